@@ -25,9 +25,93 @@ queue_names= <value>
 *How often to run the MQ input script
 mqinput_interval= <value>
 
-*Keep the MQ connection open
+*Keep the MQ connection open.  With 0 the connection is returned to the connection pool after every polling interval and stays open until it has been idle for connection_idle_timeout seconds.
 persistent_connection= <value>
 
+*Keep the queues open and wait in MQGET for messages to arrive instead of polling at the mqinput_interval.  Default 0.
+use_mqget_wait= <value>
+
+*How long MQGET waits for a message in milliseconds when use_mqget_wait is set.  Shared between the queues of a process.  Default 5000.
+mqget_wait_interval= <value>
+
+*Get up to this many messages under syncpoint and commit them only after they have been written to Splunk (at-least-once delivery).  Default 1 (no batching).
+mqget_batch_size= <value>
+
+*Maximum time in milliseconds spent filling a batch when mqget_batch_size is greater than 1.  Default 1000.
+mqget_batch_interval= <value>
+
+*Move a message to backout_queue, or discard it, once it has been backed out this many times because the response handler failed.  0 retries it forever.  Default 3.
+backout_threshold= <value>
+
+*Queue the messages that reached backout_threshold are moved to.  Default not set (discarded).
+backout_queue= <value>
+
+*Maximum number of queue manager connections shared by the threads of this input.  With use_mqget_wait it must be at least the number of getter threads (autoscale_max_threads per queue plus 1 with autoscale) and is raised to that otherwise.  Default 0 (unbounded).
+connection_pool_size= <value>
+
+*Disconnect pooled connections that have not been used for this many seconds.  Set it lower than mqinput_interval to disconnect between polling intervals when persistent_connection is 0.  Default 300.
+connection_idle_timeout= <value>
+
+*Maximum number of seconds to wait between reconnect attempts.  Default 60.
+reconnect_backoff_max= <value>
+
+*Inquire the queue depths with one PCF command and only poll the queues that have messages.  Poll every adaptive_min_interval seconds while there are messages and back off up to mqinput_interval.  Default 0.
+adaptive_polling= <value>
+
+*Polling interval in seconds while the queues have messages when adaptive_polling is set.  Default 1.
+adaptive_min_interval= <value>
+
+*Add getter threads to a queue while it has a backlog and retire them once it is empty.  Requires start_process_per_queue.  Default 0.
+autoscale= <value>
+
+*Minimum number of getter threads per queue.  Default 1.
+autoscale_min_threads= <value>
+
+*Maximum number of getter threads per queue.  Default 4.
+autoscale_max_threads= <value>
+
+*Add a getter thread while the queue depth is at least this many messages.  Default 1000.
+autoscale_depth_threshold= <value>
+
+*Add a getter thread while the oldest message is at least this many seconds old.  Requires queue monitoring.  Default 0 (disabled).
+autoscale_age_threshold= <value>
+
+*How often in seconds the auto-scaler checks the queues.  Default 30.
+autoscale_interval= <value>
+
+*Maximum number of messages got from a queue before the next queue gets its turn.  Default 0 (until the queue is empty).
+queue_quantum_messages= <value>
+
+*Maximum number of milliseconds spent getting messages from a queue in one turn.  Default 0 (no limit).
+queue_quantum_ms= <value>
+
+*Give deeper queues a bigger queue_quantum_messages in proportion to their depth.  Default 0.
+queue_depth_weighting= <value>
+
+*Number of threads that call the response handler while the poller threads keep getting messages.  Default 0 (the poller threads call the response handler).
+render_workers= <value>
+
+*Maximum number of messages waiting for a render worker.  Default 1000.
+handoff_queue_size= <value>
+
+*Maximum number of bytes of the messages waiting for a render worker.  Default 67108864.
+handoff_queue_bytes= <value>
+
+*Number of events written to Splunk in one stream.  Default 100.
+output_buffer_events= <value>
+
+*Write the buffered events once they are this many bytes.  Default 1048576.
+output_buffer_bytes= <value>
+
+*Maximum number of milliseconds an event is buffered before it is written.  Default 500.
+output_flush_interval= <value>
+
+*Level of the messages logged to splunkd.log.  DEBUG, INFO, WARNING or ERROR.  Default INFO.
+log_level= <value>
+
+*Log the details and response handler time of every nth message at INFO level.  Default 0 (disabled).
+trace_sample_rate= <value>
+
 *Whether to start a process dedicated per queue or whether to start a process that will service all queues sequentialy.
 start_process_per_queue= <value>
 
@@ -37,6 +121,9 @@ start_multiple_processes= <value>
 *Number of processes to start.  Default 1.  
 start_number_of_processes= <value>
 
+*Start start_number_of_processes worker processes instead of threads.  Default 0.
+use_worker_processes= <value>
+
 *Python classname of custom response handler
 response_handler= <value>
 
@@ -74,6 +161,33 @@ mqchs_interval= <value>
 *Keep the MQ connection open
 persistent_connection= <value>
 
+*Maximum number of queue manager connections shared by the threads of this input.  Default 0 (unbounded).
+connection_pool_size= <value>
+
+*Number of connections used to inquire the channel status in parallel.  Default 1.
+channel_status_workers= <value>
+
+*Inquire channel names that share their first qualifier with one generic name when there are at least this many of them.  Default 0 (disabled).
+coalesce_min_channels= <value>
+
+*Disconnect pooled connections that have not been used for this many seconds.  Default 300.
+connection_idle_timeout= <value>
+
+*Maximum number of seconds to wait between reconnect attempts.  Default 60.
+reconnect_backoff_max= <value>
+
+*Number of events written to Splunk in one stream.  Default 100.
+output_buffer_events= <value>
+
+*Write the buffered events once they are this many bytes.  Default 1048576.
+output_buffer_bytes= <value>
+
+*Maximum number of milliseconds an event is buffered before it is written.  Default 500.
+output_flush_interval= <value>
+
+*Level of the messages logged to splunkd.log.  DEBUG, INFO, WARNING or ERROR.  Default INFO.
+log_level= <value>
+
 *Python classname of custom response handler
 response_handler= <value>
 
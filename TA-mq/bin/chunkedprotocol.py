@@ -0,0 +1,189 @@
+'''
+IBM Websphere MQ Modular Input for Splunk
+Hannes Wagener - 2015
+
+The chunked (version 2) custom search command protocol used by the
+getbrkevt and getbrkerrs search commands.  Splunk sends the search results
+in CSV chunks and every chunk is answered as soon as it is processed, so
+only one chunk is in memory and the first results are shown immediately.
+
+DISCLAIMER
+You are free to use this code in any way you like, subject to the
+Python & IBM disclaimers & copyrights. I make no representations
+about the suitability of this software for any purpose. It is
+provided "AS-IS" without warranty of any kind, either express or
+implied.
+
+'''
+from __future__ import print_function
+
+import csv
+import io
+import json
+import re
+import sys
+
+
+PY2 = sys.version_info[0] == 2
+
+CHUNK_HEADER_RE = re.compile(br"chunked\s+1\.0\s*,\s*(\d+)\s*,\s*(\d+)\s*\n")
+
+# the payload fields can be much bigger than the csv module allows.
+csv.field_size_limit(2147483647)
+
+
+def read_exactly(stream, length):
+    data = b""
+    while len(data) < length:
+        part = stream.read(length - len(data))
+        if not part:
+            raise EOFError("Chunk ended after %i of %i bytes." %
+                           (len(data), length))
+        data = data + part
+    return data
+
+
+def read_chunk(stream):
+    '''Return the (metadata, body) of the next chunk or None at the end of
+    the input.
+    '''
+    header = stream.readline()
+    if not header:
+        return None
+
+    match = CHUNK_HEADER_RE.match(header)
+    if match is None:
+        raise ValueError("Invalid chunk header: %r" % header[:64])
+
+    metadata = json.loads(
+        read_exactly(stream, int(match.group(1))).decode("utf-8"))
+    body = read_exactly(stream, int(match.group(2))).decode("utf-8")
+    return (metadata, body)
+
+
+def write_chunk(stream, metadata, body=""):
+    metadata = json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+    body = body.encode("utf-8")
+    stream.write(("chunked 1.0,%i,%i\n" % (len(metadata), len(body)))
+                 .encode("ascii"))
+    stream.write(metadata)
+    stream.write(body)
+    stream.flush()
+
+
+def read_results(body):
+    '''Return the (field names, results) of a CSV chunk body.  Every
+    result is a dict.
+    '''
+    if not body:
+        return ([], [])
+
+    if PY2:
+        # the python 2 csv module only reads byte strings.
+        reader = ([value.decode("utf-8") for value in row] for row in
+                  csv.reader(io.BytesIO(body.encode("utf-8"))))
+    else:
+        reader = csv.reader(io.StringIO(body, newline=""))
+    fields = next(reader, [])
+    return (fields, [dict(zip(fields, row)) for row in reader])
+
+
+def text_value(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+def csv_value(value):
+    # the python 2 csv module only writes byte strings.
+    value = text_value(value)
+    if PY2 and not isinstance(value, bytes) and hasattr(value, "encode"):
+        return value.encode("utf-8")
+    return value
+
+
+def format_results(fields, results):
+    '''Return the results as a CSV chunk body.  Fields added to the results
+    follow the fields of the input and bytes values are decoded as UTF-8.
+    '''
+    if not results:
+        return ""
+
+    fields = list(fields)
+    known = set(fields)
+    for res in results:
+        for field in res:
+            if field not in known:
+                fields.append(field)
+                known.add(field)
+
+    if PY2:
+        out = io.BytesIO()
+    else:
+        out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow([csv_value(field) for field in fields])
+    for res in results:
+        writer.writerow([csv_value(res.get(field, "")) for field in fields])
+    return text_value(out.getvalue())
+
+
+def error_metadata(text):
+    return {"finished": True, "inspector": {"messages": [["ERROR", text]]}}
+
+
+def run_chunked_command(process, parse_args=None, command_type="stateful",
+                        stdin=None, stdout=None):
+    '''Run a search command with the chunked protocol until Splunk sends
+    the last chunk.
+
+    parse_args(args) - Called with the search command arguments.  Raising
+    ValueError rejects the arguments with the exception text.
+    process(results, messages) - Called with the list of results of every
+    chunk and returns the results to send back.  Append (level, text)
+    tuples to messages to show them in the search job inspector.
+    command_type - "stateful" keeps the command on the search head, which
+    has the payload files.
+    '''
+    # python 2 reads and writes bytes on sys.stdin and sys.stdout.
+    if stdin is None:
+        stdin = getattr(sys.stdin, "buffer", sys.stdin)
+    if stdout is None:
+        stdout = getattr(sys.stdout, "buffer", sys.stdout)
+
+    chunk = read_chunk(stdin)
+    if chunk is None:
+        return
+    (metadata, body) = chunk
+
+    if parse_args is not None:
+        try:
+            parse_args(metadata.get("searchinfo", {}).get("args", []))
+        except ValueError as ex:
+            write_chunk(stdout, error_metadata(str(ex)))
+            return
+
+    write_chunk(stdout, {"type": command_type})
+
+    while True:
+        chunk = read_chunk(stdin)
+        if chunk is None:
+            break
+        (metadata, body) = chunk
+        finished = bool(metadata.get("finished", False))
+
+        (fields, results) = read_results(body)
+        messages = []
+        try:
+            results = process(results, messages)
+        except Exception as ex:
+            messages.append(("ERROR", "Exception occurred.  " + str(ex)))
+
+        reply = {"finished": finished}
+        if messages:
+            reply["inspector"] = {"messages": [[level, text] for
+                                               (level, text) in messages]}
+        write_chunk(stdout, reply, format_results(fields, results))
+
+        if finished:
+            break
@@ -0,0 +1,339 @@
+'''
+IBM Websphere MQ Modular Input for Splunk
+Hannes Wagener - 2015
+
+Queue manager connection pool shared by the pollers of a modular input.
+
+DISCLAIMER
+You are free to use this code in any way you like, subject to the
+Python & IBM disclaimers & copyrights. I make no representations
+about the suitability of this software for any purpose. It is
+provided "AS-IS" without warranty of any kind, either express or
+implied.
+
+'''
+from __future__ import print_function
+
+import logging
+import threading
+import time
+
+import pymqi
+from pymqi import CMQC as CMQC
+
+
+# Reason codes that mean a connection can not be used any more.
+CONNECTION_BROKEN_REASONS = (CMQC.MQRC_CONNECTION_BROKEN,
+                             CMQC.MQRC_HCONN_ERROR,
+                             CMQC.MQRC_Q_MGR_NOT_AVAILABLE,
+                             CMQC.MQRC_Q_MGR_QUIESCING,
+                             CMQC.MQRC_Q_MGR_STOPPING,
+                             CMQC.MQRC_CONNECTION_QUIESCING,
+                             CMQC.MQRC_CONNECTION_STOPPING)
+
+
+# Reason codes that mean an open queue handle can not be used any more.
+QUEUE_HANDLE_BROKEN_REASONS = (CMQC.MQRC_HOBJ_ERROR,
+                               CMQC.MQRC_OBJECT_CHANGED,
+                               CMQC.MQRC_Q_DELETED)
+
+
+def is_connection_broken(ex):
+    '''Return true if the exception ex means the connection is unusable.
+    '''
+    return isinstance(ex, pymqi.MQMIError) and \
+        ex.reason in CONNECTION_BROKEN_REASONS
+
+
+def is_queue_handle_broken(ex):
+    '''Return true if the exception ex means the queue must be reopened.
+    '''
+    return isinstance(ex, pymqi.MQMIError) and \
+        ex.reason in QUEUE_HANDLE_BROKEN_REASONS
+
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode("ascii")
+
+
+class PooledConnection(object):
+    """
+    A queue manager connection owned by a ConnectionPool.  The pymqi
+    QueueManager is available as the "qm" attribute.  Queues opened through
+    open_queue stay open for as long as the connection is pooled.
+    """
+
+    def __init__(self, pool, key, qm):
+        self.pool = pool
+        self.key = key
+        self.qm = qm
+        self.created = time.time()
+        self.last_used = self.created
+        self.queues = {}
+
+    def open_queue(self, queue_name, options):
+        """Return the cached handle for the queue, opening it if needed."""
+        queue = self.queues.get((queue_name, options))
+        if queue is None:
+            queue = pymqi.Queue(self.qm, queue_name, options)
+            self.queues[(queue_name, options)] = queue
+            self.pool._queue_opened(self.key, queue_name)
+        return queue
+
+    def discard_queue(self, queue_name):
+        """Forget the handles for a queue after a handle related error so
+        that the next open_queue reopens it.
+        """
+        for (name, options) in list(self.queues.keys()):
+            if name == queue_name:
+                queue = self.queues.pop((name, options))
+                try:
+                    queue.close()
+                except Exception:
+                    pass
+
+    def is_healthy(self):
+        try:
+            return self.qm._is_connected()
+        except:
+            return False
+
+    def close(self):
+        # disconnecting closes any open queue handles.
+        self.queues = {}
+        try:
+            self.qm.disconnect()
+        except Exception as ex:
+            logging.debug("Exception while disconnecting pooled connection: %s",
+                          ex)
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of queue manager connections keyed by
+    (queue manager, host, port, channel, user).
+
+    max_connections - Maximum number of connections per key.  0 is unbounded.
+    idle_timeout - Disconnect connections that have not been used for this
+    many seconds.
+    max_backoff - Maximum number of seconds to wait between reconnect
+    attempts after connecting failed.
+    health_check_interval - Ping connections that have been idle for longer
+    than this many seconds before handing them out again.
+    stop_event - threading.Event that aborts waiting for a connection.
+    """
+
+    def __init__(self, max_connections=0, idle_timeout=300, max_backoff=60,
+                 health_check_interval=30, stop_event=None):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.max_backoff = max_backoff
+        self.health_check_interval = health_check_interval
+        if stop_event is None:
+            stop_event = threading.Event()
+        self.stop_event = stop_event
+
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._in_use = {}
+        self._failures = {}
+        self._next_attempt = {}
+
+        self._opened_queues = set()
+        self.queue_open_count = 0
+        self.queue_reopen_count = 0
+
+    def acquire(self, queue_manager_name, host, port, channel, user="",
+                password=""):
+        """Borrow a connection.  Reuses an idle connection if possible,
+        otherwise connects once the pool has room for another connection
+        and any reconnect backoff has expired.
+
+        Returns None if the stop event was set while waiting.
+        """
+        key = (queue_manager_name, host, port, channel, user)
+
+        while not self.stop_event.is_set():
+            candidates = []
+            backoff = 0
+            self._cond.acquire()
+            try:
+                expired = self._evict_idle()
+                idle = self._idle.get(key, [])
+                if idle:
+                    conn = idle.pop()
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    candidates.append(conn)
+                elif self.max_connections <= 0 or \
+                        self._in_use.get(key, 0) < self.max_connections:
+                    backoff = self._next_attempt.get(key, 0) - time.time()
+                    if backoff <= 0:
+                        self._in_use[key] = self._in_use.get(key, 0) + 1
+                else:
+                    # the pool is full. wait for a connection to be released.
+                    self._cond.wait(1.0)
+                    continue
+            finally:
+                self._cond.release()
+
+            for conn in expired:
+                conn.close()
+
+            if candidates:
+                conn = candidates[0]
+                if time.time() - conn.last_used < self.health_check_interval \
+                   or conn.is_healthy():
+                    return conn
+                logging.info("Discarding unhealthy connection to %s." %
+                             str(queue_manager_name))
+                conn.close()
+                self._release_slot(key)
+                continue
+
+            if backoff > 0:
+                self.stop_event.wait(min(backoff, 1.0))
+                continue
+
+            try:
+                qm = self._connect(queue_manager_name, host, port, channel,
+                                   user, password)
+            except:
+                self._release_slot(key)
+                self._record_failure(key)
+                raise
+
+            self._cond.acquire()
+            try:
+                self._failures.pop(key, None)
+                self._next_attempt.pop(key, None)
+            finally:
+                self._cond.release()
+
+            return PooledConnection(self, key, qm)
+
+        return None
+
+    def release(self, conn, broken=False):
+        """Return a borrowed connection to the pool.  Broken connections
+        are disconnected instead of being reused.
+        """
+        if conn is None:
+            return
+
+        if broken:
+            conn.close()
+            self._release_slot(conn.key)
+            return
+
+        self._cond.acquire()
+        try:
+            conn.last_used = time.time()
+            self._in_use[conn.key] = max(0, self._in_use.get(conn.key, 1) - 1)
+            self._idle.setdefault(conn.key, []).append(conn)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def stats(self):
+        """Return a dict of the pool counters."""
+        self._cond.acquire()
+        try:
+            return {"connections_in_use": sum(self._in_use.values()),
+                    "connections_idle": sum([len(c) for c in
+                                             self._idle.values()]),
+                    "queue_opens": self.queue_open_count,
+                    "queue_reopens": self.queue_reopen_count}
+        finally:
+            self._cond.release()
+
+    def close_all(self):
+        """Disconnect all idle connections."""
+        self._cond.acquire()
+        try:
+            idle = [c for conns in self._idle.values() for c in conns]
+            self._idle = {}
+        finally:
+            self._cond.release()
+
+        for conn in idle:
+            conn.close()
+
+    def _connect(self, queue_manager_name, host, port, channel, user,
+                 password):
+        cd = pymqi.cd()
+        #set the max message length to maximum
+        cd["MaxMsgLength"] = 104857600
+        cd["ChannelName"] = to_bytes(channel)
+        cd["ConnectionName"] = to_bytes("%s(%i)" % (str(host).strip(), port))
+        cd["ChannelType"] = CMQC.MQCHT_CLNTCONN
+        cd["TransportType"] = CMQC.MQXPT_TCP
+
+        logging.debug("Connecting to %s using channel %s and address %s(%i).",
+                      queue_manager_name, channel, host, port)
+
+        qm = pymqi.QueueManager(None)
+        # the connection may be used by a different thread every time it is
+        # borrowed from the pool.
+        qm.connect_with_options(queue_manager_name, cd=cd,
+                                opts=CMQC.MQCNO_HANDLE_SHARE_BLOCK,
+                                user=user, password=password)
+
+        logging.debug("Successfully Connected to %s using channel %s and "
+                      "address %s(%i).", queue_manager_name, channel, host,
+                      port)
+        return qm
+
+    def _queue_opened(self, key, queue_name):
+        self._cond.acquire()
+        try:
+            self.queue_open_count = self.queue_open_count + 1
+            reopened = (key, queue_name) in self._opened_queues
+            if reopened:
+                self.queue_reopen_count = self.queue_reopen_count + 1
+            else:
+                self._opened_queues.add((key, queue_name))
+            reopen_count = self.queue_reopen_count
+        finally:
+            self._cond.release()
+
+        if reopened:
+            logging.info("Reopened queue %s on %s. queue_reopens=%i" %
+                         (queue_name, key[0], reopen_count))
+
+    def _release_slot(self, key):
+        self._cond.acquire()
+        try:
+            self._in_use[key] = max(0, self._in_use.get(key, 1) - 1)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _record_failure(self, key):
+        self._cond.acquire()
+        try:
+            failures = self._failures.get(key, 0) + 1
+            self._failures[key] = failures
+            delay = min(self.max_backoff, 2 ** (failures - 1))
+            self._next_attempt[key] = time.time() + delay
+        finally:
+            self._cond.release()
+
+        logging.info("Connecting to %s failed %i time(s). Next attempt in %i "
+                     "seconds." % (key[0], failures, delay))
+
+    def _evict_idle(self):
+        # must be called with the lock held. returns the evicted connections
+        # so they can be disconnected outside the lock.
+        expired = []
+        now = time.time()
+        for key, conns in list(self._idle.items()):
+            keep = [c for c in conns if now - c.last_used < self.idle_timeout]
+            expired.extend([c for c in conns
+                            if now - c.last_used >= self.idle_timeout])
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        return expired
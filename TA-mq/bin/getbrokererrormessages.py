@@ -17,22 +17,13 @@ from __future__ import print_function
 
 import csv
 import sys
-import splunk.Intersplunk
 import string
-import os
-import gzip
+import re
 import binascii
-import base64
-import zlib
-
-MONGO_SUPPORTED = False
-try:
-    import pymongo
-    import bson
-    MONGO_SUPPORTED = True
-except:
-    pass
-    
+
+from chunkedprotocol import run_chunked_command
+from payloadstore import ArchiveReader, connect_mongodb, fetch_mongodb_payloads
+
 
 MONGODB_HOST = "127.0.0.1"
 MONGODB_PORT = 27017
@@ -43,130 +34,118 @@ MONGODB_AUTH_DB = ""
 MONGODB_USE_AUTH = False
 
 
-mongodb_client = None
-mongodb_db = None
-
-(isgetinfo, sys.argv) = splunk.Intersplunk.isGetInfo(sys.argv)
-
-if isgetinfo:
-    splunk.Intersplunk.outputInfo(True, False, True, False, None, True)
-
-if len(sys.argv) > 7:
-    splunk.Intersplunk.parseError("Too many arguments provided.")
-
-
 valid_parms = ["includeblob", "bloblimit", "dontfixpdgheader", "extractblob", "excludepayload", "convertblob", "extractbloblimit"]
 
-i = 1
 parm_dict = {}
-while i < len(sys.argv):
-    arg = sys.argv[i]
 
-    if arg.count("=") == 1:
-        (parm, value) = arg.split("=")
-        if parm not in valid_parms:
-            splunk.Intersplunk.parseError("Invalid argument. Valid options are includeblob/dontfixpdgheader/extractblob/excludepayload/convertblob=<true|false> bloblimit/extractbloblimit=<integer>")
+def parse_args(args):
+    '''Parse the search command arguments into parm_dict.
+    '''
+    if len(args) > 6:
+        raise ValueError("Too many arguments provided.")
 
-        if parm == "bloblimit" or parm == "extractbloblimit":
-            try:
-                int(value.strip())
-            except:
-                splunk.Intersplunk.parseError("Invalid argument vale for bloblimit or extractbloblimit.  Must be an integer value.")
+    for arg in args:
 
-        if parm == "includeblob" or parm == "dontfixpdgheader" or parm == "extractblob" or parm == "excludepayload" or parm == "convertblob":
-            if value.strip().lower() != "true" and value.strip().lower() != "false":
-                splunk.Intersplunk.parseError("Invalid argument value for includeblob, extractblob or dontfixpdg.  Must be either true or false")
+        if arg.count("=") == 1:
+            (parm, value) = arg.split("=")
+            if parm not in valid_parms:
+                raise ValueError("Invalid argument. Valid options are includeblob/dontfixpdgheader/extractblob/excludepayload/convertblob=<true|false> bloblimit/extractbloblimit=<integer>")
 
-        parm_dict[parm] = value
+            if parm == "bloblimit" or parm == "extractbloblimit":
+                try:
+                    int(value.strip())
+                except:
+                    raise ValueError("Invalid argument vale for bloblimit or extractbloblimit.  Must be an integer value.")
 
-    else:
-        if arg.count("=") > 1 or arg.count("=") <= 0:
-            splunk.Intersplunk.parseError("Invalid argument. Valid options are includeblob/dontfixpdgheader/extractblob/excludepayload/convertblob=<true|false> bloblimit/extractbloblimit=<integer>")
+            if parm == "includeblob" or parm == "dontfixpdgheader" or parm == "extractblob" or parm == "excludepayload" or parm == "convertblob":
+                if value.strip().lower() != "true" and value.strip().lower() != "false":
+                    raise ValueError("Invalid argument value for includeblob, extractblob or dontfixpdg.  Must be either true or false")
 
-    i = i + 1
-    # outputInfo automatically calls sys.exit()
+            parm_dict[parm] = value
 
-#print "after outputinfo"
-results = splunk.Intersplunk.readResults(None, None, True)
-messages = {}
+        else:
+            if arg.count("=") > 1 or arg.count("=") <= 0:
+                raise ValueError("Invalid argument. Valid options are includeblob/dontfixpdgheader/extractblob/excludepayload/convertblob=<true|false> bloblimit/extractbloblimit=<integer>")
 
-def isPrintable(char):
-    '''Return true if the character char is printable or false if it is not printable.
-    '''
-    if string.printable.count(char) > 0:
-        return True
-    else:
-        return False
+# maps every byte that is not in string.printable to '.'
+PRINTABLE_TABLE = bytes(bytearray([c if chr(c) in string.printable else ord('.') for c in range(256)]))
+NON_PRINTABLE_RE = re.compile("[^%s]" % re.escape(string.printable))
 
 def makePrintable(instr):
     '''Return a printable representation of the string instr.
     '''
-    retstr = ''
-    for char in instr:
-        if not isPrintable(char):
-            retstr = retstr + '.'
-        else:
-            retstr = retstr + char
-    return retstr
-
-def get_msg_from_mongodb(mongodb_db, mongodb_collection, msg_id):
-
-    if mongodb_db is None:
-        #sys.stderr.write("Mongodb db none?")
-        return None
-
-    if msg_id is None:
-        return None
-    else:
-        if len(msg_id) != 24:
-            #splunk.Intersplunk.addWarnMessage(messages, "Msg id not 24 bytes?: %s" % (str(msg_id)))
-            return None
+    if isinstance(instr, (bytes, bytearray)):
+        return instr.translate(PRINTABLE_TABLE).decode("ascii")
 
     try:
+        return instr.encode("latin-1").translate(PRINTABLE_TABLE).decode("ascii")
+    except UnicodeEncodeError:
+        # characters above U+00FF are never printable.
+        return NON_PRINTABLE_RE.sub(".", instr)
 
-        msg_doc = mongodb_db[mongodb_collection].find_one({"_id": bson.objectid.ObjectId(msg_id)})
-        uncomp_msg_data = ""
+def archive_locator(res):
+    '''Return the payload archive locator of a search result or None.
+    '''
+    if "message_segment" in res and "message_offset" in res and "message_length" in res:
+        try:
+            return (res["message_segment"], int(res["message_offset"]), int(res["message_length"]))
+        except ValueError:
+            return None
 
-        if msg_doc is not None:
-            if "msg_data" in msg_doc:
-                msg_data = msg_doc["msg_data"]
+    if "message_file_name" in res:
+        return (res["message_file_name"],)
 
-                #uncomp_msg_data = zlib.decompress(base64.decodestring(msg_data), -15)
-                uncomp_msg_data = zlib.decompress(base64.decodestring(msg_data))
-            return uncomp_msg_data
+    return None
 
-    except Exception as ex:
-        sys.stderr.write("Exception while fetching message. Exception: %s\n" % (str(ex)))
-        #splunk.Intersplunk.addMessage(messages, "Exception while fetching message from mongodb message. Exception: %s" % (str(ex)))
-        pass
+def mongodb_locator(res):
+    '''Return the (collection, mongoid) of a search result or None.
+    '''
+    if "collection" in res and "mongoid" in res:
+        return (res["collection"], res["mongoid"])
 
     return None
 
-for res in results:
+# shared by all the chunks so payloads are cached between chunks.
+archive_reader = ArchiveReader()
+mongodb_db = None
 
-    try:
-        msg_data = ""
-        if "message_file_name" in res:
+def process_results(results, messages):
+    '''Add the payloads to one chunk of search results.
+    '''
+    global mongodb_db
 
-            if os.path.exists(res["message_file_name"]):
-                msg_file = open(res["message_file_name"], "r")
-                msg_data = msg_file.read()
-                msg_file.close()
+    # read the payloads of all the results of the chunk at once.
+    payloads = archive_reader.read([archive_locator(res) for res in results])
 
-            else:
-                if os.path.exists(res["message_file_name"] + ".gz"):
-                    msg_file = gzip.open(res["message_file_name"] + ".gz", "rb")
-                    msg_data = msg_file.read()
-                    msg_file.close()
-
-        if "collection" in res and "mongoid" in res:
-            if mongodb_client is None:
-                mongodb_client = pymongo.MongoClient(MONGODB_HOST, MONGODB_PORT)
-                mongodb_db = mongodb_client[MONGODB_DB_NAME]
+    mongodb_keys = [mongodb_locator(res) for res in results]
+    mongodb_payloads = [None] * len(results)
+    if [key for key in mongodb_keys if key is not None]:
+        try:
+            if mongodb_db is None:
+                mongodb_db = connect_mongodb(MONGODB_HOST, MONGODB_PORT, MONGODB_DB_NAME)
                 if MONGODB_USE_AUTH:
                     mongodb_db.authenticate(MONGODB_USER, MONGODB_PASSWORD, source=MONGODB_AUTH_DB)
 
-            msg_data = get_msg_from_mongodb(mongodb_db, res["collection"], res["mongoid"])
+            mongodb_payloads = fetch_mongodb_payloads(mongodb_db, mongodb_keys)
+        except Exception as ex:
+            messages.append(("ERROR", "Exception while fetching messages from mongodb.  " + str(ex)))
+
+    for (res, payload, mongodb_key, mongodb_payload) in zip(results, payloads, mongodb_keys, mongodb_payloads):
+        process_result(res, payload, mongodb_key, mongodb_payload, messages)
+
+    return results
+
+def process_result(res, payload, mongodb_key, mongodb_payload, messages):
+
+    try:
+        msg_data = ""
+        if payload is not None:
+            msg_data = payload.decode("utf-8", "replace")
+
+        if mongodb_key is not None:
+            msg_data = ""
+            if mongodb_payload is not None:
+                msg_data = mongodb_payload.decode("utf-8", "replace")
 
         if msg_data != "":
 
@@ -222,7 +201,7 @@ for res in results:
                         if xsi_end > 0:
                             new_msg_data = new_msg_data[:xsi_start] + new_msg_data[xsi_end + 12:]
                         else:
-                            splunk.Intersplunk.addWarnMessage(messages, "Weird.  No close tag for pdg xmlns xsi issue.")
+                            messages.append(("WARN", "Weird.  No close tag for pdg xmlns xsi issue."))
                     else:
                         done = True
 
@@ -302,7 +281,6 @@ for res in results:
 
 
     except Exception as ex:
-        splunk.Intersplunk.addErrorMessage(messages, "Exception occurred.  " + str(ex))
-
+        messages.append(("ERROR", "Exception occurred.  " + str(ex)))
 
-splunk.Intersplunk.outputResults(results, messages=messages)
+run_chunked_command(process_results, parse_args)
@@ -17,24 +17,14 @@ implied.
 from __future__ import print_function
 
 import csv
-import sys
-import splunk.Intersplunk
 import string
-import os
-import gzip
+import re
 import binascii
-import zlib
 import base64
 
+from chunkedprotocol import run_chunked_command
+from payloadstore import ArchiveReader, connect_mongodb, fetch_mongodb_payloads
 
-MONGO_SUPPORTED = False
-try:
-    import pymongo
-    import bson
-    MONGO_SUPPORTED = True
-except:
-    pass
-    
 
 MONGODB_HOST = "127.0.0.1"
 MONGODB_PORT = 27017
@@ -44,122 +34,113 @@ MONGODB_PASSWORD = ""
 MONGODB_AUTH_DB = ""
 MONGODB_USE_AUTH = False
 
-mongodb_client = None
-mongodb_db = None
-
-(isgetinfo, sys.argv) = splunk.Intersplunk.isGetInfo(sys.argv)
-
-if isgetinfo:
-    splunk.Intersplunk.outputInfo(True, False, True, False, None, True)
-
-if len(sys.argv) > 4:
-    splunk.Intersplunk.parseError("Too many arguments provided.")
-
 
 valid_parms = ["excludeevent", "includebitstream", "extractbitstream", "decodebitstream", "convertbitstream"]
 
-i = 1
 parm_dict = {}
-while i < len(sys.argv):
-    arg = sys.argv[i]
 
-    if arg.count("=") == 1:
-        (parm, value) = arg.split("=")
-        if parm not in valid_parms:
-            splunk.Intersplunk.parseError("Invalid argument. Valid options are includebitstream/extractbitstream/decodebitstream/convertbitstream=<true|false>")
-
-        if parm == "includebitstream" or parm == "convertbitstream" or parm == "decodebitstream" or parm == "extractbitstream" or parm == "exludeevent":
-            if value.strip().lower() != "true" and value.strip().lower() != "false":
-                splunk.Intersplunk.parseError("Invalid argument value for excludeevent or includebitstream or extractbitstream or decodebitstream or convertbitstream. ")
+def parse_args(args):
+    '''Parse the search command arguments into parm_dict.
+    '''
+    if len(args) > 3:
+        raise ValueError("Too many arguments provided.")
 
-        parm_dict[parm] = value
+    for arg in args:
 
-    else:
-        if arg.count("=") > 1 or arg.count("=") <= 0:
-            splunk.Intersplunk.parseError("Invalid argument. Valid options are includebitstream/extractbitstream/decodebitstream/convertbitstream=<true|false>")
+        if arg.count("=") == 1:
+            (parm, value) = arg.split("=")
+            if parm not in valid_parms:
+                raise ValueError("Invalid argument. Valid options are includebitstream/extractbitstream/decodebitstream/convertbitstream=<true|false>")
 
-    i = i + 1
-    # outputInfo automatically calls sys.exit()
+            if parm == "includebitstream" or parm == "convertbitstream" or parm == "decodebitstream" or parm == "extractbitstream" or parm == "exludeevent":
+                if value.strip().lower() != "true" and value.strip().lower() != "false":
+                    raise ValueError("Invalid argument value for excludeevent or includebitstream or extractbitstream or decodebitstream or convertbitstream. ")
 
-#print "after outputinfo"
+            parm_dict[parm] = value
 
-results = splunk.Intersplunk.readResults(None, None, True)
-messages = {}
+        else:
+            if arg.count("=") > 1 or arg.count("=") <= 0:
+                raise ValueError("Invalid argument. Valid options are includebitstream/extractbitstream/decodebitstream/convertbitstream=<true|false>")
 
-def isPrintable(char):
-    '''Return true if the character char is printable or false if it is not printable.
-    '''
-    if string.printable.count(char) > 0:
-        return True
-    else:
-        return False
+# maps every byte that is not in string.printable to '.'
+PRINTABLE_TABLE = bytes(bytearray([c if chr(c) in string.printable else ord('.') for c in range(256)]))
+NON_PRINTABLE_RE = re.compile("[^%s]" % re.escape(string.printable))
 
 def makePrintable(instr):
     '''Return a printable representation of the string instr.
     '''
-    retstr = ''
-    for char in instr:
-        if not isPrintable(char):
-            retstr = retstr + '.'
-        else:
-            retstr = retstr + char
-    return retstr
-
-def get_msg_from_mongodb(mongodb_db, mongodb_collection, msg_id):
-
-    if mongodb_db is None:
-        #sys.stderr.write("Mongodb db none?")
-        return None
-
-    if msg_id is None:
-        return None
-    else:
-        if len(msg_id) != 24:
-            #splunk.Intersplunk.addWarnMessage(messages, "Msg id not 24 bytes?: %s" % (str(msg_id)))
-            return None
+    if isinstance(instr, (bytes, bytearray)):
+        return instr.translate(PRINTABLE_TABLE).decode("ascii")
 
     try:
+        return instr.encode("latin-1").translate(PRINTABLE_TABLE).decode("ascii")
+    except UnicodeEncodeError:
+        # characters above U+00FF are never printable.
+        return NON_PRINTABLE_RE.sub(".", instr)
 
-        msg_doc = mongodb_db[mongodb_collection].find_one({"_id": bson.objectid.ObjectId(msg_id)})
+def archive_locator(res):
+    '''Return the payload archive locator of a search result or None.
+    '''
+    if "event_segment" in res and "event_offset" in res and "event_length" in res:
+        try:
+            return (res["event_segment"], int(res["event_offset"]), int(res["event_length"]))
+        except ValueError:
+            return None
 
-        if msg_doc is not None:
-            msg_data = msg_doc["msg_data"]
+    if "event_file_name" in res:
+        return (res["event_file_name"],)
 
-            uncomp_msg_data = zlib.decompress(base64.decodestring(msg_data))
-            return uncomp_msg_data
+    return None
 
-    except Exception as ex:
-        sys.stderr.write("Exception while fetching message. Exception: %s\n" % (str(ex)))
-        #splunk.Intersplunk.addMessage(messages, "Exception while fetching message from mongodb message. Exception: %s" % (str(ex)))
-        pass
+def mongodb_locator(res):
+    '''Return the (collection, mongoid) of a search result or None.
+    '''
+    if "collection" in res and "mongoid" in res:
+        return (res["collection"], res["mongoid"])
 
     return None
 
-for res in results:
+# shared by all the chunks so payloads are cached between chunks.
+archive_reader = ArchiveReader()
+mongodb_db = None
 
-    try:
-        msg_data = ""
-        if "event_file_name" in res:
+def process_results(results, messages):
+    '''Add the payloads to one chunk of search results.
+    '''
+    global mongodb_db
 
-            if os.path.exists(res["event_file_name"]):
-                msg_file = open(res["event_file_name"], "r")
-                msg_data = msg_file.read()
-                msg_file.close()
+    # read the payloads of all the results of the chunk at once.
+    payloads = archive_reader.read([archive_locator(res) for res in results])
 
-            else:
-                if os.path.exists(res["event_file_name"] + ".gz"):
-                    msg_file = gzip.open(res["event_file_name"] + ".gz", "rb")
-                    msg_data = msg_file.read()
-                    msg_file.close()
-
-        if "collection" in res and "mongoid" in res:
-            if mongodb_client is None:
-                mongodb_client = pymongo.MongoClient(MONGODB_HOST, MONGODB_PORT)
-                mongodb_db = mongodb_client[MONGODB_DB_NAME]
+    mongodb_keys = [mongodb_locator(res) for res in results]
+    mongodb_payloads = [None] * len(results)
+    if [key for key in mongodb_keys if key is not None]:
+        try:
+            if mongodb_db is None:
+                mongodb_db = connect_mongodb(MONGODB_HOST, MONGODB_PORT, MONGODB_DB_NAME)
                 if MONGODB_USE_AUTH:
                     mongodb_db.authenticate(MONGODB_USER, MONGODB_PASSWORD, source=MONGODB_AUTH_DB)
 
-            msg_data = get_msg_from_mongodb(mongodb_db, res["collection"], res["mongoid"])
+            mongodb_payloads = fetch_mongodb_payloads(mongodb_db, mongodb_keys)
+        except Exception as ex:
+            messages.append(("ERROR", "Exception while fetching messages from mongodb.  " + str(ex)))
+
+    for (res, payload, mongodb_key, mongodb_payload) in zip(results, payloads, mongodb_keys, mongodb_payloads):
+        process_result(res, payload, mongodb_key, mongodb_payload, messages)
+
+    return results
+
+def process_result(res, payload, mongodb_key, mongodb_payload, messages):
+
+    try:
+        msg_data = ""
+        if payload is not None:
+            msg_data = payload.decode("utf-8", "replace")
+
+        if mongodb_key is not None:
+            msg_data = ""
+            if mongodb_payload is not None:
+                msg_data = mongodb_payload.decode("utf-8", "replace")
 
         if msg_data != "" and msg_data is not None:
 
@@ -209,8 +190,6 @@ for res in results:
                 bs_end = msg_data.find("</wmb:bitstream>", bs_start)
 
             if bs_start > 0 and bs_end > 0:
-                bs_len = bs_end - bs_start + 1
-
                 new_msg_data = ""
                 if include_bitstream:
                     new_msg_data = msg_data
@@ -230,7 +209,7 @@ for res in results:
                                 enc = msg_data[enc_start + 14:enc_end]
 
                                 if enc == "base64Binary":
-                                    dc_bs = base64.decodestring(bitstream)
+                                    dc_bs = base64.b64decode(bitstream)
                                 else:
                                     if enc == "hexBinary":
                                         dc_bs = binascii.unhexlify(bitstream)
@@ -268,10 +247,6 @@ for res in results:
                 res["event"] = new_msg_data
 
     except Exception as ex:
-        splunk.Intersplunk.addErrorMessage(messages, "Exception occurred.  " + str(ex))
-
-splunk.Intersplunk.outputResults(results, messages=messages)
-
-
-
+        messages.append(("ERROR", "Exception occurred.  " + str(ex)))
 
+run_chunked_command(process_results, parse_args)
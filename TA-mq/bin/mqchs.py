@@ -17,23 +17,39 @@ from __future__ import print_function
 
 import os
 import sys
+import collections
 import logging
 import xml.dom.minidom
 import xml.sax.saxutils
 import time
 import threading
 import uuid
+import signal
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 import pymqi
 from pymqi import CMQC as CMQC
 
+from connectionpool import ConnectionPool, is_connection_broken
+
 SPLUNK_HOME = os.environ.get("SPLUNK_HOME")
 
 RESPONSE_HANDLER_INSTANCE = None
+EVENT_WRITER = None
+
+# Set when splunkd stops the input.  The poller thread checks it instead of
+# polling a pid file.
+SHUTDOWN_EVENT = threading.Event()
+
+CONNECTION_POOL = None
 
 
 # Initialize the root logger with a StreamHandler and a format message:
-logging.basicConfig(level=logging.DEBUG, format='%(levelname)s %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
 
 
 SCHEME = """<scheme>
@@ -121,6 +137,79 @@ SCHEME = """<scheme>
                 <required_on_create>false</required_on_create>
             </arg>
 
+            <arg name="channel_status_workers">
+                <title>Channel Status Workers</title>
+                <description>Number of connections used to inquire the
+ channel status in parallel. Defaults to 1.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="coalesce_min_channels">
+                <title>Coalesce Channel Names</title>
+                <description>Inquire channel names that share their first
+ qualifier with one generic name when there are at least this many of
+ them. Defaults to 0 (disabled).</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="connection_pool_size">
+                <title>Connection Pool Size</title>
+                <description>Maximum number of connections to the queue
+ manager used by this input. Defaults to 0 (unbounded).</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="connection_idle_timeout">
+                <title>Connection Idle Timeout</title>
+                <description>Disconnect pooled connections that have not been
+ used for this many seconds. Defaults to 300.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="reconnect_backoff_max">
+                <title>Maximum Reconnect Backoff</title>
+                <description>Maximum number of seconds to wait between
+ reconnect attempts. Defaults to 60.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="output_buffer_events">
+                <title>Output Buffer Events</title>
+                <description>Number of events written to Splunk in one
+ stream. Defaults to 100.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="output_buffer_bytes">
+                <title>Output Buffer Size</title>
+                <description>Write the buffered events once they are this
+ many bytes. Defaults to 1048576.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="output_flush_interval">
+                <title>Output Flush Interval</title>
+                <description>Maximum number of milliseconds an event is
+ buffered before it is written. Defaults to 500.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="log_level">
+                <title>Log Level</title>
+                <description>Level of the messages logged to splunkd.log.
+ DEBUG, INFO, WARNING or ERROR. Defaults to INFO.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
             <arg name="response_handler">
                 <title>Response Handler</title>
                 <description>Python classname of custom response handler
@@ -150,6 +239,8 @@ def do_validate():
         config = get_validation_config()
         port = config.get("port")
         mqchs_interval = config.get("mqchs_interval")
+        channel_status_workers = config.get("channel_status_workers")
+        coalesce_min_channels = config.get("coalesce_min_channels")
 
         validationFailed = False
 
@@ -160,6 +251,16 @@ def do_validate():
             print_validation_error("Script polling interval must be a \
                                     positive integer")
             validationFailed = True
+        if channel_status_workers is not None and \
+           int(channel_status_workers) < 1:
+            print_validation_error("Channel status workers must be a \
+                                    positive integer")
+            validationFailed = True
+        if coalesce_min_channels is not None and \
+           int(coalesce_min_channels) < 0:
+            print_validation_error("Coalesce min channels must be zero or \
+                                    a positive integer")
+            validationFailed = True
         if validationFailed:
             sys.exit(2)
 
@@ -213,23 +314,43 @@ def do_run():
     persistent_connection = int(config.get("persistent_connection", 0))
     create_event_per_channnel = int(config.get("create_event_per_channnel", 0))
     include_zero_values = int(config.get("include_zero_values", 0))
+    channel_status_workers = int(config.get("channel_status_workers", 1))
+    coalesce_min_channels = int(config.get("coalesce_min_channels", 0))
+    connection_pool_size = int(config.get("connection_pool_size", 0))
+    connection_idle_timeout = int(config.get("connection_idle_timeout", 300))
+    reconnect_backoff_max = int(config.get("reconnect_backoff_max", 60))
+    output_buffer_events = int(config.get("output_buffer_events", 100))
+    output_buffer_bytes = int(config.get("output_buffer_bytes", 1048576))
+    output_flush_interval = int(config.get("output_flush_interval", 500))
+    set_log_level(config.get("log_level", "INFO"))
 
     response_handler_args = {}
     response_handler_args_str = config.get("response_handler_args")
     if response_handler_args_str is not None:
         response_handler_args = dict((k.strip(), v.strip()) for k, v in
-                                     (item.split('=') for item in
+                                     (item.split('=', 1) for item in
                                       response_handler_args_str.split(',')))
 
     response_handler = config.get("response_handler",
                                   "DefaultChannelStatusResponseHandler")
-    logging.debug("Using response_handler:" + response_handler)
+    logging.debug("Using response_handler:%s", response_handler)
     module = __import__("responsehandlers")
     class_ = getattr(module, response_handler)
 
     global RESPONSE_HANDLER_INSTANCE
     RESPONSE_HANDLER_INSTANCE = class_(**response_handler_args)
 
+    global EVENT_WRITER
+    EVENT_WRITER = module.configure_event_writer(output_buffer_events,
+                                                 output_buffer_bytes,
+                                                 output_flush_interval / 1000.0)
+
+    global CONNECTION_POOL
+    CONNECTION_POOL = ConnectionPool(max_connections=connection_pool_size,
+                                     idle_timeout=connection_idle_timeout,
+                                     max_backoff=reconnect_backoff_max,
+                                     stop_event=SHUTDOWN_EVENT)
+
     try:
         # update all the root StreamHandlers with a new formatter
         # that includes the config information
@@ -246,10 +367,7 @@ def do_run():
        not(port is None) and not(server_connection_channel is None):
 
         group_id = str(uuid.uuid4())
-        pid_fle = open("/tmp/%s_current.pid" % name.replace("://", "-"), "w")
-        logging.debug("Starting new thread group. " + group_id)
-        pid_fle.write(group_id)
-        pid_fle.close()
+        logging.debug("Starting new thread group. %s", group_id)
         logging.debug("Starting single process")
         qp = ChannelStatusPollerThread(group_id, name, splunk_host,
                                        queue_manager_name, queue_manager_host,
@@ -259,9 +377,59 @@ def do_run():
                                        mqchs_interval,
                                        persistent_connection,
                                        create_event_per_channnel,
-                                       include_zero_values)
+                                       include_zero_values,
+                                       channel_status_workers,
+                                       coalesce_min_channels)
         qp.start()
 
+        wait_for_shutdown([qp])
+
+
+def set_log_level(log_level):
+    """Set the level of the root logger from the log_level parameter."""
+    level = logging.getLevelName(str(log_level).strip().upper())
+    if not isinstance(level, int):
+        logging.error("Unknown log_level %s. Using INFO.", log_level)
+        level = logging.INFO
+    logging.getLogger().setLevel(level)
+
+
+def handle_stop_signal(signum, frame):
+    logging.info("Received signal %i. Stopping." % signum)
+    SHUTDOWN_EVENT.set()
+
+
+def wait_for_shutdown(threads):
+    """Block until splunkd stops the input and then stop the poller threads.
+
+    splunkd sends SIGTERM when the input is disabled, changed or restarted.
+    The configuration is read from stdin up to EOF, so the parent process is
+    watched as well in case splunkd goes away without signalling.
+    """
+    signal.signal(signal.SIGTERM, handle_stop_signal)
+    signal.signal(signal.SIGINT, handle_stop_signal)
+
+    parent_pid = os.getppid()
+    while not SHUTDOWN_EVENT.is_set():
+        if os.getppid() != parent_pid:
+            logging.info("Parent process has exited. Stopping.")
+            break
+        if not [t for t in threads if t.is_alive()]:
+            logging.info("All poller threads have stopped.")
+            break
+        SHUTDOWN_EVENT.wait(1.0)
+
+    SHUTDOWN_EVENT.set()
+    for t in threads:
+        t.join(30.0)
+
+    if EVENT_WRITER is not None:
+        EVENT_WRITER.close()
+        EVENT_WRITER.log_stats()
+
+    if CONNECTION_POOL is not None:
+        CONNECTION_POOL.close_all()
+
 
 class ChannelStatusPollerThread(threading.Thread):
 
@@ -269,31 +437,33 @@ class ChannelStatusPollerThread(threading.Thread):
                  queue_manager_host, port, server_connection_channel,
                  mq_user_name, mq_password, channel_names, mqchs_interval,
                  persistent_connection, create_event_per_channnel,
-                 include_zero_values, **kw):
+                 include_zero_values, channel_status_workers=1,
+                 coalesce_min_channels=0, **kw):
         threading.Thread.__init__(self)
+        self.daemon = True
         # logging.debug("-------------------------------------------------------")
-        logging.debug("Started channel Poller for channel/s: " +
-                      channel_names +
-                      " Thread Group:" + group_id)
+        logging.debug("Started channel Poller for channel/s: %s "
+                      "Thread Group:%s", channel_names, group_id)
 
         self.config_name = name
-        self.queue_manager_name = queue_manager_name.encode("ascii")
-        self.queue_manager_host = queue_manager_host.encode("ascii")
+        self.queue_manager_name = queue_manager_name
+        self.queue_manager_host = queue_manager_host
         self.port = port
-        self.server_conn_chl = server_connection_channel.encode("ascii")
+        self.server_conn_chl = server_connection_channel
         self.mq_user_name = mq_user_name
         self.mq_password = mq_password
 
         if self.mq_user_name is not None:
-            if len(self.mq_user_name.encode("ascii").strip()) > 0:
-                self.mq_user_name = self.mq_user_name.encode("ascii").strip()
-                self.mq_password = self.mq_password.encode("ascii").strip()
+            if len(self.mq_user_name.strip()) > 0:
+                self.mq_user_name = self.mq_user_name.strip()
+                self.mq_password = self.mq_password.strip()
         else:
             self.mq_user_name = ""
             self.mq_password = ""
 
         self.channel_names = channel_names
         self.mqinput_interval = mqchs_interval
+        self._conn = None
         self._qm = None
 
         self.setName(group_id)
@@ -307,142 +477,232 @@ class ChannelStatusPollerThread(threading.Thread):
         self.persistent_connection = persistent_connection
         self.create_event_per_channnel = create_event_per_channnel
         self.include_zero_values = include_zero_values
+        self.channel_status_workers = max(1, channel_status_workers)
+        self.inquiries = coalesce_channel_names(self.channel_name_list,
+                                                coalesce_min_channels)
 
     def run(self):
-        done = False
-        while not done:
-            try:
-                # logging.debug("before connect %s %s %s" %
-                # (self.queue_manager_name,
-                # self.server_conn_chl, self.socket))
-                file_pid = str(open("/tmp/%s_current.pid" %
-                                    self.config_name.replace("://", "-"),
-                                    "r").read())
-                # logging.debug("%%%%%% this pid:" + str(self.getName()) +
-                # " File pid:" + str(file_pid))
-                if self.getName().strip() != file_pid.strip():
-                    # another thrread has started and this one is not done.
-                    # stop..
-                    # logging.debug("$$$$ Stopping... this pid:" +
-                    # str(self.getName()) + " File pid:" + str(file_pid))
-                    done = True
-                    sys.exit(1)
-                else:
-                    pass
-                    # logging.debug("!!! NOT Stopping... this pid:" +
-                    # str(self.getName()) + " File pid:" + str(file_pid))
-
-                if self._qm is None:
-                    self._qm = pymqi.QueueManager(None)
-                    logging.debug("Connecting to " +
-                                  self.queue_manager_name +
-                                  self.server_conn_chl)
-
-                    self._qm.connectTCPClient(self.queue_manager_name,
-                                              pymqi.cd(),
-                                              self.server_conn_chl,
-                                              self.socket, self.mq_user_name,
-                                              self.mq_password)
-                    logging.debug("Successfully Connected to " +
-                                  self.queue_manager_name +
-                                  self.server_conn_chl)
+        while not SHUTDOWN_EVENT.is_set():
+            start = time.time()
+            workers = min(self.channel_status_workers, len(self.inquiries))
+            if workers > 1:
+                self.run_workers(workers)
+            else:
+                self.run_sequential()
+
+            duration = time.time() - start
+            logging.info("Channel status cycle: channels=%i inquiries=%i "
+                         "workers=%i duration_ms=%.1f",
+                         len(self.channel_name_list), len(self.inquiries),
+                         max(workers, 1), duration * 1000.0)
+            if duration > float(self.mqinput_interval):
+                logging.warning("Channel status cycle took %.1f seconds which "
+                                "is longer than the interval of %s seconds.  "
+                                "Increase channel_status_workers.",
+                                duration, self.mqinput_interval)
+
+            SHUTDOWN_EVENT.wait(float(self.mqinput_interval))
+
+        self.disconnect()
+
+    def run_sequential(self):
+        """Inquire the channel status of all channels on one connection."""
+        try:
+            # logging.debug("before connect %s %s %s" %
+            # (self.queue_manager_name,
+            # self.server_conn_chl, self.socket))
+            if not self.connect():
+                return
+
+            logging.debug("channel name list: %s",
+                          self.channel_name_list)
+
+            pcf = pymqi.PCFExecute(self._qm)
+            # logging.debug("Start get")
+            for (query_name, channel_names) in self.inquiries:
+                if SHUTDOWN_EVENT.is_set():
+                    break
+                self.inquire(pcf, query_name, channel_names)
+
+            if not self.persistent_connection:
+                self.disconnect()
+        except pymqi.MQMIError as e:
+            logging.error("MQ Exception occurred: %s " % (str(e)))
+            if is_connection_broken(e):
+                self.disconnect(broken=True)
+            elif not self.persistent_connection:
+                self.disconnect()
+
+        except:  # catch *all* exceptions
+            e = sys.exc_info()[1]
+            logging.error("Stopping.  Exception occurred in \
+                ChannelStatusPoller: %s" % str(e))
+            sys.exit(1)
+
+    def run_workers(self, workers):
+        """Inquire the channel status with a number of worker threads that
+        each borrow a connection from the connection pool.  Returns when all
+        the inquiries of this cycle are done.
+        """
+        inquiries = queue.Queue()
+        for inquiry in self.inquiries:
+            inquiries.put(inquiry)
+
+        threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self.inquiry_worker,
+                                 args=(inquiries,),
+                                 name="%s-%i" % (self.getName(), i))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            t.join()
+
+    def inquiry_worker(self, inquiries):
+        conn = None
+        try:
+            while not SHUTDOWN_EVENT.is_set():
+                try:
+                    (query_name, channel_names) = inquiries.get_nowait()
+                except queue.Empty:
+                    break
+
+                if conn is None:
+                    conn = CONNECTION_POOL.acquire(self.queue_manager_name,
+                                                   self.queue_manager_host,
+                                                   self.port,
+                                                   self.server_conn_chl,
+                                                   self.mq_user_name,
+                                                   self.mq_password)
+                    if conn is None:
+                        break
+                    pcf = pymqi.PCFExecute(conn.qm)
+
+                try:
+                    self.inquire(pcf, query_name, channel_names)
+                except pymqi.MQMIError as e:
+                    logging.error("MQ Exception occurred: %s " % (str(e)))
+                    if is_connection_broken(e):
+                        # leave the other inquiries to the workers that
+                        # still have a connection.
+                        CONNECTION_POOL.release(conn, True)
+                        conn = None
+                        break
+        except:  # catch *all* exceptions
+            e = sys.exc_info()[1]
+            logging.error("Exception occurred in ChannelStatusPoller "
+                          "worker: %s" % str(e))
+
+        if conn is not None:
+            CONNECTION_POOL.release(conn, False)
+
+    def inquire(self, pcf, query_name, channel_names=None):
+        """Inquire the channel status of query_name and handle the response.
+
+        channel_names - The channel names a generic query_name was coalesced
+        from.  The response is split up so that every channel name is
+        handled as if it was inquired on its own.
+        """
+        get_chs_args = {pymqi.CMQCFC.MQCACH_CHANNEL_NAME: query_name}
+
+        try:
+            pcf_response = pcf.MQCMD_INQUIRE_CHANNEL_STATUS(get_chs_args)
+
+        except pymqi.MQMIError as e:
+            if e.comp == pymqi.CMQC.MQCC_FAILED and \
+               e.reason == pymqi.CMQC.MQRC_UNKNOWN_OBJECT_NAME:
+                logging.info("Channel '%s' does not exist." % query_name)
+            else:
+                if e.comp == pymqi.CMQC.MQCC_FAILED and \
+                   e.reason == pymqi.CMQCFC.MQRCCF_CHL_STATUS_NOT_FOUND:
+                    logging.info("No status for channel '%s'." % query_name)
                 else:
-                    if not self.persistent_connection:
-                        self._qm = pymqi.QueueManager(None)
-                        logging.debug("Connecting to " +
-                                      self.queue_manager_name +
-                                      self.server_conn_chl)
-
-                        self._qm.connectTCPClient(self.queue_manager_name,
-                                                  pymqi.cd(),
-                                                  self.server_conn_chl,
-                                                  self.socket,
-                                                  self.mq_user_name,
-                                                  self.mq_password)
-                        logging.debug("Successfully Connected to " +
-                                      str(self.queue_manager_name) +
-                                      str(self.server_conn_chl))
-                    else:
-                        if not self._qm._is_connected():
-                            self._qm = pymqi.QueueManager(None)
-                            logging.debug("Connecting to " +
-                                          str(self.queue_manager_name) +
-                                          str(self.server_conn_chl))
-
-                            self._qm.connectTCPClient(self.queue_manager_name,
-                                                      pymqi.cd(),
-                                                      self.server_conn_chl,
-                                                      self.socket,
-                                                      self.mq_user_name,
-                                                      self.mq_password)
-                            logging.debug("Successfully Connected to " +
-                                          str(self.queue_manager_name) +
-                                          str(self.server_conn_chl))
-
-                logging.debug("channel name list: %s" %
-                              str(self.channel_name_list))
-
-                pcf = pymqi.PCFExecute(self._qm)
-                # logging.debug("Start get")
-                for channel_name in self.channel_name_list:
-                    """
-                    file_pid = str(open("/tmp/%s_current.pid" %
-                    self.config_name.replace("://", "-"), "r").read())
-                    #logging.debug("%%%%%% this pid:" + str(self.getName()) +
-                    # " File pid:" + str(file_pid))
-                    if self.getName().strip() != file_pid.strip():
-                        # logging.debug("$$$$ Stopping... this pid:" +
-                        # str(self.getName()) + " File pid:" + str(file_pid))
-                        done = True
-                        sys.exit(1)
-                    else:
-                        pass
-                        # logging.debug("!!! NOT Stopping... this pid:" +
-                        # str(self.getName()) + " File pid:" + str(file_pid))
-                    """
-
-                    get_chs_args = {pymqi.CMQCFC.MQCACH_CHANNEL_NAME:
-                                    channel_name}
-
-                    try:
-                        pcf_response = \
-                            pcf.MQCMD_INQUIRE_CHANNEL_STATUS(get_chs_args)
-
-                    except pymqi.MQMIError as e:
-                        if e.comp == pymqi.CMQC.MQCC_FAILED and \
-                           e.reason == pymqi.CMQC.MQRC_UNKNOWN_OBJECT_NAME:
-                            logging.info("Channel '%s' does not exist." %
-                                         channel_name)
-                        else:
-                            if e.comp == pymqi.CMQC.MQCC_FAILED and \
-                               e.reason == \
-                                    pymqi.CMQCFC.MQRCCF_CHL_STATUS_NOT_FOUND:
-                                logging.info("No status for channel '%s'." %
-                                              channel_name)
-                            else:
-                                raise
-                    else:
-                        handle_output(self.splunk_host,
-                                      self.queue_manager_name,
-                                      channel_name, pcf_response,
-                                      **self.kw)
-
-                if not self.persistent_connection:
-                    self._qm.disconnect()
-            except pymqi.MQMIError as e:
-                logging.error("MQ Exception occurred: %s " % (str(e)))
-                if self._qm is not None:
-                    if not self.persistent_connection and \
-                       self._qm._is_connected():
-                        self._qm.disconnect()
-
-            except:  # catch *all* exceptions
-                e = sys.exc_info()[1]
-                logging.error("Stopping.  Exception occurred in \
-                    ChannelStatusPoller: %s" % str(e))
-                sys.exit(1)
-
-            time.sleep(float(self.mqinput_interval))
+                    raise
+            return
+
+        if channel_names is None:
+            handle_output(self.splunk_host, self.queue_manager_name,
+                          query_name, pcf_response, **self.kw)
+            return
+
+        responses = collections.defaultdict(list)
+        for channel_info in pcf_response:
+            responses[response_channel_name(channel_info)].append(channel_info)
+
+        for channel_name in channel_names:
+            if channel_name in responses:
+                handle_output(self.splunk_host, self.queue_manager_name,
+                              channel_name, responses[channel_name],
+                              **self.kw)
+            else:
+                logging.info("No status for channel '%s'." % channel_name)
+
+    def connect(self):
+        """Borrow a connection from the connection pool unless the current
+        connection can be reused.  Returns False if the input is stopping.
+        """
+        if self._conn is not None:
+            return True
+
+        self._conn = CONNECTION_POOL.acquire(self.queue_manager_name,
+                                             self.queue_manager_host,
+                                             self.port,
+                                             self.server_conn_chl,
+                                             self.mq_user_name,
+                                             self.mq_password)
+        if self._conn is None:
+            return False
+
+        self._qm = self._conn.qm
+        return True
+
+    def disconnect(self, broken=False):
+        """Return the connection to the pool. Broken connections are
+        disconnected.
+        """
+        CONNECTION_POOL.release(self._conn, broken)
+        self._conn = None
+        self._qm = None
+
+
+def coalesce_channel_names(channel_names, min_channels):
+    '''Return the list of (query name, channel names) inquiries for the
+    channel names.
+
+    Channel names that share their first qualifier (LDB0 of LDB0.TO.LDB1)
+    are inquired with one generic name made of their common prefix when
+    there are at least min_channels of them.  The channel names of the other
+    inquiries are None.  Generic channel names are never coalesced.
+    '''
+    if min_channels < 1:
+        return [(channel_name, None) for channel_name in channel_names]
+
+    groups = collections.OrderedDict()
+    for channel_name in channel_names:
+        if "*" in channel_name:
+            key = (channel_name,)
+        else:
+            key = channel_name.split(".", 1)[0]
+        groups.setdefault(key, collections.OrderedDict())[channel_name] = None
+
+    inquiries = []
+    for (key, names) in groups.items():
+        names = list(names)
+        if len(names) < max(min_channels, 2) or isinstance(key, tuple):
+            inquiries.extend((name, None) for name in names)
+        else:
+            inquiries.append((os.path.commonprefix(names) + "*", names))
+
+    return inquiries
+
+
+def response_channel_name(channel_info):
+    channel_name = channel_info.get(pymqi.CMQCFC.MQCACH_CHANNEL_NAME, "")
+    if not isinstance(channel_name, str):
+        channel_name = channel_name.decode("ascii", "replace")
+    return channel_name.strip()
 
 
 # prints validation error data to be consumed by Splunk
@@ -456,7 +716,6 @@ def handle_output(splunk_host, queue_manager_name, channel_name,
     try:
         RESPONSE_HANDLER_INSTANCE(splunk_host, queue_manager_name,
                                   channel_name, pcf_response, **kw)
-        sys.stdout.flush()
     except:
         e = sys.exc_info()[1]
         logging.error("Exception occurred while handling response output: %s" %
@@ -492,20 +751,20 @@ def get_input_config():
             if stanza:
                 stanza_name = stanza.getAttribute("name")
                 if stanza_name:
-                    logging.debug("XML: found stanza " + stanza_name)
+                    logging.debug("XML: found stanza %s", stanza_name)
                     config["name"] = stanza_name
 
                     params = stanza.getElementsByTagName("param")
                     for param in params:
                         param_name = param.getAttribute("name")
-                        logging.debug("XML: found param '%s'" % param_name)
+                        logging.debug("XML: found param '%s'", param_name)
                         if param_name and param.firstChild and \
                            param.firstChild.nodeType == \
                                 param.firstChild.TEXT_NODE:
                             data = param.firstChild.data
                             config[param_name] = data
-                            logging.debug("XML: '%s' -> '%s'" %
-                                          (param_name, data))
+                            logging.debug("XML: '%s' -> '%s'",
+                                          param_name, data)
 
         checkpnt_node = root.getElementsByTagName("checkpoint_dir")[0]
         if checkpnt_node and checkpnt_node.firstChild and \
@@ -546,7 +805,7 @@ def get_validation_config():
         params_node = item_node.getElementsByTagName("param")
         for param in params_node:
             name = param.getAttribute("name")
-            logging.debug("Found param %s" % name)
+            logging.debug("Found param %s", name)
             if name and param.firstChild and \
                param.firstChild.nodeType == param.firstChild.TEXT_NODE:
                 val_data[name] = param.firstChild.data
@@ -22,17 +22,45 @@ import xml.sax.saxutils
 import time
 import threading
 import uuid
+import signal
+import itertools
+import binascii
+import multiprocessing
 
 import pymqi
 from pymqi import CMQC as CMQC
 
+from connectionpool import ConnectionPool, is_connection_broken, \
+    is_queue_handle_broken
+from payloadstore import close_archive_writers, flush_archive_writers
+from pipeline import PipeSink, RenderBatch, RenderPool, forward_output
+
 SPLUNK_HOME = os.environ.get("SPLUNK_HOME")
 
 RESPONSE_HANDLER_INSTANCE = None
+EVENT_WRITER = None
+
+# Set when splunkd stops the input.  The poller threads check it between
+# gets instead of polling a pid file.
+SHUTDOWN_EVENT = threading.Event()
+
+CONNECTION_POOL = None
+
+# renderer threads that call the response handler for the poller threads.
+# None when the poller threads call the response handler themselves.
+RENDER_POOL = None
+
+# log every nth message handled at INFO level.  0 disables tracing.
+TRACE_SAMPLE_RATE = 0
+TRACE_COUNTER = itertools.count(1)
+
+# shortest common prefix of the queue names that is inquired as a generic
+# name.  A shorter one would match many queues that are not configured.
+MIN_GENERIC_PREFIX = 4
 
 
 # Initialize the root logger with a StreamHandler and a format message:
-logging.basicConfig(level=logging.DEBUG, format='%(levelname)s %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
 
 
 SCHEME = """<scheme>
@@ -116,6 +144,242 @@ SCHEME = """<scheme>
                 <required_on_create>false</required_on_create>
             </arg>>
 
+            <arg name="use_mqget_wait">
+                <title>Wait for messages</title>
+                <description>Keep the queues open and wait in MQGET for
+ messages to arrive instead of polling at the interval.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="mqget_wait_interval">
+                <title>MQGET Wait Interval</title>
+                <description>How long MQGET waits for a message in
+ milliseconds. Defaults to 5000.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="mqget_batch_size">
+                <title>MQGET Batch Size</title>
+                <description>Get up to this many messages under syncpoint
+ and only commit them after they have been written to Splunk.
+ Defaults to 1 (no batching).</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="mqget_batch_interval">
+                <title>MQGET Batch Interval</title>
+                <description>Maximum time in milliseconds spent filling a
+ batch. Defaults to 1000.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="backout_threshold">
+                <title>Backout Threshold</title>
+                <description>Move a message to the backout queue, or discard
+ it, once it has been backed out this many times because the response handler
+ failed. 0 retries it forever. Defaults to 3.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="backout_queue">
+                <title>Backout Queue</title>
+                <description>Queue the messages that reached the
+ backout_threshold are moved to. Discarded if not set.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="connection_pool_size">
+                <title>Connection Pool Size</title>
+                <description>Maximum number of connections to the queue
+ manager shared by the threads of this input. Defaults to 0 (unbounded).
+                </description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="connection_idle_timeout">
+                <title>Connection Idle Timeout</title>
+                <description>Disconnect pooled connections that have not been
+ used for this many seconds. Defaults to 300.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="reconnect_backoff_max">
+                <title>Maximum Reconnect Backoff</title>
+                <description>Maximum number of seconds to wait between
+ reconnect attempts. Defaults to 60.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="adaptive_polling">
+                <title>Adaptive Polling</title>
+                <description>Inquire the depth of the queues with one PCF
+ command and only get messages from the queues that have messages.  Poll
+ every adaptive_min_interval seconds while there are messages and back off
+ up to mqinput_interval when the queues are empty. Defaults to 0.
+                </description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="adaptive_min_interval">
+                <title>Adaptive Minimum Interval</title>
+                <description>Polling interval in seconds while the queues have
+ messages when adaptive_polling is set. Defaults to 1.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="autoscale">
+                <title>Auto-scale Getter Threads</title>
+                <description>Add getter threads to a queue while it has a
+ backlog and retire them once it is empty. Requires start_process_per_queue.
+ Defaults to 0.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="autoscale_min_threads">
+                <title>Auto-scale Minimum Threads</title>
+                <description>Minimum number of getter threads per queue.
+ Defaults to 1.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="autoscale_max_threads">
+                <title>Auto-scale Maximum Threads</title>
+                <description>Maximum number of getter threads per queue.
+ Defaults to 4.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="autoscale_depth_threshold">
+                <title>Auto-scale Depth Threshold</title>
+                <description>Add a getter thread while the queue depth is at
+ least this many messages. Defaults to 1000.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="autoscale_age_threshold">
+                <title>Auto-scale Message Age Threshold</title>
+                <description>Add a getter thread while the oldest message on
+ the queue is at least this many seconds old.  Requires queue monitoring
+ (MONQ). Defaults to 0 (disabled).</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="autoscale_interval">
+                <title>Auto-scale Interval</title>
+                <description>How often in seconds the queues are checked.
+ Defaults to 30.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="queue_quantum_messages">
+                <title>Queue Quantum Messages</title>
+                <description>Maximum number of messages got from a queue
+ before the next queue serviced by the same thread gets its turn. Defaults
+ to 0 (get messages until the queue is empty).</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="queue_quantum_ms">
+                <title>Queue Quantum Milliseconds</title>
+                <description>Maximum number of milliseconds spent getting
+ messages from a queue before the next queue gets its turn. Defaults to 0
+ (no limit).</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="queue_depth_weighting">
+                <title>Queue Depth Weighting</title>
+                <description>Give queues with more messages a bigger
+ queue_quantum_messages in proportion to their current depth. Defaults to
+ 0.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="render_workers">
+                <title>Render Workers</title>
+                <description>Number of threads that call the response
+ handler while the poller threads keep getting messages. Defaults to 0 (the
+ poller threads call the response handler).</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="handoff_queue_size">
+                <title>Hand-off Queue Size</title>
+                <description>Maximum number of messages waiting for a render
+ worker. Defaults to 1000.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="handoff_queue_bytes">
+                <title>Hand-off Queue Bytes</title>
+                <description>Maximum number of bytes of the messages waiting
+ for a render worker. Defaults to 67108864.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="output_buffer_events">
+                <title>Output Buffer Events</title>
+                <description>Number of events written to Splunk in one
+ stream. Defaults to 100.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="output_buffer_bytes">
+                <title>Output Buffer Size</title>
+                <description>Write the buffered events once they are this
+ many bytes. Defaults to 1048576.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="output_flush_interval">
+                <title>Output Flush Interval</title>
+                <description>Maximum number of milliseconds an event is
+ buffered before it is written. Defaults to 500.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="log_level">
+                <title>Log Level</title>
+                <description>Level of the messages logged to splunkd.log.
+ DEBUG, INFO, WARNING or ERROR. Defaults to INFO.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
+            <arg name="trace_sample_rate">
+                <title>Trace Sample Rate</title>
+                <description>Log the details of every nth message at INFO
+ level. Defaults to 0 (disabled).</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
             <arg name="start_process_per_queue">
                 <title>Start Process Per Queue if more than one queue name
  is specified.</title>
@@ -142,6 +406,15 @@ SCHEME = """<scheme>
                 <required_on_create>false</required_on_create>
             </arg>
 
+            <arg name="use_worker_processes">
+                <title>Use Worker Processes</title>
+                <description>Start start_number_of_processes worker processes
+ instead of threads so that the response handlers run on more than one CPU.
+ Defaults to 0.</description>
+                <required_on_edit>false</required_on_edit>
+                <required_on_create>false</required_on_create>
+            </arg>
+
             <arg name="response_handler">
                 <title>Response Handler</title>
                 <description>Python classname of custom response handler.
@@ -170,6 +443,25 @@ def do_validate():
 
         port = config.get("port")
         mqinput_interval = config.get("mqinput_interval")
+        mqget_wait_interval = config.get("mqget_wait_interval")
+        mqget_batch_size = config.get("mqget_batch_size")
+        mqget_batch_interval = config.get("mqget_batch_interval")
+        output_buffer_events = config.get("output_buffer_events")
+        adaptive_min_interval = config.get("adaptive_min_interval")
+        backout_threshold = config.get("backout_threshold")
+        autoscale_min_threads = config.get("autoscale_min_threads")
+        autoscale_max_threads = config.get("autoscale_max_threads")
+        autoscale_depth_threshold = config.get("autoscale_depth_threshold")
+        autoscale_age_threshold = config.get("autoscale_age_threshold")
+        autoscale_interval = config.get("autoscale_interval")
+        queue_quantum_messages = config.get("queue_quantum_messages")
+        queue_quantum_ms = config.get("queue_quantum_ms")
+        render_workers = config.get("render_workers")
+        handoff_queue_size = config.get("handoff_queue_size")
+        handoff_queue_bytes = config.get("handoff_queue_bytes")
+        output_flush_interval = config.get("output_flush_interval")
+        trace_sample_rate = config.get("trace_sample_rate")
+        connection_pool_size = config.get("connection_pool_size")
 
         validationFailed = False
 
@@ -180,6 +472,100 @@ def do_validate():
             print_validation_error("Script polling interval must be a positive \
                 integer")
             validationFailed = True
+        if mqget_wait_interval is not None and int(mqget_wait_interval) < 1:
+            print_validation_error("MQGET wait interval must be a positive \
+                integer")
+            validationFailed = True
+        if mqget_batch_size is not None and int(mqget_batch_size) < 1:
+            print_validation_error("MQGET batch size must be a positive \
+                integer")
+            validationFailed = True
+        if mqget_batch_interval is not None and \
+           int(mqget_batch_interval) < 1:
+            print_validation_error("MQGET batch interval must be a positive \
+                integer")
+            validationFailed = True
+        if backout_threshold is not None and int(backout_threshold) < 0:
+            print_validation_error("Backout threshold must be zero or a \
+                positive integer")
+            validationFailed = True
+        if adaptive_min_interval is not None and \
+           int(adaptive_min_interval) < 1:
+            print_validation_error("Adaptive minimum interval must be a \
+                positive integer")
+            validationFailed = True
+        if autoscale_min_threads is not None and \
+           int(autoscale_min_threads) < 1:
+            print_validation_error("Auto-scale minimum threads must be a \
+                positive integer")
+            validationFailed = True
+        if autoscale_max_threads is not None and \
+           int(autoscale_max_threads) < int(autoscale_min_threads or 1):
+            print_validation_error("Auto-scale maximum threads must be at \
+                least the minimum threads")
+            validationFailed = True
+        if autoscale_depth_threshold is not None and \
+           int(autoscale_depth_threshold) < 1:
+            print_validation_error("Auto-scale depth threshold must be a \
+                positive integer")
+            validationFailed = True
+        if autoscale_age_threshold is not None and \
+           int(autoscale_age_threshold) < 0:
+            print_validation_error("Auto-scale age threshold must be zero or \
+                a positive integer")
+            validationFailed = True
+        if autoscale_interval is not None and int(autoscale_interval) < 1:
+            print_validation_error("Auto-scale interval must be a positive \
+                integer")
+            validationFailed = True
+        if queue_quantum_messages is not None and \
+           int(queue_quantum_messages) < 0:
+            print_validation_error("Queue quantum messages must be zero or a \
+                positive integer")
+            validationFailed = True
+        if queue_quantum_ms is not None and int(queue_quantum_ms) < 0:
+            print_validation_error("Queue quantum milliseconds must be zero \
+                or a positive integer")
+            validationFailed = True
+        if render_workers is not None and int(render_workers) < 0:
+            print_validation_error("Render workers must be zero or a \
+                positive integer")
+            validationFailed = True
+        if handoff_queue_size is not None and int(handoff_queue_size) < 1:
+            print_validation_error("Hand-off queue size must be a positive \
+                integer")
+            validationFailed = True
+        if handoff_queue_bytes is not None and int(handoff_queue_bytes) < 1:
+            print_validation_error("Hand-off queue bytes must be a positive \
+                integer")
+            validationFailed = True
+        if output_buffer_events is not None and \
+           int(output_buffer_events) < 1:
+            print_validation_error("Output buffer events must be a positive \
+                integer")
+            validationFailed = True
+        if output_flush_interval is not None and \
+           int(output_flush_interval) < 1:
+            print_validation_error("Output flush interval must be a positive \
+                integer")
+            validationFailed = True
+        if trace_sample_rate is not None and int(trace_sample_rate) < 0:
+            print_validation_error("Trace sample rate must be zero or a \
+                positive integer")
+            validationFailed = True
+        if connection_pool_size is not None and int(connection_pool_size) > 0:
+            needed = held_connections(
+                len(config.get("queue_names", "").split(",")),
+                int(config.get("start_process_per_queue") or 0),
+                int(config.get("start_number_of_processes") or 1),
+                int(config.get("use_mqget_wait") or 0),
+                int(config.get("autoscale") or 0),
+                int(autoscale_max_threads or 4))
+            if int(connection_pool_size) < needed:
+                print_validation_error("Connection pool size must be at \
+                    least %i, the number of connections the getter threads \
+                    keep open" % needed)
+                validationFailed = True
         if validationFailed:
             sys.exit(2)
 
@@ -198,6 +584,20 @@ def do_run():
 
     config = get_input_config()
 
+    if int(config.get("use_worker_processes", 0)):
+        run_worker_processes(config)
+    else:
+        run_input(config)
+
+
+def run_input(config, number_of_processes=None, sink=None):
+    '''Start the queue pollers of the input and wait until the input is
+    stopped.
+
+    number_of_processes - Number of pollers to start instead of
+    start_number_of_processes.
+    sink - Where the event writer writes the events.  Default is stdout.
+    '''
     queue_manager_name = config.get("queue_manager_name")
     queue_manager_host = config.get("queue_manager_host")
 
@@ -240,24 +640,89 @@ def do_run():
     start_process_per_queue = int(config.get("start_process_per_queue", 0))
     #start_multiple_processes = int(config.get("start_multiple_processes", 0))
     start_number_of_processes = int(config.get("start_number_of_processes", 1))
+    if number_of_processes is not None:
+        start_number_of_processes = number_of_processes
+    use_mqget_wait = int(config.get("use_mqget_wait", 0))
+    mqget_wait_interval = int(config.get("mqget_wait_interval", 5000))
+    mqget_batch_size = int(config.get("mqget_batch_size", 1))
+    mqget_batch_interval = int(config.get("mqget_batch_interval", 1000))
+    connection_pool_size = int(config.get("connection_pool_size", 0))
+    connection_idle_timeout = int(config.get("connection_idle_timeout", 300))
+    reconnect_backoff_max = int(config.get("reconnect_backoff_max", 60))
+    output_buffer_events = int(config.get("output_buffer_events", 100))
+    output_buffer_bytes = int(config.get("output_buffer_bytes", 1048576))
+    output_flush_interval = int(config.get("output_flush_interval", 500))
+    adaptive_polling = int(config.get("adaptive_polling", 0))
+    adaptive_min_interval = int(config.get("adaptive_min_interval", 1))
+    backout_threshold = int(config.get("backout_threshold", 3))
+    backout_queue = config.get("backout_queue")
+    if backout_queue is not None:
+        backout_queue = str(backout_queue).strip()
+    autoscale = int(config.get("autoscale", 0))
+    autoscale_min_threads = int(config.get("autoscale_min_threads", 1))
+    autoscale_max_threads = int(config.get("autoscale_max_threads", 4))
+    autoscale_depth_threshold = int(config.get("autoscale_depth_threshold",
+                                               1000))
+    autoscale_age_threshold = int(config.get("autoscale_age_threshold", 0))
+    autoscale_interval = int(config.get("autoscale_interval", 30))
+    queue_quantum_messages = int(config.get("queue_quantum_messages", 0))
+    queue_quantum_ms = int(config.get("queue_quantum_ms", 0))
+    queue_depth_weighting = int(config.get("queue_depth_weighting", 0))
+    render_workers = int(config.get("render_workers", 0))
+    handoff_queue_size = int(config.get("handoff_queue_size", 1000))
+    handoff_queue_bytes = int(config.get("handoff_queue_bytes", 67108864))
+    set_log_level(config.get("log_level", "INFO"))
+
+    global TRACE_SAMPLE_RATE
+    TRACE_SAMPLE_RATE = int(config.get("trace_sample_rate", 0))
 
     response_handler_args = {}
     response_handler_args_str = config.get("response_handler_args")
     if response_handler_args_str is not None:
         response_handler_args = dict((k.strip(), v.strip())
-                                     for k, v in (item.split('=')
+                                     for k, v in (item.split('=', 1)
                                      for item in
                                      response_handler_args_str.split(',')))
 
     response_handler = config.get("response_handler",
                                   "DefaultQueueResponseHandler")
-    logging.debug("Using response_handler:" + response_handler)
+    logging.debug("Using response_handler:%s", response_handler)
     module = __import__("responsehandlers")
     class_ = getattr(module, response_handler)
 
     global RESPONSE_HANDLER_INSTANCE
     RESPONSE_HANDLER_INSTANCE = class_(**response_handler_args)
 
+    global EVENT_WRITER
+    EVENT_WRITER = module.configure_event_writer(output_buffer_events,
+                                                 output_buffer_bytes,
+                                                 output_flush_interval / 1000.0,
+                                                 sink=sink)
+
+    needed = held_connections(len(queue_name_list), start_process_per_queue,
+                              start_number_of_processes, use_mqget_wait,
+                              autoscale, autoscale_max_threads)
+    if 0 < connection_pool_size < needed:
+        # the getter threads would wait for a connection forever.
+        logging.warning("connection_pool_size=%i is less than the %i "
+                        "connections the getter threads keep open.  Using "
+                        "%i.", connection_pool_size, needed, needed)
+        connection_pool_size = needed
+
+    global CONNECTION_POOL
+    CONNECTION_POOL = ConnectionPool(max_connections=connection_pool_size,
+                                     idle_timeout=connection_idle_timeout,
+                                     max_backoff=reconnect_backoff_max,
+                                     stop_event=SHUTDOWN_EVENT)
+
+    if render_workers > 0:
+        global RENDER_POOL
+        RENDER_POOL = RenderPool(render_output, workers=render_workers,
+                                 max_items=handoff_queue_size,
+                                 max_bytes=handoff_queue_bytes,
+                                 stop_event=SHUTDOWN_EVENT)
+        RENDER_POOL.start()
+
     try:
         # update all the root StreamHandlers with a new
         # formatter that includes the config information
@@ -284,34 +749,48 @@ def do_run():
         if start_process_per_queue:
             logging.debug("Starting a process per queue")
 
-            for queue_name in queue_name_list:
-                for i in range(start_number_of_processes):
-                    group_id = str(uuid.uuid4())
-                    pid_fle = open("/tmp/%s_current.pid" %
-                                   (name.replace("://", "-") +
-                                    "_" + str(i)), "w")
-                    logging.debug("Starting new thread group. " + group_id)
-                    pid_fle.write(group_id)
-                    pid_fle.close()
-                    qps.append(QueuePollerThread(group_id, i, name,
-                                                 splunk_host,
-                                                 queue_manager_name,
-                                                 queue_manager_host, port,
-                                                 server_connection_channel,
-                                                 mq_user_name, mq_password,
-                                                 queue_name, mqinput_interval,
-                                                 start_process_per_queue,
-                                                 persistent_connection))
-                    qps[-1].start()
+            def new_poller(queue_name, i):
+                group_id = str(uuid.uuid4())
+                logging.debug("Starting new thread group. %s", group_id)
+                return QueuePollerThread(group_id, i, name, splunk_host,
+                                         queue_manager_name,
+                                         queue_manager_host, port,
+                                         server_connection_channel,
+                                         mq_user_name, mq_password,
+                                         queue_name, mqinput_interval,
+                                         start_process_per_queue,
+                                         persistent_connection,
+                                         use_mqget_wait,
+                                         mqget_wait_interval,
+                                         mqget_batch_size,
+                                         mqget_batch_interval,
+                                         queue_quantum_messages,
+                                         queue_quantum_ms,
+                                         queue_depth_weighting,
+                                         adaptive_polling,
+                                         adaptive_min_interval,
+                                         backout_threshold,
+                                         backout_queue)
+
+            if autoscale:
+                # the auto-scaler adds its threads to qps.
+                scaler = QueueAutoScaler(new_poller, qps, queue_name_list,
+                                         autoscale_min_threads,
+                                         autoscale_max_threads,
+                                         autoscale_depth_threshold,
+                                         autoscale_age_threshold,
+                                         autoscale_interval)
+                scaler.start_pollers()
+                scaler.start()
+            else:
+                for queue_name in queue_name_list:
+                    for i in range(start_number_of_processes):
+                        qps.append(new_poller(queue_name, i))
+                        qps[-1].start()
         else:
             for i in range(start_number_of_processes):
                 group_id = str(uuid.uuid4())
-                pid_fle = open("/tmp/%s_current.pid" %
-                               (name.replace("://", "-") + "_" + str(i)),
-                               "w")
-                logging.debug("Starting new thread group. " + group_id)
-                pid_fle.write(group_id)
-                pid_fle.close()
+                logging.debug("Starting new thread group. %s", group_id)
                 logging.debug("Starting process for all queues.")
                 qp = QueuePollerThread(group_id, i, name, splunk_host,
                                        queue_manager_name, queue_manager_host,
@@ -319,10 +798,144 @@ def do_run():
                                        mq_user_name, mq_password, queue_names,
                                        mqinput_interval,
                                        start_process_per_queue,
-                                       persistent_connection)
+                                       persistent_connection,
+                                       use_mqget_wait,
+                                       mqget_wait_interval,
+                                       mqget_batch_size,
+                                       mqget_batch_interval,
+                                       queue_quantum_messages,
+                                       queue_quantum_ms,
+                                       queue_depth_weighting,
+                                       adaptive_polling,
+                                       adaptive_min_interval,
+                                       backout_threshold,
+                                       backout_queue)
                 qp.start()
                 qps.append(qp)
 
+        wait_for_shutdown(qps, mqget_wait_interval / 1000.0)
+
+
+def run_worker_processes(config):
+    '''Run the pollers of the input in start_number_of_processes worker
+    processes.  Every worker has its own connections and response handler
+    and sends its <stream> documents to this process through a pipe.  This
+    process writes the documents to stdout one at a time and acknowledges
+    each one, so the workers commit their batches only once the events were
+    written.
+    '''
+    set_log_level(config.get("log_level", "INFO"))
+    number_of_processes = int(config.get("start_number_of_processes", 1))
+    mqget_wait_interval = int(config.get("mqget_wait_interval", 5000))
+
+    try:
+        # don't copy the threads and MQ connections of this process.
+        context = multiprocessing.get_context("spawn")
+    except AttributeError:
+        context = multiprocessing
+
+    output_lock = threading.Lock()
+    workers = []
+    forwarders = []
+    for i in range(max(1, number_of_processes)):
+        # duplex so that the forwarder can tell the worker once its
+        # events have been written.
+        (conn, worker_conn) = context.Pipe()
+        worker = context.Process(target=run_worker_process,
+                                 args=(config, worker_conn),
+                                 name="mqinput-worker-%i" % i)
+        worker.daemon = True
+        worker.start()
+        # the pipe reports EOF once the worker has closed its end.
+        worker_conn.close()
+
+        forwarder = threading.Thread(target=forward_output,
+                                     args=(conn, output_lock))
+        forwarder.daemon = True
+        forwarder.start()
+
+        workers.append(worker)
+        forwarders.append(forwarder)
+        logging.debug("Started worker process %i.", worker.pid)
+
+    wait_for_stop(workers)
+
+    # the workers write their buffered events and stop on SIGTERM.
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+    for worker in workers:
+        worker.join(mqget_wait_interval / 1000.0 + 10.0)
+    for forwarder in forwarders:
+        forwarder.join(5.0)
+
+
+def run_worker_process(config, conn):
+    '''Entry point of a worker process started by run_worker_processes.'''
+    run_input(config, number_of_processes=1, sink=PipeSink(conn))
+    conn.close()
+
+
+def set_log_level(log_level):
+    """Set the level of the root logger from the log_level parameter."""
+    level = logging.getLevelName(str(log_level).strip().upper())
+    if not isinstance(level, int):
+        logging.error("Unknown log_level %s. Using INFO.", log_level)
+        level = logging.INFO
+    logging.getLogger().setLevel(level)
+
+
+def handle_stop_signal(signum, frame):
+    logging.info("Received signal %i. Stopping." % signum)
+    SHUTDOWN_EVENT.set()
+
+
+def wait_for_stop(threads):
+    """Block until splunkd stops the input or all the threads (or worker
+    processes) have stopped.
+
+    splunkd sends SIGTERM when the input is disabled, changed or restarted.
+    The configuration is read from stdin up to EOF, so the parent process is
+    watched as well in case splunkd goes away without signalling.
+    """
+    signal.signal(signal.SIGTERM, handle_stop_signal)
+    signal.signal(signal.SIGINT, handle_stop_signal)
+
+    parent_pid = os.getppid()
+    while not SHUTDOWN_EVENT.is_set():
+        if os.getppid() != parent_pid:
+            logging.info("Parent process has exited. Stopping.")
+            break
+        if not [t for t in threads if t.is_alive()]:
+            logging.info("All pollers have stopped.")
+            break
+        SHUTDOWN_EVENT.wait(1.0)
+
+    SHUTDOWN_EVENT.set()
+
+
+def wait_for_shutdown(threads, join_timeout):
+    """Block until the input is stopped and then stop the poller threads."""
+    wait_for_stop(threads)
+
+    for t in threads:
+        # a thread may be blocked in MQGET for up to the wait interval.
+        t.join(join_timeout + 5.0)
+
+    if RENDER_POOL is not None:
+        # the messages already taken from the queues are still written.
+        RENDER_POOL.close()
+        RENDER_POOL.log_stats()
+
+    if EVENT_WRITER is not None:
+        EVENT_WRITER.close()
+        EVENT_WRITER.log_stats()
+
+    close_archive_writers()
+
+    if CONNECTION_POOL is not None:
+        CONNECTION_POOL.close_all()
+
 
 class QueuePollerThread(threading.Thread):
 
@@ -330,10 +943,19 @@ class QueuePollerThread(threading.Thread):
                  queue_manager_name, queue_manager_host,
                  port, server_connection_channel,
                  mq_user_name, mq_password, queue_names, mqinput_interval,
-                 start_process_per_queue, persistent_connection, **kw):
+                 start_process_per_queue, persistent_connection,
+                 use_mqget_wait=0, mqget_wait_interval=5000,
+                 mqget_batch_size=1, mqget_batch_interval=1000,
+                 queue_quantum_messages=0, queue_quantum_ms=0,
+                 queue_depth_weighting=0, adaptive_polling=0,
+                 adaptive_min_interval=1, backout_threshold=3,
+                 backout_queue=None, **kw):
         threading.Thread.__init__(self)
-        logging.debug("Started Queue Poller for queue/s: " + queue_names +
-                      " Thread Group:" + group_id)
+        logging.debug("Started Queue Poller for queue/s: %s Thread Group:%s",
+                      queue_names, group_id)
+        # don't keep the process alive if a thread is stuck in an MQ call
+        # after a stop was requested.
+        self.daemon = True
 
         self.config_name = name
 
@@ -352,7 +974,31 @@ class QueuePollerThread(threading.Thread):
         self.queue_names = queue_names
         self.mqinput_interval = mqinput_interval
         self.start_process_per_queue = start_process_per_queue
+        self.use_mqget_wait = use_mqget_wait
+        self.mqget_wait_interval = mqget_wait_interval
+        self.mqget_batch_size = mqget_batch_size
+        self.mqget_batch_interval = mqget_batch_interval
+        self.queue_quantum_messages = queue_quantum_messages
+        self.queue_quantum_ms = queue_quantum_ms
+        # the quantum is only weighted if there is one to weight.
+        self.queue_depth_weighting = queue_depth_weighting and \
+            queue_quantum_messages > 0
+        # waiting for messages makes polling the depth pointless.
+        self.adaptive_polling = adaptive_polling and not use_mqget_wait
+        self.adaptive_min_interval = min(adaptive_min_interval,
+                                         mqinput_interval)
+        self.poll_interval = mqinput_interval
+        self.backout_threshold = backout_threshold
+        self.backout_queue = backout_queue
+        # queue name -> number of messages to get one at a time after the
+        # response handler failed.
+        self._isolated_gets = {}
+        self._conn = None
         self._qm = None
+        self._pcf = None
+        self._open_queues = []
+        # set by the auto-scaler to retire this poller.
+        self._retire_event = threading.Event()
 
         if self.mq_user_name is not None:
             if len(self.mq_user_name.strip()) > 0:
@@ -371,201 +1017,503 @@ class QueuePollerThread(threading.Thread):
         self.socket = "%s(%i)" % (str(self.queue_manager_host).strip(),
                                   self.port)
         self.kw = kw
-        self.persistent_connection = persistent_connection
+        # consumer mode keeps the connection and the queues open.
+        self.persistent_connection = persistent_connection or use_mqget_wait
+
+    def should_stop(self):
+        """Return True once the input has been asked to stop or the poller
+        was retired.
+        """
+        return SHUTDOWN_EVENT.is_set() or self._retire_event.is_set()
+
+    def retire(self):
+        """Ask the poller to stop after the messages it is getting."""
+        self._retire_event.set()
+
+    def wait(self, timeout):
+        """Wait timeout seconds or until the poller should stop."""
+        end = time.time() + timeout
+        while not self.should_stop():
+            remaining = end - time.time()
+            if remaining <= 0:
+                return
+            SHUTDOWN_EVENT.wait(min(remaining, 1.0))
+
+    def connect(self):
+        """Borrow a connection from the connection pool unless the current
+        connection can be reused.  Returns False if the input is stopping.
+        """
+        if self._conn is not None:
+            return True
+
+        self._conn = CONNECTION_POOL.acquire(self.queue_manager_name,
+                                             self.queue_manager_host,
+                                             self.port,
+                                             self.server_conn_chl,
+                                             self.mq_user_name,
+                                             self.mq_password)
+        if self._conn is None:
+            return False
+
+        self._qm = self._conn.qm
+        return True
+
+    def disconnect(self, broken=False):
+        """Return the connection to the pool.  The pool keeps the queues
+        open unless the connection is broken, in which case it is
+        disconnected.
+        """
+        self._open_queues = []
+        if self._pcf is not None:
+            if not broken:
+                # close the reply queue of the pooled connection.
+                self._pcf.disconnect()
+            self._pcf = None
+        CONNECTION_POOL.release(self._conn, broken)
+        self._conn = None
+        self._qm = None
+
+    def open_queues(self, queue_names=None):
+        """Open the queues (default all the configured queues) for input.
+        Queues that are already open on the pooled connection are reused.
+        """
+        if queue_names is None:
+            queue_names = self.queue_name_list
+
+        options = CMQC.MQOO_INPUT_SHARED
+        if self.queue_depth_weighting:
+            options = options | CMQC.MQOO_INQUIRE
+
+        self._open_queues = []
+        for queue_name in queue_names:
+            try:
+                self._open_queues.append((queue_name,
+                                          self._conn.open_queue(
+                                              queue_name, options)))
+            except Exception as ex:
+                logging.error("Unable to open queue:" +
+                              str(queue_name) +
+                              " Exception: " +
+                              str(ex))
+
+        return self._open_queues
+
+    def handle_queue_error(self, queue_name, ex):
+        """Forget the queue handle if the error means it must be
+        reopened.
+        """
+        if is_queue_handle_broken(ex):
+            self._conn.discard_queue(queue_name)
+            self._open_queues = [(n, q) for (n, q) in self._open_queues
+                                 if n != queue_name]
+
+    def output(self, queue_name, msg_data, msg_desc, batch=None,
+               syncpoint=False):
+        """Pass the message to the response handler, or to the render
+        workers if there are any.  batch is the RenderBatch of a syncpoint
+        batch.  Errors of the response handler are raised when syncpoint
+        is set (or by batch.wait() with render workers) and logged
+        otherwise.
+        """
+        if RENDER_POOL is None:
+            render = handle_output
+            if syncpoint:
+                render = render_output
+            render(self.splunk_host, self.config_name,
+                   self.queue_manager_name, queue_name, msg_data, msg_desc,
+                   **self.kw)
+        else:
+            RENDER_POOL.submit((self.splunk_host, self.config_name,
+                                self.queue_manager_name, queue_name, msg_data,
+                                msg_desc), self.kw, len(msg_data), batch)
+
+    def drain_queue(self, queue_name, queue_obj, get_opts, quantum=0):
+        """Get and handle messages from the queue until there are no more
+        messages (2033), quantum messages have been got or queue_quantum_ms
+        has passed.  Any other MQ error is raised to the caller.
+
+        Returns True if the queue may have more messages.
+        """
+        start = time.time()
+        count = 0
+
+        def turn_over():
+            if self.should_stop():
+                return True
+            if quantum > 0 and count >= quantum:
+                return True
+            return self.queue_quantum_ms > 0 and \
+                (time.time() - start) * 1000 >= self.queue_quantum_ms
+
+        if self.mqget_batch_size > 1:
+            while not turn_over():
+                max_messages = self.mqget_batch_size
+                if quantum > 0:
+                    max_messages = min(max_messages, quantum - count)
+                (batch_count, more_messages) = self.get_batch(
+                    queue_name, queue_obj, get_opts, max_messages)
+                count = count + batch_count
+                if not more_messages:
+                    return False
+            return True
+
+        msg_desc = pymqi.md()
+        while not turn_over():
+            try:
+                if RENDER_POOL is not None:
+                    # the render workers still use the previous one.
+                    msg_desc = pymqi.md()
+                msg_desc['MsgId'] = CMQC.MQMI_NONE
+                msg_desc['CorrelId'] = CMQC.MQCI_NONE
+                msg_data = queue_obj.get(None, msg_desc, get_opts)
+
+                self.output(queue_name, msg_data, msg_desc)
+                count = count + 1
+            except pymqi.MQMIError as e:
+                if e.reason == CMQC.MQRC_NO_MSG_AVAILABLE:
+                    return False
+                raise
+        return True
+
+    def get_batch(self, queue_name, queue_obj, get_opts, max_messages=None):
+        """Get up to max_messages (default mqget_batch_size) messages under
+        syncpoint, or as many as arrive within mqget_batch_interval
+        milliseconds, hand them to the response handler and flush the event
+        writer once.  The messages are only committed after the flush so a
+        failure before that point backs them out onto the queue again
+        (at-least-once delivery).
+
+        If the response handler fails the batch is backed out and its
+        messages are got one at a time afterwards, so that only the message
+        that fails is backed out again.  A message backed out
+        backout_threshold times is moved to the backout queue or discarded.
+
+        Returns (number of messages, False once the queue has no more
+        messages).
+        """
+        if max_messages is None:
+            max_messages = self.mqget_batch_size
+        isolated = self._isolated_gets.get(queue_name, 0)
+        if isolated > 0:
+            max_messages = 1
+            self._isolated_gets[queue_name] = isolated - 1
+
+        options = get_opts["Options"] | CMQC.MQGMO_SYNCPOINT
+        wait_interval = get_opts["WaitInterval"]
+        batch_opts = pymqi.gmo(Options=options, WaitInterval=wait_interval)
+
+        msg_desc = pymqi.md()
+        batch_start = time.time()
+        count = 0
+        more_messages = True
+        batch = None
+        if RENDER_POOL is not None:
+            batch = RenderBatch()
+        handler_error = None
+
+        try:
+            while count < max_messages:
+                if count > 0:
+                    remaining = self.mqget_batch_interval - \
+                        int((time.time() - batch_start) * 1000)
+                    if remaining <= 0:
+                        break
+                    if options & CMQC.MQGMO_WAIT:
+                        # don't wait beyond the end of the batch interval.
+                        batch_opts["WaitInterval"] = min(wait_interval,
+                                                         remaining)
+
+                if batch is not None:
+                    msg_desc = pymqi.md()
+                msg_desc['MsgId'] = CMQC.MQMI_NONE
+                msg_desc['CorrelId'] = CMQC.MQCI_NONE
+                try:
+                    msg_data = queue_obj.get(None, msg_desc, batch_opts)
+                except pymqi.MQMIError as e:
+                    if e.reason == CMQC.MQRC_NO_MSG_AVAILABLE:
+                        more_messages = False
+                        break
+                    raise
+
+                count = count + 1
+                if self.backout_threshold > 0 and \
+                   msg_desc["BackoutCount"] >= self.backout_threshold:
+                    self.skip_message(queue_name, msg_data, msg_desc)
+                    continue
+                try:
+                    self.output(queue_name, msg_data, msg_desc, batch,
+                                syncpoint=True)
+                except:
+                    handler_error = sys.exc_info()[1]
+                    break
+
+            if count > 0:
+                if batch is not None:
+                    # every event of the batch is written before the commit.
+                    try:
+                        batch.wait()
+                    except:
+                        if handler_error is None:
+                            handler_error = sys.exc_info()[1]
+                if handler_error is not None:
+                    raise handler_error
+                EVENT_WRITER.flush()
+                # the archived payloads are written before the messages are
+                # removed from the queue too.
+                flush_archive_writers()
+                self._qm.commit()
+                logging.debug("Committed batch of %i messages from %s",
+                              count, queue_name)
+        except:
+            if count > 0:
+                e = sys.exc_info()[1]
+                logging.error("Backing out batch of %i messages from %s. "
+                              "Exception: %s" % (count, queue_name, str(e)))
+                try:
+                    self._qm.backout()
+                except pymqi.MQMIError as be:
+                    logging.error("MQ Exception occurred during backout: %s " %
+                                  str(be))
+            if handler_error is None:
+                raise
+
+        if handler_error is not None:
+            # the poller carries on with the next messages.
+            self._isolated_gets[queue_name] = count
+            return (0, False)
+
+        return (count, more_messages and count > 0)
+
+    def skip_message(self, queue_name, msg_data, msg_desc):
+        """Move a message that was backed out backout_threshold times to
+        the backout queue, or discard it if there is none.  It is put
+        under syncpoint so that it is only moved with its batch.
+        """
+        msg_id = binascii.hexlify(msg_desc["MsgId"]).decode("ascii")
+        if not self.backout_queue:
+            logging.error("Discarding message %s from %s. It was backed out "
+                          "%i times.", msg_id, queue_name,
+                          msg_desc["BackoutCount"])
+            return
+
+        put_opts = pymqi.pmo(Options=CMQC.MQPMO_SYNCPOINT |
+                             CMQC.MQPMO_FAIL_IF_QUIESCING)
+        self._qm.put1(self.backout_queue, msg_data, msg_desc, put_opts)
+        logging.warning("Moved message %s from %s to %s. It was backed out "
+                        "%i times.", msg_id, queue_name, self.backout_queue,
+                        msg_desc["BackoutCount"])
+
+    def queue_quanta(self, queues):
+        """Return a dict of the number of messages each of the (queue name,
+        queue) pairs may get in its turn.  0 is unlimited.
+        """
+        if not self.queue_depth_weighting:
+            return dict((queue_name, self.queue_quantum_messages)
+                        for (queue_name, queue_obj) in queues)
+
+        depths = {}
+        for (queue_name, queue_obj) in queues:
+            try:
+                depths[queue_name] = \
+                    queue_obj.inquire(CMQC.MQIA_CURRENT_Q_DEPTH)
+            except pymqi.MQMIError as e:
+                logging.debug("Could not inquire the depth of %s: %s",
+                              queue_name, e)
+                depths[queue_name] = 0
+
+        return weighted_quanta(depths, self.queue_quantum_messages)
+
+    def queue_depths(self):
+        """Return a dict of the current depth of the configured local
+        queues, inquired with one PCF command for a generic queue name (or
+        one per queue if the names have no common prefix).  Returns None if
+        the depths could not be inquired.
+        """
+        depths = {}
+        for queue_name in generic_queue_names(self.queue_name_list):
+            try:
+                if self._pcf is None:
+                    self._pcf = pymqi.PCFExecute(self._qm)
+                response = self._pcf.MQCMD_INQUIRE_Q(
+                    {CMQC.MQCA_Q_NAME: queue_name,
+                     CMQC.MQIA_Q_TYPE: CMQC.MQQT_LOCAL,
+                     pymqi.CMQCFC.MQIACF_Q_ATTRS:
+                     [CMQC.MQIA_CURRENT_Q_DEPTH]})
+            except pymqi.MQMIError as e:
+                if is_connection_broken(e):
+                    raise
+                if e.comp == CMQC.MQCC_FAILED and \
+                   e.reason == CMQC.MQRC_UNKNOWN_OBJECT_NAME:
+                    continue
+                logging.warning("Could not inquire the depth of %s.  Polling "
+                                "all the queues.  Exception: %s" %
+                                (queue_name, e))
+                return None
+
+            for attrs in response:
+                name = attrs.get(CMQC.MQCA_Q_NAME, "")
+                if not isinstance(name, str):
+                    name = name.decode("ascii", "replace")
+                depths[name.strip()] = attrs.get(CMQC.MQIA_CURRENT_Q_DEPTH, 0)
+        return depths
+
+    def queues_with_messages(self):
+        """Return the configured queues that have messages, and set the
+        next polling interval.  Queues that are not local queues are always
+        polled.
+        """
+        depths = self.queue_depths()
+        if depths is None:
+            self.poll_interval = self.mqinput_interval
+            return None
+
+        queue_names = [n for n in self.queue_name_list
+                       if depths.get(n) is None or depths[n] > 0]
+        if [n for n in self.queue_name_list if depths.get(n, 0) > 0]:
+            self.poll_interval = self.adaptive_min_interval
+        else:
+            # back off while the queues are empty.
+            self.poll_interval = min(self.poll_interval * 2,
+                                     self.mqinput_interval)
+
+        logging.debug("Adaptive polling: %i of %i queues to poll.  Next poll "
+                      "in %i seconds.", len(queue_names),
+                      len(self.queue_name_list), self.poll_interval)
+        return queue_names
+
+    def poll_queues(self):
+        """Drain the queues in turns of queue_quantum_messages messages or
+        queue_quantum_ms milliseconds per queue until they are all empty, so
+        that a deep queue does not hold up the others.  The queue handles
+        stay open on the pooled connection between polling intervals.
+        """
+        get_opts = pymqi.gmo(Options=CMQC.MQGMO_FAIL_IF_QUIESCING)
+
+        queue_names = None
+        if self.adaptive_polling:
+            queue_names = self.queues_with_messages()
+
+        pending = list(self.open_queues(queue_names))
+        while pending and not self.should_stop():
+            quanta = self.queue_quanta(pending)
+            for (queue_name, queue_obj) in list(pending):
+                if self.should_stop():
+                    break
+
+                more_messages = False
+                try:
+                    more_messages = self.drain_queue(queue_name, queue_obj,
+                                                     get_opts,
+                                                     quanta[queue_name])
+                except pymqi.MQMIError as e:
+                    logging.error("MQ Exception occurred: %s " % (str(e)))
+                    if is_connection_broken(e):
+                        raise
+                    self.handle_queue_error(queue_name, e)
+
+                if not more_messages:
+                    pending.remove((queue_name, queue_obj))
+
+    def consume_queues(self):
+        """Keep the queues open and block in MQGET until a message arrives
+        or the wait interval expires.  When more than one queue is serviced
+        by this thread the wait interval is shared between the queues.
+
+        A queue that fails with an error that is not a connection error is
+        left out for mqinput_interval seconds while the other queues are
+        still consumed.  Queues that could not be opened are opened again
+        every mqinput_interval seconds.
+        """
+        if not self._open_queues:
+            self.open_queues()
+
+        # queue name -> time after which a queue that failed is got from
+        # again.
+        retry_at = {}
+        opened_at = time.time()
+        while not self.should_stop():
+            now = time.time()
+            if len(self._open_queues) < len(self.queue_name_list) and \
+               now - opened_at >= self.mqinput_interval:
+                self.open_queues()
+                opened_at = now
+
+            if not self._open_queues:
+                # nothing could be opened. retry after the polling interval.
+                return
+
+            queues = [(n, q) for (n, q) in self._open_queues
+                      if retry_at.get(n, 0) <= now]
+            if not queues:
+                # every open queue failed recently.
+                wake = [retry_at[n] for (n, q) in self._open_queues]
+                if len(self._open_queues) < len(self.queue_name_list):
+                    wake.append(opened_at + self.mqinput_interval)
+                self.wait(min(wake) - now)
+                continue
+
+            wait_interval = max(1, int(self.mqget_wait_interval /
+                                       len(queues)))
+            get_opts = pymqi.gmo(Options=CMQC.MQGMO_WAIT |
+                                 CMQC.MQGMO_FAIL_IF_QUIESCING,
+                                 WaitInterval=wait_interval)
+
+            quanta = self.queue_quanta(queues)
+            for (queue_name, queue_obj) in queues:
+                if self.should_stop():
+                    return
+
+                try:
+                    self.drain_queue(queue_name, queue_obj, get_opts,
+                                     quanta[queue_name])
+                except pymqi.MQMIError as e:
+                    logging.error("MQ Exception occurred: %s " % (str(e)))
+                    if is_connection_broken(e):
+                        raise
+                    self.handle_queue_error(queue_name, e)
+                    retry_at[queue_name] = time.time() + \
+                        self.mqinput_interval
 
     def run(self):
 
-        while True:
+        while not self.should_stop():
             try:
-                # logging.debug("before connect %s %s %s" %
-                # (self.queue_manager_name, self.server_conn_chl,
-                #  self.socket))
-                pid_fle = open("/tmp/%s_current.pid" %
-                                    (self.config_name.replace("://", "-") +
-                                     "_" + str(self.thread_id)), "r")
-                
-                file_pid = pid_fle.read()
-                pid_fle.close()
-                
-                logging.debug("This pid:" + str(self.getName()) +
-                              " File pid:" + str(file_pid))
-
-                if self.getName().strip() != file_pid.strip():
-                    # logging.debug("$$$$ Stopping... this pid:" +
-                    # str(self.getName()) + " File pid:" + str(file_pid))
-                    done = True
-                    sys.exit(1)
-                else:
-                    pass
-                    # logging.debug("!!! NOT Stopping... this pid:" +
-                    # str(self.getName()) + " File pid:" + str(file_pid))
-
-                cd = pymqi.cd()
-                #set the max message length to maximum
-                cd["MaxMsgLength"] = 104857600
-
-                if self._qm is None:
-                    self._qm = pymqi.QueueManager(None)
-                    logging.debug("(1)Connecting to " +
-                                str(self.queue_manager_name) + 
-                                " using channel " +
-                                str(self.server_conn_chl) + 
-                                " and address " + 
-                                self.socket + ".")
-
-                    self._qm.connect_tcp_client(self.queue_manager_name, cd,
-                                              self.server_conn_chl,
-                                              self.socket, 
-                                              self.mq_user_name,
-                                              self.mq_password)
-
-                    logging.debug("(1)Successfully Connected to " +
-                                str(self.queue_manager_name) + 
-                                " using channel " +
-                                str(self.server_conn_chl) + 
-                                " and address " + 
-                                self.socket + ".")
+                if not self.connect():
+                    break
+
+                if self.use_mqget_wait:
+                    # only returns if none of the queues could be opened
+                    # or the input is stopping.
+                    self.consume_queues()
                 else:
-                    if not self.persistent_connection:
-                        self._qm = pymqi.QueueManager(None)
-                        logging.debug("(2)Connecting to " +
-                                str(self.queue_manager_name) + 
-                                " using channel " +
-                                str(self.server_conn_chl) + 
-                                " and address " + 
-                                self.socket + ".")
-
-                        self._qm.connect_tcp_client(self.queue_manager_name, cd,
-                                                  self.server_conn_chl,
-                                                  self.socket,
-                                                  self.mq_user_name,
-                                                  self.mq_password)
-                                                  
-                        logging.debug("(2)Successfully Connected to " +
-                                  str(self.queue_manager_name) + 
-                                  " using channel " +
-                                  str(self.server_conn_chl) + 
-                                  " and address " + 
-                                  self.socket + ".")
-                    else:
-                        if not self._qm._is_connected():
-                            self._qm = pymqi.QueueManager(None)
-                            logging.debug("(3)Connecting to " +
-                                str(self.queue_manager_name) + 
-                                " using channel " +
-                                str(self.server_conn_chl) + 
-                                " and address " + 
-                                self.socket + ".")
-                            
-                            self._qm.connect_tcp_client(self.queue_manager_name,
-                                                      cd,
-                                                      self.server_conn_chl,
-                                                      self.socket,
-                                                      self.mq_user_name,
-                                                      self.mq_password)
-                            logging.debug("(3)Successfully Connected to " +
-                                self.queue_manager_name + 
-                                " using channel " +
-                                self.server_conn_chl + 
-                                " and address " + 
-                                self.socket + ".")
-
-                queues = []
-                logging.debug("Queue name list: %s" %
-                              str(self.queue_name_list))
-
-                for queue_name in self.queue_name_list:
-                    try:
-                        queues.append((queue_name,
-                                       pymqi.Queue(self._qm,
-                                                   queue_name,
-                                                   CMQC.MQOO_INPUT_SHARED)))
-                        # logging.debug("queue loop.  queue name:" +
-                        #               str(queue_name))
-                    except Exception as ex:
-                        logging.error("Unable to open queue:" +
-                                      str(queue_name) +
-                                      " Exception: " +
-                                      str(ex))
-
-                get_opts = pymqi.gmo(Options=CMQC.MQGMO_FAIL_IF_QUIESCING)
-
-                # logging.debug("after get_opts")
-                msg_desc = pymqi.md()
-                # logging.debug("Start get")
-                for (queue_name, queue_obj) in queues:
-                    # logging.debug("queue = %s " % queue_name)
-                    # logging.debug("Current tid:" +
-                    #                str(self.getName()) +
-                    #                " queue:" + queue_name)
-                    # logging.debug("Check pid: queue:" + queue_name)
-
-                    file_pid = str(open("/tmp/%s_current.pid" %
-                                        (self.config_name.replace("://", "-") +
-                                         "_" +
-                                         str(self.thread_id)), "r").read())
-                    # logging.debug("%%%%%% this pid:" + str(self.getName()) +
-                    #              " File pid:" + str(file_pid))
-                    if self.getName().strip() != file_pid.strip():
-                        # logging.debug("$$$$ Stopping... this pid:" +
-                        #               str(self.getName()) +
-                        #               " File pid:" + str(file_pid))
-                        done = True
-                        sys.exit(1)
-                    else:
-                        pass
-                        # logging.debug("!!! NOT Stopping... this pid:" +
-                        #               str(self.getName()) + " File pid:" +
-                        #               str(file_pid))
-
-                    done = False
-                    while not done:
-
-                        try:
-
-                            logging.debug("Before MQGET")
-                            msg_desc['MsgId'] = CMQC.MQMI_NONE
-                            msg_desc['CorrelId'] = CMQC.MQCI_NONE
-                            msg_data = queue_obj.get(None, msg_desc, get_opts)
-                            logging.debug("Got message. ")
-                            # MQMD:" + str(msg_desc.get()) + "MSG:" + msg_data)
-
-                            handle_output(self.splunk_host,
-                                          self.config_name,
-                                          self.queue_manager_name,
-                                          queue_name, msg_data,
-                                          msg_desc, **self.kw)
-                            logging.debug("Handled output")
-                        except pymqi.MQMIError as e:
-                            if e.reason == 2033:
-                                logging.debug("Done! 2033. No more messages!")
-                                done = True
-                            else:
-                                logging.error("MQ Exception occurred: %s " %
-                                              (str(e)))
-                                done = True
-
-                    queue_obj.close()
+                    self.poll_queues()
 
                 if not self.persistent_connection:
-                    self._qm.disconnect()
+                    self.disconnect()
             except pymqi.MQMIError as e:
-                if e.reason == 2033:
+                if e.reason == CMQC.MQRC_NO_MSG_AVAILABLE:
                     pass
                 else:
                     logging.error("MQ Exception occurred: %s " % (str(e)))
-                    if self._qm is not None:
-                        if not self.persistent_connection \
-                           and self._qm._is_connected():
-                            self._qm.disconnect()
+                    if is_connection_broken(e):
+                        self.disconnect(broken=True)
+                    elif self.use_mqget_wait or \
+                            not self.persistent_connection:
+                        # the queue handles stay cached on the pooled
+                        # connection unless the error invalidated them.
+                        self.disconnect()
 
             except:  # catch *all* exceptions
                 e = sys.exc_info()[1]
                 logging.error("Stopping. Exception in QueuePoller: %s" %
                               str(e))
+                self.disconnect()
                 sys.exit(1)
 
-            time.sleep(float(self.mqinput_interval))
+            self.wait(float(self.poll_interval))
+
+        logging.debug("Queue poller %s stopping.", self.getName())
+        self.disconnect()
 
 
 # class MQTriggerThread(threading.Thread):
@@ -593,24 +1541,251 @@ class QueuePollerThread(threading.Thread):
 #         pass
 
 
+class QueueAutoScaler(threading.Thread):
+    """
+    Adds getter threads to a queue while its depth or the age of its oldest
+    message is over a threshold and retires them once the queue is empty.
+    The queues are checked with one PCF inquire queue status command for
+    their generic name, or one per queue (see generic_queue_names).
+
+    new_poller - Called with (queue name, thread id) to create a poller
+    thread for one queue.
+    pollers - The list of all the poller threads of the input.  Started
+    pollers are appended to it and stopped ones are removed.
+    min_threads, max_threads - Bounds of the number of pollers per queue.
+    depth_threshold - Add a poller while the depth is at least this.
+    age_threshold - Add a poller while the oldest message is at least this
+    many seconds old.  0 disables it.
+    interval - Check the queues every this many seconds.
+    """
+
+    def __init__(self, new_poller, pollers, queue_names, min_threads=1,
+                 max_threads=4, depth_threshold=1000, age_threshold=0,
+                 interval=30):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.new_poller = new_poller
+        self.pollers = pollers
+        self.queue_names = queue_names
+        self.min_threads = max(1, min_threads)
+        self.max_threads = max(self.min_threads, max_threads)
+        self.depth_threshold = depth_threshold
+        self.age_threshold = age_threshold
+        self.interval = interval
+
+        self.queue_pollers = dict((q, []) for q in queue_names)
+        self._thread_ids = itertools.count()
+        self._connect_args = None
+
+    def start_pollers(self):
+        """Start min_threads pollers for every queue."""
+        for queue_name in self.queue_names:
+            for i in range(self.min_threads):
+                self.add_poller(queue_name)
+
+    def add_poller(self, queue_name):
+        poller = self.new_poller(queue_name, next(self._thread_ids))
+        if self._connect_args is None:
+            self._connect_args = (poller.queue_manager_name,
+                                  poller.queue_manager_host, poller.port,
+                                  poller.server_conn_chl, poller.mq_user_name,
+                                  poller.mq_password)
+        poller.start()
+        self.queue_pollers[queue_name].append(poller)
+        self.pollers.append(poller)
+
+    def retire_poller(self, queue_name):
+        self.queue_pollers[queue_name].pop().retire()
+
+    def queue_status(self):
+        """Return a dict of (current depth, oldest message age) of the
+        queues.  The age is -1 if queue monitoring is off.  Queues that are
+        not local queues are left out.
+        """
+        conn = CONNECTION_POOL.acquire(*self._connect_args)
+        if conn is None:
+            return {}
+
+        broken = False
+        response = []
+        try:
+            pcf = pymqi.PCFExecute(conn.qm)
+            try:
+                for queue_name in generic_queue_names(self.queue_names):
+                    try:
+                        response.extend(pcf.MQCMD_INQUIRE_Q_STATUS(
+                            {CMQC.MQCA_Q_NAME: queue_name,
+                             pymqi.CMQCFC.MQIACF_Q_STATUS_ATTRS:
+                             [CMQC.MQIA_CURRENT_Q_DEPTH,
+                              pymqi.CMQCFC.MQIACF_OLDEST_MSG_AGE]}))
+                    except pymqi.MQMIError as e:
+                        if is_connection_broken(e) or \
+                           queue_name.endswith("*"):
+                            raise
+                        logging.debug("Could not inquire the status of %s: "
+                                      "%s", queue_name, e)
+            finally:
+                pcf.disconnect()
+        except pymqi.MQMIError as e:
+            broken = is_connection_broken(e)
+            raise
+        finally:
+            CONNECTION_POOL.release(conn, broken)
+
+        status = {}
+        for attrs in response:
+            name = attrs.get(CMQC.MQCA_Q_NAME, "")
+            if not isinstance(name, str):
+                name = name.decode("ascii", "replace")
+            status[name.strip()] = (
+                attrs.get(CMQC.MQIA_CURRENT_Q_DEPTH, 0),
+                attrs.get(pymqi.CMQCFC.MQIACF_OLDEST_MSG_AGE, -1))
+        return status
+
+    def scale(self):
+        # the list is shared with wait_for_shutdown so it is changed in
+        # place.  retired pollers stay in it until they have stopped.
+        self.pollers[:] = [p for p in self.pollers if p.is_alive()]
+
+        status = self.queue_status()
+        for queue_name in self.queue_names:
+            pollers = self.queue_pollers[queue_name]
+            # pollers that stopped because of an error are replaced.
+            pollers[:] = [p for p in pollers if p.is_alive()]
+            while len(pollers) < self.min_threads:
+                self.add_poller(queue_name)
+
+            if queue_name not in status:
+                continue
+            (depth, age) = status[queue_name]
+
+            backlog = depth >= self.depth_threshold or \
+                (self.age_threshold > 0 and age >= self.age_threshold)
+            if backlog and len(pollers) < self.max_threads:
+                self.add_poller(queue_name)
+            elif depth == 0 and len(pollers) > self.min_threads:
+                self.retire_poller(queue_name)
+            else:
+                continue
+
+            logging.info("Auto-scaler: queue=%s depth=%i oldest_msg_age=%i "
+                         "getter_threads=%i", queue_name, depth, age,
+                         len(pollers))
+
+    def run(self):
+        while not SHUTDOWN_EVENT.wait(float(self.interval)):
+            try:
+                self.scale()
+            except pymqi.MQMIError as e:
+                logging.error("Auto-scaler MQ Exception occurred: %s " %
+                              str(e))
+            except:  # catch *all* exceptions
+                e = sys.exc_info()[1]
+                logging.error("Exception occurred in the auto-scaler: %s" %
+                              str(e))
+
+
+def generic_queue_names(queue_names):
+    '''Return the names to inquire the queues with: the generic name made
+    of the common prefix of the queue names, or the queue names themselves
+    if there is only one or the prefix is shorter than MIN_GENERIC_PREFIX.
+    '''
+    if len(set(queue_names)) == 1:
+        return [queue_names[0]]
+    prefix = os.path.commonprefix(queue_names)
+    if len(prefix) < MIN_GENERIC_PREFIX:
+        return sorted(set(queue_names))
+    return [prefix + "*"]
+
+
+def held_connections(queue_count, start_process_per_queue,
+                     number_of_processes, use_mqget_wait, autoscale=0,
+                     autoscale_max_threads=4):
+    '''Return the number of connections the getter threads of an input
+    process keep while they wait in MQGET.  Polling threads release their
+    connections between the polling intervals so they need none.  The
+    auto-scaler needs one more for its inquiries.
+    '''
+    if not use_mqget_wait:
+        return 0
+    if not start_process_per_queue:
+        return max(1, number_of_processes)
+    if autoscale:
+        return autoscale_max_threads * queue_count + 1
+    return max(1, number_of_processes) * queue_count
+
+
+def weighted_quanta(depths, quantum):
+    '''Return a dict of the quantum of every queue in the depths dict.
+    Every queue gets at least quantum messages per turn, deeper queues get a
+    share of quantum times the number of queues in proportion to their
+    depth.
+    '''
+    total = sum(depths.values())
+    quanta = {}
+    for (queue_name, depth) in depths.items():
+        share = 0
+        if total > 0:
+            share = int(quantum * len(depths) * depth / total)
+        quanta[queue_name] = max(quantum, share)
+    return quanta
+
+
 # prints validation error data to be consumed by Splunk
 def print_validation_error(s):
     print("<error><message>%s</message></error>" % xml.sax.saxutils.escape(s))
 
 
-def handle_output(splunk_host, name, queue_manager_name, queue, msg_desc,
-                  msg_data, **kw):
-
+def handle_output(splunk_host, name, queue_manager_name, queue, msg_data,
+                  msg_desc, **kw):
+    """Pass the message to the response handler.  The events are written
+    to stdout by the event writer.  Errors of the response handler are
+    logged.
+    """
     try:
-        RESPONSE_HANDLER_INSTANCE(splunk_host, name, queue_manager_name, queue,
-                                  msg_desc, msg_data, **kw)
-        sys.stdout.flush()
+        render_output(splunk_host, name, queue_manager_name, queue, msg_data,
+                      msg_desc, **kw)
     except:
         e = sys.exc_info()[1]
         logging.error("Exception occurred while handling response output: %s" %
                       str(e))
 
 
+def render_output(splunk_host, name, queue_manager_name, queue, msg_data,
+                  msg_desc, **kw):
+    """handle_output that raises the errors of the response handler, so
+    that a syncpoint batch with a message that could not be handled is
+    backed out.
+    """
+    if TRACE_SAMPLE_RATE > 0 and \
+       next(TRACE_COUNTER) % TRACE_SAMPLE_RATE == 0:
+        trace_output(splunk_host, name, queue_manager_name, queue, msg_data,
+                     msg_desc, **kw)
+        return
+
+    RESPONSE_HANDLER_INSTANCE(splunk_host, name, queue_manager_name, queue,
+                              msg_data, msg_desc, **kw)
+
+
+def trace_output(splunk_host, name, queue_manager_name, queue, msg_data,
+                 msg_desc, **kw):
+    """render_output for a sampled message.  Logs the message details and
+    the time taken by the response handler.
+    """
+    start = time.time()
+    try:
+        RESPONSE_HANDLER_INSTANCE(splunk_host, name, queue_manager_name, queue,
+                                  msg_data, msg_desc, **kw)
+    finally:
+        logging.info("TRACE queue_manager=%s queue=%s thread=%s msg_id=%s "
+                     "length=%i put_date=%s put_time=%s handler_ms=%.3f",
+                     queue_manager_name, queue,
+                     threading.current_thread().name,
+                     binascii.hexlify(msg_desc["MsgId"]).decode("ascii"),
+                     len(msg_data), msg_desc["PutDate"], msg_desc["PutTime"],
+                     (time.time() - start) * 1000)
+
+
 def usage():
     print("usage: mqinput.py [--scheme|--validate-arguments]")
     logging.error("Incorrect Program Usage")
@@ -641,20 +1816,20 @@ def get_input_config():
             if stanza:
                 stanza_name = stanza.getAttribute("name")
                 if stanza_name:
-                    logging.debug("XML: found stanza " + stanza_name)
+                    logging.debug("XML: found stanza %s", stanza_name)
                     config["name"] = stanza_name
 
                     params = stanza.getElementsByTagName("param")
                     for param in params:
                         param_name = param.getAttribute("name")
-                        logging.debug("XML: found param '%s'" % param_name)
+                        logging.debug("XML: found param '%s'", param_name)
                         if param_name and param.firstChild and \
                            param.firstChild.nodeType == \
                            param.firstChild.TEXT_NODE:
                             data = param.firstChild.data
                             config[param_name] = data
-                            logging.debug("XML: '%s' -> '%s'" %
-                                          (param_name, data))
+                            logging.debug("XML: '%s' -> '%s'",
+                                          param_name, data)
 
         checkpnt_node = root.getElementsByTagName("checkpoint_dir")[0]
         if checkpnt_node and checkpnt_node.firstChild and \
@@ -697,7 +1872,7 @@ def get_validation_config():
         params_node = item_node.getElementsByTagName("param")
         for param in params_node:
             name = param.getAttribute("name")
-            logging.debug("Found param %s" % name)
+            logging.debug("Found param %s", name)
             if name and param.firstChild and \
                param.firstChild.nodeType == param.firstChild.TEXT_NODE:
                 val_data[name] = param.firstChild.data
@@ -0,0 +1,617 @@
+'''
+IBM Websphere MQ Modular Input for Splunk
+Hannes Wagener - 2015
+
+Archive of the message payloads written by the response handlers and read
+back by the getbrkevt and getbrkerrs search commands, and the lookup of
+payloads that were stored in MongoDB.
+
+Payloads are appended to rolling segment files in
+<folder>/<queue manager>/<queue>/<yyyymmdd>/ instead of one file per
+message.  Every segment has an index file with one "msg_id offset length"
+line per payload.  Events locate their payload with the segment file name,
+offset and length.
+
+DISCLAIMER
+You are free to use this code in any way you like, subject to the
+Python & IBM disclaimers & copyrights. I make no representations
+about the suitability of this software for any purpose. It is
+provided "AS-IS" without warranty of any kind, either express or
+implied.
+
+'''
+from __future__ import print_function
+
+import atexit
+import base64
+import collections
+import gzip
+import io
+import itertools
+import logging
+import mmap
+import os
+import threading
+import time
+import zlib
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+try:
+    import queue as Queue
+except ImportError:
+    import Queue
+
+
+INDEX_SUFFIX = ".idx"
+
+
+def gzip_compress(data):
+    '''gzip.compress, which python 2 does not have.'''
+    if hasattr(gzip, "compress"):
+        return gzip.compress(data)
+    out = io.BytesIO()
+    f = gzip.GzipFile(fileobj=out, mode="wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return out.getvalue()
+
+
+def gzip_decompress(data):
+    '''gzip.decompress, which python 2 does not have.'''
+    if hasattr(gzip, "decompress"):
+        return gzip.decompress(data)
+    f = gzip.GzipFile(fileobj=io.BytesIO(data), mode="rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class ArchiveReader(object):
+    """
+    Reads the payloads of a batch of search results.
+
+    The results are grouped by file so every segment file is opened and
+    mapped once, and every folder of the old one file per message layout
+    is listed once instead of checking each file with os.path.exists.  The
+    files are read on a thread pool and the decompressed payloads are kept
+    in a cache keyed by file name.
+
+    max_workers - Number of files read at the same time.
+    cache_bytes - Size of the decompressed payload cache.
+    """
+
+    def __init__(self, max_workers=8, cache_bytes=67108864):
+        self.max_workers = max_workers
+        self.cache_bytes = cache_bytes
+
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        self._folders = {}
+
+    def read(self, locators):
+        """Return the payloads of a list of locators in the same order.
+
+        A locator is a (segment, offset, length) tuple, a (file_name,)
+        tuple for a file of the old layout, where file_name.gz is tried as
+        well, or None.  The payload of a locator that can not be read is
+        None.
+        """
+        payloads = [None] * len(locators)
+        reads = collections.OrderedDict()
+
+        for (i, locator) in enumerate(locators):
+            if not locator:
+                continue
+            if len(locator) == 3:
+                (file_name, offset, length) = locator
+            else:
+                file_name = self.find_file(locator[0])
+                if file_name is None:
+                    continue
+                (offset, length) = (None, None)
+
+            payload = self.cached((file_name, offset))
+            if payload is not None:
+                payloads[i] = payload
+            else:
+                reads.setdefault(file_name, []).append((i, offset, length))
+
+        if not reads:
+            return payloads
+
+        if ThreadPoolExecutor is None or self.max_workers <= 1 or \
+                len(reads) == 1:
+            for (file_name, wanted) in reads.items():
+                self.read_file(file_name, wanted, payloads)
+        else:
+            executor = ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(reads)))
+            try:
+                futures = [executor.submit(self.read_file, file_name,
+                                           wanted, payloads)
+                           for (file_name, wanted) in reads.items()]
+                for future in futures:
+                    future.result()
+            finally:
+                executor.shutdown()
+
+        return payloads
+
+    def find_file(self, file_name):
+        """Return the name of the old layout file, or its .gz, that
+        exists.  Every folder is listed only once.
+        """
+        (folder, name) = os.path.split(file_name)
+        names = self._folders.get(folder)
+        if names is None:
+            try:
+                names = set(os.listdir(folder or "."))
+            except OSError:
+                names = set()
+            self._folders[folder] = names
+
+        if name in names:
+            return file_name
+        if name + ".gz" in names:
+            return file_name + ".gz"
+        return None
+
+    def read_file(self, file_name, wanted, payloads):
+        """Read the wanted (index, offset, length) records of a file into
+        payloads.  An offset of None is the whole file.
+        """
+        try:
+            f = open(file_name, "rb")
+        except Exception as ex:
+            logging.error("Failed to open payload file %s. %s" %
+                          (file_name, str(ex)))
+            return
+
+        data = None
+        try:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # empty files can not be mapped.
+                data = f.read()
+
+            compressed = file_name.endswith(".gz")
+            for (i, offset, length) in wanted:
+                key = (file_name, offset)
+                payload = self.cached(key)
+                if payload is None:
+                    try:
+                        if offset is None:
+                            payload = data[:]
+                        else:
+                            payload = data[offset:offset + length]
+                        if compressed:
+                            payload = gzip_decompress(payload)
+                        self.cache(key, payload)
+                    except Exception as ex:
+                        logging.error("Failed to read payload from %s. %s" %
+                                      (file_name, str(ex)))
+                        continue
+                payloads[i] = payload
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+            f.close()
+
+    def cached(self, key):
+        self._lock.acquire()
+        try:
+            payload = self._cache.get(key)
+            if payload is not None:
+                self._cache.pop(key)
+                self._cache[key] = payload
+            return payload
+        finally:
+            self._lock.release()
+
+    def cache(self, key, payload):
+        if len(payload) > self.cache_bytes:
+            return
+        self._lock.acquire()
+        try:
+            if key in self._cache:
+                return
+            self._cache[key] = payload
+            self._cached_bytes = self._cached_bytes + len(payload)
+            while self._cached_bytes > self.cache_bytes:
+                (old_key, old_payload) = self._cache.popitem(last=False)
+                self._cached_bytes = self._cached_bytes - len(old_payload)
+        finally:
+            self._lock.release()
+
+
+# Environment variables that point the search commands at another MongoDB,
+# eg. a local mongod when testing.  TA_MQ_MONGODB_URI=mongomock:// uses an
+# in memory mongomock client.
+MONGODB_URI_ENV = "TA_MQ_MONGODB_URI"
+MONGODB_DB_ENV = "TA_MQ_MONGODB_DB"
+
+
+def connect_mongodb(host, port, db_name):
+    '''Return the MongoDB database the payloads are stored in.
+    '''
+    uri = os.environ.get(MONGODB_URI_ENV)
+    db_name = os.environ.get(MONGODB_DB_ENV, db_name)
+
+    if uri is not None and uri.startswith("mongomock:"):
+        import mongomock
+        return mongomock.MongoClient()[db_name]
+
+    import pymongo
+    if uri:
+        return pymongo.MongoClient(uri)[db_name]
+    return pymongo.MongoClient(host, port)[db_name]
+
+
+def decode_mongodb_payload(msg_data):
+    return zlib.decompress(base64.b64decode(msg_data))
+
+
+def fetch_mongodb_payloads(db, keys, chunk_size=500, max_workers=8):
+    """Return the payloads of a list of (collection, mongoid) keys in the
+    same order.
+
+    The ids of a collection are fetched with one find per chunk_size ids
+    and the payloads are decompressed on a thread pool.  The payload of a
+    key that is None, is not a valid id or is not found is None.
+    """
+    from bson.objectid import ObjectId
+
+    payloads = [None] * len(keys)
+    collections_ids = collections.OrderedDict()
+    for (i, key) in enumerate(keys):
+        if key is None:
+            continue
+        (collection, msg_id) = key
+        if msg_id is None or len(msg_id) != 24:
+            continue
+        try:
+            object_id = ObjectId(msg_id)
+        except Exception:
+            continue
+        collections_ids.setdefault(collection, collections.OrderedDict()) \
+            .setdefault(object_id, []).append(i)
+
+    found = []
+    for (collection, ids) in collections_ids.items():
+        id_list = list(ids.keys())
+        for start in range(0, len(id_list), chunk_size):
+            try:
+                cursor = db[collection].find(
+                    {"_id": {"$in": id_list[start:start + chunk_size]}},
+                    {"msg_data": 1})
+                for msg_doc in cursor:
+                    if "msg_data" in msg_doc:
+                        found.append((ids[msg_doc["_id"]], msg_doc["msg_data"]))
+            except Exception as ex:
+                logging.error("Exception while fetching messages from %s. "
+                              "Exception: %s" % (collection, str(ex)))
+
+    if not found:
+        return payloads
+
+    def decode(item):
+        try:
+            return decode_mongodb_payload(item[1])
+        except Exception as ex:
+            logging.error("Exception while decoding message. Exception: %s" %
+                          str(ex))
+            return None
+
+    if ThreadPoolExecutor is None or max_workers <= 1 or len(found) == 1:
+        decoded = [decode(item) for item in found]
+    else:
+        executor = ThreadPoolExecutor(max_workers=min(max_workers,
+                                                      len(found)))
+        try:
+            decoded = list(executor.map(decode, found))
+        finally:
+            executor.shutdown()
+
+    for ((indexes, msg_data), payload) in zip(found, decoded):
+        for i in indexes:
+            payloads[i] = payload
+
+    return payloads
+
+
+class ArchiveWriter(object):
+    """
+    Appends payloads to rolling segment files from a background thread.
+    write() only compresses the payload and reserves its offset, so the
+    MQGET threads never wait for the disk unless the queue is full.
+
+    Compressed payloads are written as separate gzip members so a whole
+    segment can also be read with gunzip.
+
+    folder - Root folder of the archive.
+    prefix - Segment file name prefix.
+    compress - gzip every payload.
+    max_segment_bytes - Start a new segment once a segment is this big.
+    max_queue_size - Number of payloads that may wait for the writer thread.
+    """
+
+    def __init__(self, folder, prefix, compress=True,
+                 max_segment_bytes=67108864, max_queue_size=1000):
+        self.folder = folder
+        self.prefix = prefix
+        self.compress = compress
+        self.max_segment_bytes = max_segment_bytes
+        self.extension = ".gz" if compress else ".xml"
+
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue(max(1, max_queue_size))
+        self._segment_numbers = itertools.count(1)
+        # sequence number of the last payload queued, of the payloads that
+        # could not be written and of the last payload each thread flushed.
+        self._seq = 0
+        self._failed_seqs = []
+        self._flushed_seqs = {}
+        # (queue manager, queue) -> [folder, segment, next offset]
+        self._segments = {}
+        self._thread = None
+
+        # only used by the writer thread.
+        self._known_folders = set()
+        self._files = {}
+
+        self.record_count = 0
+        self.byte_count = 0
+        self.segment_count = 0
+        self.error_count = 0
+        self.queue_full_count = 0
+
+    def write(self, queue_manager_name, queue, msg_id, payload):
+        """Queue a payload to be archived and return its
+        (segment, offset, length) locator.
+        """
+        if self.compress:
+            record = gzip_compress(payload)
+        else:
+            record = payload
+
+        folder = os.path.join(self.folder, queue_manager_name, queue,
+                              time.strftime("%Y%m%d"))
+        rolled = None
+        self._lock.acquire()
+        try:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+            segment = self._segments.get((queue_manager_name, queue))
+            if segment is None or segment[0] != folder or \
+                    (segment[2] > 0 and
+                     segment[2] + len(record) > self.max_segment_bytes):
+                if segment is not None:
+                    rolled = segment[1]
+                segment = [folder, self.segment_name(folder), 0]
+                self._segments[(queue_manager_name, queue)] = segment
+                self.segment_count = self.segment_count + 1
+
+            offset = segment[2]
+            segment[2] = offset + len(record)
+            self._seq = self._seq + 1
+            seq = self._seq
+        finally:
+            self._lock.release()
+
+        if self._queue.full():
+            self.queue_full_count = self.queue_full_count + 1
+        if rolled is not None:
+            self._queue.put(("close", None, (rolled,)))
+        self._queue.put(("write", seq, (segment[1], offset, msg_id, record)))
+
+        return (segment[1], offset, len(record))
+
+    def segment_name(self, folder):
+        return os.path.join(folder, "%s_%s_%i_%i%s" % (
+            self.prefix, time.strftime("%H%M%S"), os.getpid(),
+            next(self._segment_numbers), self.extension))
+
+    def flush(self):
+        """Block until every payload queued before the call is written.
+        Raises IOError if a payload queued since the previous flush of the
+        calling thread could not be written.  With render workers the
+        payloads of other threads are included too, so an error may back
+        out more than the batch it belongs to but it is never missed.
+        """
+        thread = threading.current_thread()
+        self._lock.acquire()
+        try:
+            if self._thread is None:
+                return
+            seq = self._seq
+            since = self._flushed_seqs.get(thread, 0)
+        finally:
+            self._lock.release()
+
+        # wait for a marker rather than for the queue to be empty, which
+        # may never happen while other threads keep writing.
+        marker = threading.Event()
+        self._queue.put(("flush", None, (marker,)))
+        while not marker.wait(1.0):
+            writer_thread = self._thread
+            if writer_thread is None or not writer_thread.is_alive():
+                raise IOError("Payload archive writer %s stopped." %
+                              self.folder)
+
+        self._lock.acquire()
+        try:
+            failed = len([s for s in self._failed_seqs if since < s <= seq])
+            self._flushed_seqs[thread] = seq
+            self._prune_failed_seqs()
+        finally:
+            self._lock.release()
+
+        if failed > 0:
+            raise IOError("Failed to archive %i payloads in %s." %
+                          (failed, self.folder))
+
+    def _prune_failed_seqs(self):
+        # must be called with the lock held.  the failures every live
+        # thread has flushed past are no longer needed.
+        for thread in list(self._flushed_seqs.keys()):
+            if not thread.is_alive():
+                del self._flushed_seqs[thread]
+        if self._flushed_seqs:
+            low = min(self._flushed_seqs.values())
+            self._failed_seqs = [s for s in self._failed_seqs if s > low]
+
+    def close(self):
+        """Write the queued payloads and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(30.0)
+        self._thread = None
+
+    def log_stats(self):
+        if self.record_count > 0 or self.error_count > 0:
+            logging.info("Payload archive %s: records=%i bytes=%i segments=%i "
+                         "errors=%i queue_full=%i" %
+                         (self.folder, self.record_count, self.byte_count,
+                          self.segment_count, self.error_count,
+                          self.queue_full_count))
+
+    def _run(self):
+        done = False
+        while not done:
+            items = [self._queue.get()]
+            # write everything that is queued before flushing the files.
+            try:
+                while len(items) < 1000:
+                    items.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
+
+            written = []
+            failed = []
+            markers = []
+            for item in items:
+                if item is None:
+                    done = True
+                elif item[0] == "close":
+                    self._close_segment(*item[2])
+                elif item[0] == "flush":
+                    markers.append(item[2][0])
+                elif self._write_record(*item[2]):
+                    written.append(item[1])
+                else:
+                    failed.append(item[1])
+
+            for (data_file, index_file) in self._files.values():
+                try:
+                    data_file.flush()
+                    index_file.flush()
+                except Exception as ex:
+                    logging.error("Failed to flush payload archive. " +
+                                  str(ex))
+                    # not known which of the records were written.
+                    self.error_count = self.error_count + len(written)
+                    failed.extend(written)
+                    written = []
+
+            if failed:
+                self._lock.acquire()
+                self._failed_seqs.extend(failed)
+                self._lock.release()
+
+            for marker in markers:
+                marker.set()
+
+        for segment in list(self._files.keys()):
+            self._close_segment(segment)
+
+    def _write_record(self, segment, offset, msg_id, record):
+        # returns False if the record could not be written.
+        try:
+            files = self._files.get(segment)
+            if files is None:
+                folder = os.path.dirname(segment)
+                if folder not in self._known_folders:
+                    if not os.path.isdir(folder):
+                        os.makedirs(folder)
+                    self._known_folders.add(folder)
+
+                # records may arrive out of order so the file is not opened
+                # in append mode.
+                fd = os.open(segment, os.O_WRONLY | os.O_CREAT, 0o644)
+                files = (os.fdopen(fd, "wb"),
+                         open(segment + INDEX_SUFFIX, "a"))
+                self._files[segment] = files
+
+            files[0].seek(offset)
+            files[0].write(record)
+            files[1].write("%s %i %i\n" % (msg_id, offset, len(record)))
+
+            self.record_count = self.record_count + 1
+            self.byte_count = self.byte_count + len(record)
+            return True
+        except Exception as ex:
+            self.error_count = self.error_count + 1
+            logging.error("Failed to archive payload %s. %s" %
+                          (msg_id, str(ex)))
+            return False
+
+    def _close_segment(self, segment):
+        files = self._files.pop(segment, None)
+        if files is None:
+            return
+        for f in files:
+            try:
+                f.close()
+            except Exception as ex:
+                logging.error("Failed to close payload archive segment " +
+                              "%s. %s" % (segment, str(ex)))
+
+
+# archive writers shared by the response handlers of a process.
+ARCHIVE_WRITERS = {}
+ARCHIVE_WRITERS_LOCK = threading.Lock()
+
+
+def get_archive_writer(folder, prefix, compress=True,
+                       max_segment_bytes=67108864):
+    """Return the archive writer for folder and prefix, creating it if
+    needed.
+    """
+    ARCHIVE_WRITERS_LOCK.acquire()
+    try:
+        key = (folder, prefix, compress)
+        writer = ARCHIVE_WRITERS.get(key)
+        if writer is None:
+            writer = ArchiveWriter(folder, prefix, compress=compress,
+                                   max_segment_bytes=max_segment_bytes)
+            ARCHIVE_WRITERS[key] = writer
+        return writer
+    finally:
+        ARCHIVE_WRITERS_LOCK.release()
+
+
+def flush_archive_writers():
+    for writer in list(ARCHIVE_WRITERS.values()):
+        writer.flush()
+
+
+def close_archive_writers():
+    for writer in list(ARCHIVE_WRITERS.values()):
+        writer.close()
+        writer.log_stats()
+
+
+atexit.register(close_archive_writers)
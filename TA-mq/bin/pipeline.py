@@ -0,0 +1,351 @@
+'''
+IBM Websphere MQ Modular Input for Splunk
+Hannes Wagener - 2015
+
+Hand-off between the threads that get the messages from the queues and the
+threads that call the response handler, and between the worker processes
+and the process that writes their events to splunkd.
+
+DISCLAIMER
+You are free to use this code in any way you like, subject to the
+Python & IBM disclaimers & copyrights. I make no representations
+about the suitability of this software for any purpose. It is
+provided "AS-IS" without warranty of any kind, either express or
+implied.
+
+'''
+from __future__ import print_function
+
+import collections
+import logging
+import sys
+import threading
+import time
+
+
+# queued by RenderPool.close() to stop a renderer thread.
+STOP_RENDERER = object()
+
+# sent back to a worker process by forward_output for every document.
+DOCUMENT_WRITTEN = b"ok"
+DOCUMENT_FAILED = b"failed"
+
+
+class HandoffQueue(object):
+    """
+    A queue bounded by the number of items and by the number of bytes of
+    the items.  put() blocks while the queue is full, which holds back the
+    getter threads until the renderer threads have caught up.
+
+    max_items - Maximum number of items in the queue.
+    max_bytes - Maximum number of bytes in the queue.  An item bigger than
+    this is accepted once the queue is empty.
+    stop_event - threading.Event that stops put() from waiting, so that no
+    message already taken from a queue is lost when the input stops.
+    """
+
+    def __init__(self, max_items=1000, max_bytes=67108864, stop_event=None):
+        self.max_items = max(1, max_items)
+        self.max_bytes = max_bytes
+        if stop_event is None:
+            stop_event = threading.Event()
+        self.stop_event = stop_event
+
+        self._cond = threading.Condition()
+        self._items = collections.deque()
+        self._bytes = 0
+
+        self.put_count = 0
+        self.max_depth = 0
+        self.blocked_count = 0
+        self.blocked_time = 0.0
+
+    def _full(self, size):
+        # must be called with the lock held.
+        if len(self._items) >= self.max_items:
+            return True
+        return len(self._items) > 0 and self._bytes + size > self.max_bytes
+
+    def put(self, item, size=0, block=True):
+        """Add an item of size bytes, waiting while the queue is full."""
+        self._cond.acquire()
+        try:
+            if block and self._full(size):
+                self.blocked_count = self.blocked_count + 1
+                start = time.time()
+                while self._full(size) and not self.stop_event.is_set():
+                    self._cond.wait(0.5)
+                self.blocked_time = self.blocked_time + time.time() - start
+
+            self._items.append((item, size))
+            self._bytes = self._bytes + size
+            self.put_count = self.put_count + 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def get(self, timeout=None):
+        """Remove and return the oldest item.  Returns None if the queue is
+        still empty after timeout seconds.
+        """
+        self._cond.acquire()
+        try:
+            if not self._items:
+                self._cond.wait(timeout)
+                if not self._items:
+                    return None
+
+            (item, size) = self._items.popleft()
+            self._bytes = self._bytes - size
+            self._cond.notify_all()
+            return item
+        finally:
+            self._cond.release()
+
+    def stats(self):
+        """Return a dict of the queue gauges and counters."""
+        self._cond.acquire()
+        try:
+            return {"depth": len(self._items),
+                    "bytes": self._bytes,
+                    "max_depth": self.max_depth,
+                    "puts": self.put_count,
+                    "blocked_puts": self.blocked_count,
+                    "blocked_ms": self.blocked_time * 1000}
+        finally:
+            self._cond.release()
+
+
+class RenderBatch(object):
+    """
+    Counts the messages of a syncpoint batch that have not been handled yet
+    so that the getter only commits the batch once all its events have been
+    written.  The first error raised while handling one of the messages is
+    kept and raised by wait() so that the getter backs the batch out.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = 0
+        self.error = None
+
+    def add(self):
+        self._cond.acquire()
+        try:
+            self._pending = self._pending + 1
+        finally:
+            self._cond.release()
+
+    def done(self, error=None):
+        self._cond.acquire()
+        try:
+            if error is not None and self.error is None:
+                self.error = error
+            self._pending = self._pending - 1
+            if self._pending <= 0:
+                self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def wait(self):
+        """Block until every message added to the batch was handled.
+        Raises the first error of the batch, if any.
+        """
+        self._cond.acquire()
+        try:
+            while self._pending > 0:
+                self._cond.wait(1.0)
+        finally:
+            self._cond.release()
+
+        if self.error is not None:
+            raise self.error
+
+
+class RenderPool(object):
+    """
+    A pool of renderer threads that take the messages from a HandoffQueue
+    and pass them to the render function.  The render function must be safe
+    to call from several threads at once.
+
+    render - Called with the args and keyword args of every message.  An
+    exception raised by render is logged and passed to the batch of the
+    message.
+    workers - Number of renderer threads.
+    max_items, max_bytes - Bounds of the hand-off queue.
+    stop_event - threading.Event set when the input stops.
+    stats_interval - Log the gauges every this many seconds.
+    """
+
+    def __init__(self, render, workers=2, max_items=1000,
+                 max_bytes=67108864, stop_event=None, stats_interval=60):
+        self.render = render
+        self.workers = max(1, workers)
+        self.stats_interval = stats_interval
+        self.handoff = HandoffQueue(max_items, max_bytes, stop_event)
+
+        self._lock = threading.Lock()
+        self._threads = []
+        self._busy = 0
+        self._last_stats = time.time()
+
+        self.render_count = 0
+        self.render_time = 0.0
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, args=(i,),
+                                 name="renderer-%i" % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, args, kw, size=0, batch=None):
+        """Queue a message for the renderers.  Blocks while the hand-off
+        queue is full.  batch is a RenderBatch that is told once the message
+        was handled.
+        """
+        if batch is not None:
+            batch.add()
+        self.handoff.put((args, kw, batch), size)
+
+    def close(self, timeout=30.0):
+        """Let the renderers handle the queued messages and stop them.  Call
+        it once the getter threads have stopped.
+        """
+        for t in self._threads:
+            self.handoff.put(STOP_RENDERER, block=False)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        """Return a dict of the per stage gauges and counters."""
+        stats = self.handoff.stats()
+        self._lock.acquire()
+        try:
+            stats["renderers"] = self.workers
+            stats["renderers_busy"] = self._busy
+            stats["rendered"] = self.render_count
+            stats["avg_render_ms"] = 0.0
+            if self.render_count > 0:
+                stats["avg_render_ms"] = \
+                    self.render_time * 1000 / self.render_count
+        finally:
+            self._lock.release()
+        return stats
+
+    def log_stats(self):
+        logging.info("Render pipeline: handoff_depth=%(depth)i "
+                     "handoff_bytes=%(bytes)i handoff_max_depth=%(max_depth)i "
+                     "handoff_puts=%(puts)i blocked_puts=%(blocked_puts)i "
+                     "blocked_ms=%(blocked_ms).1f renderers=%(renderers)i "
+                     "renderers_busy=%(renderers_busy)i rendered=%(rendered)i "
+                     "avg_render_ms=%(avg_render_ms).3f" % self.stats())
+
+    def _run(self, worker_id):
+        while True:
+            item = self.handoff.get(1.0)
+
+            if worker_id == 0 and \
+               time.time() - self._last_stats >= self.stats_interval:
+                self._last_stats = time.time()
+                self.log_stats()
+
+            if item is None:
+                continue
+            if item is STOP_RENDERER:
+                return
+
+            (args, kw, batch) = item
+            self._lock.acquire()
+            self._busy = self._busy + 1
+            self._lock.release()
+
+            start = time.time()
+            error = None
+            try:
+                self.render(*args, **kw)
+            except:
+                error = sys.exc_info()[1]
+                logging.error("Exception occurred in renderer: %s" %
+                              str(error))
+
+            elapsed = time.time() - start
+            self._lock.acquire()
+            self._busy = self._busy - 1
+            self.render_count = self.render_count + 1
+            self.render_time = self.render_time + elapsed
+            self._lock.release()
+
+            if batch is not None:
+                batch.done(error)
+
+
+class PipeSink(object):
+    """
+    Event writer sink of a worker process.  Every flush sends the <stream>
+    document written since the last flush to the parent process as one
+    message on a duplex multiprocessing connection and waits until the
+    parent has written it.  flush raises IOError if the parent could not
+    write it, so that a syncpoint batch is only committed once its events
+    were written to splunkd.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(data)
+
+    def flush(self):
+        if not self._parts:
+            return
+        data = "".join(self._parts)
+        self._parts = []
+        self.conn.send_bytes(data.encode("utf-8"))
+        try:
+            reply = self.conn.recv_bytes()
+        except EOFError:
+            raise IOError("The input process stopped before it wrote the "
+                          "events.")
+        if reply != DOCUMENT_WRITTEN:
+            raise IOError("The input process could not write the events.")
+
+
+def forward_output(conn, lock, stream=None):
+    '''Write the documents a worker process sends on conn to the stream
+    (stdout by default) until the worker closes its end of the pipe, and
+    tell the worker whether each one was written.  The lock is shared by
+    the forwarders of all the workers so that every document is written
+    whole.
+    '''
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except (EOFError, OSError, IOError):
+            break
+
+        reply = DOCUMENT_WRITTEN
+        lock.acquire()
+        try:
+            out = stream
+            if out is None:
+                out = sys.stdout
+            out.write(data.decode("utf-8"))
+            out.flush()
+        except Exception as ex:
+            logging.error("Exception occurred while writing events: %s" %
+                          str(ex))
+            reply = DOCUMENT_FAILED
+        finally:
+            lock.release()
+
+        try:
+            conn.send_bytes(reply)
+        except (OSError, IOError):
+            break
+
+    conn.close()
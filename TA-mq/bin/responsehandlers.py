@@ -23,16 +23,22 @@ import binascii
 import base64
 import string
 import os
-import lxml
+import io
+import lxml.etree
 import logging
-import gzip
 import re
-import copy
+import sys
+import threading
+import atexit
+import calendar
+import collections
 
 import pymqi
 from pymqi import CMQC as CMQC
 
-logging.basicConfig(level=logging.DEBUG, format='%(levelname)s %(message)s')
+from payloadstore import get_archive_writer
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
 
 
 #####################################
@@ -77,35 +83,14 @@ class DefaultQueueResponseHandler(object):
         log_payload_as_event=true/false - If false, do not wrap the payload in a name value pair and log the payload as the full event.
         If true the event will be wrapped in a payload element.  eg. payload=""  Default is true.
 
+        mqmd_fields=MsgId|CorrelId|PutApplName - Only include these MQMD
+        fields in the event.  Default: all fields
+
     """
 
     def __init__(self, **args):
 
-        logging.error("default queue handler _init_")
         self.args = args
-        self.mqmd_dicts = None
-
-        mqmd_dict = pymqi._MQConst2String(CMQC, "MQMD_")
-        mqro_dict = pymqi._MQConst2String(CMQC, "MQRO_")
-        mqmt_dict = pymqi._MQConst2String(CMQC, "MQMT_")
-        mqei_dict = pymqi._MQConst2String(CMQC, "MQEI_")
-        mqfb_dict = pymqi._MQConst2String(CMQC, "MQFB_")
-        mqenc_dict = pymqi._MQConst2String(CMQC, "MQENC_")
-        mqccsi_dict = pymqi._MQConst2String(CMQC, "MQCCSI_")
-        mqfmt_dict = pymqi._MQConst2String(CMQC, "MQFMT_")
-        mqpri_dict = pymqi._MQConst2String(CMQC, "MQPRI_")
-        mqper_dict = pymqi._MQConst2String(CMQC, "MQPER_")
-        mqat_dict = pymqi._MQConst2String(CMQC, "MQAT_")
-        mqmf_dict = pymqi._MQConst2String(CMQC, "MQMF_")
-        mqol_dict = pymqi._MQConst2String(CMQC, "MQOL_")
-
-        self.mqmd_dicts = {"mqmd": mqmd_dict, "mqro": mqro_dict,
-                           "mqmt": mqmt_dict, "mqei": mqei_dict,
-                           "mqfb": mqfb_dict, "mqenc": mqenc_dict,
-                           "mqccsi": mqccsi_dict, "mqfmt": mqfmt_dict,
-                           "mqpri": mqpri_dict, "mqper": mqper_dict,
-                           "mqat": mqat_dict, "mqmf": mqmf_dict,
-                           "mqol": mqol_dict}
 
         if "include_mqmd" in self.args:
             if self.args["include_mqmd"].lower().strip() == "true":
@@ -186,66 +171,34 @@ class DefaultQueueResponseHandler(object):
         else:
             self.payload_quote_char = '"'
 
+        self.mqmd_renderer = MQMDRenderer(self.pretty_mqmd,
+                                          self.make_mqmd_printable,
+                                          parse_mqmd_fields(self.args))
+
 
     def __call__(self, splunk_host, name, queue_manager_name, queue, msg_data,
                  msg_desc, **kw):
 
         splunk_event = ""
-        logging.debug("default queue handler _call_")
         mqmd_str = ""
         if self.include_mqmd and (msg_desc is not None):
-            new_mqmd = make_mqmd(msg_desc, self.mqmd_dicts,
-                                 self.pretty_mqmd,
-                                 self.make_mqmd_printable)
-            for (mqmd_key, mqmd_value) in list(new_mqmd.items()):
-                if isinstance(mqmd_value, int) or \
-                    isinstance(mqmd_value, float) or \
-                        str(mqmd_value).startswith("MQ"):
-                    mqmd_str = mqmd_str + \
-                                " %s=%s" % (str(mqmd_key).strip(),
-                                            str(mqmd_value))
-                else:
-                    if isinstance(mqmd_value, bytes):
-                        mqmd_value = mqmd_value.decode("ascii")
-                    mqmd_str = mqmd_str + \
-                                ' %s="%s"' % (str(mqmd_key).strip(),
-                                              str(mqmd_value))
+            mqmd_str = self.mqmd_renderer(msg_desc)
         #logging.debug("mqmd mapped")
-        index_time = "[" + \
-            datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + \
-            " " + time.strftime("%z") + "]"
-        #logging.debug("after index time")
         event_time = None
         if self.use_mqmd_puttime:
-
-            logging.debug("use mqmd puttime")
-            logging.debug('msg_desc["PutDate"]:' +  str(msg_desc["PutDate"]) + str(msg_desc["PutTime"]))
-            puttime = datetime.datetime.strptime(msg_desc["PutDate"].decode("ascii") +
-                                                 " " +
-                                                 msg_desc["PutTime"][0:6].decode("ascii"),
-                                                 "%Y%m%d %H%M%S")
-
-            logging.debug("puttime set")
-            # puttime = puttime.replace(tzinfo=pytz.timezone("GMT"))
-            localtime = puttime - datetime.timedelta(seconds=time.timezone)
-
-            h_secs = msg_desc["PutTime"][6:].decode("ascii")
-            logging.debug("before mqmd put index time")
-            index_time = "[" + localtime.strftime("%Y-%m-%d %H:%M:%S") + \
-                         "." + h_secs + "0 " + \
-                         time.strftime("%z") + "]"
-
-            event_time = str(localtime.timestamp())
+            (put_epoch, put_time) = TIMESTAMP_SERVICE.put_time(
+                msg_desc["PutDate"], msg_desc["PutTime"])
+            index_time = "[" + put_time + "]"
+            event_time = str(put_epoch)
+        else:
+            index_time = "[" + TIMESTAMP_SERVICE.now() + "]"
 
         payload = ""
-        logging.debug("B4 include payload.")
         if not self.log_payload_as_event:
             payload_el_str = '%s'
         else:
             payload_el_str = ' payload=' + self.payload_quote_char + "%s" + self.payload_quote_char
 
-        logging.debug("payload el str: " + payload_el_str)
-
         if self.include_payload:
             if self.encode_payload == "base64":
                 payload = payload_el_str % \
@@ -274,9 +227,6 @@ class DefaultQueueResponseHandler(object):
         else:
             splunk_event = splunk_event + payload
 
-        logging.debug("doing event: queue manager name:" + str(queue_manager_name))
-        logging.debug("doing event: queue name:" + str(queue))
-        
         print_xml_single_instance_mode(splunk_host, splunk_event, event_time=event_time, name=name, queue_manager=queue_manager_name, queue=queue)
 
 
@@ -309,196 +259,438 @@ class DefaultQueueResponseHandler(object):
 #             print_xml_single_instance_mode(destination, json.dumps(values))
 
 
-def is_printable(char):
-    '''Return true if the character char is printable or false
-       if it is not printable.
-    '''
-    if string.printable.count(char) > 0:
-        return True
-    else:
-        return False
+# maps every byte that is not in string.printable to '.'
+PRINTABLE_TABLE = bytes(bytearray([c if chr(c) in string.printable
+                                   else ord('.') for c in range(256)]))
+NON_PRINTABLE_RE = re.compile("[^%s]" % re.escape(string.printable))
 
 
 def make_printable(instr):
     '''Return a printable representation of the string instr.
     '''
-    retstr = ''
-    logging.debug("here")
-    #logging.debug("instr: " + binascii.hexlify(instr).decode("ascii"))
-    logging.debug("there")
-    if isinstance(instr, bytes):
-        #     instr = instr.decode("ascii")
-
-        for char in instr:
-            if not is_printable(chr(char)):
-                retstr = retstr + '.'
-            else:
-                retstr = retstr + chr(char)
-    else:
-            #     instr = instr.decode("ascii")
+    if isinstance(instr, (bytes, bytearray)):
+        return instr.translate(PRINTABLE_TABLE).decode("ascii")
+
+    try:
+        return instr.encode("latin-1").translate(PRINTABLE_TABLE).decode(
+            "ascii")
+    except UnicodeEncodeError:
+        # characters above U+00FF are never printable.
+        return NON_PRINTABLE_RE.sub(".", instr)
+
+
+# MQMD fields in event order and the prefix of the constants used for their
+# textual descriptions.
+MQMD_CONSTANT_FIELDS = [("StrucId", "MQMD_"), ("Version", "MQMD_"),
+                        ("Report", "MQRO_"), ("MsgType", "MQMT_"),
+                        ("Expiry", "MQEI_"), ("Feedback", "MQFB_"),
+                        ("Encoding", "MQENC_"), ("CodedCharSetId", "MQCCSI_"),
+                        ("Format", "MQFMT_"), ("Priority", "MQPRI_"),
+                        ("Persistence", "MQPER_"), ("PutApplType", "MQAT_"),
+                        ("MsgFlags", "MQMF_"), ("OriginalLength", "MQOL_")]
+
+MQMD_OTHER_FIELDS = ["MsgId", "CorrelId", "BackoutCount", "ReplyToQ",
+                     "ReplyToQMgr", "UserIdentifier", "AccountingToken",
+                     "ApplIdentityData", "PutApplName", "PutDate", "PutTime",
+                     "ApplOriginData", "GroupId", "MsgSeqNumber", "Offset"]
+
+# fields that are escaped with make_printable or hexlified.
+MQMD_BINARY_FIELDS = ["MsgId", "CorrelId", "UserIdentifier",
+                      "AccountingToken", "ApplIdentityData", "PutApplName",
+                      "GroupId"]
+
+MQMD_STRIPPED_FIELDS = ["ReplyToQ", "ReplyToQMgr"]
+
+MQMD_FIELDS = [f for (f, prefix) in MQMD_CONSTANT_FIELDS] + MQMD_OTHER_FIELDS
+
+
+def format_mqmd_value(name, value):
+    '''Return the " name=value" event segment for an MQMD value.  Numbers
+       and MQ constant names are not quoted.
+    '''
+    if isinstance(value, (int, float)):
+        return " %s=%s" % (name, value)
+    if isinstance(value, bytes):
+        return ' %s="%s"' % (name, value.decode("ascii", "replace"))
+    if value.startswith("MQ"):
+        return " %s=%s" % (name, value)
+    return ' %s="%s"' % (name, value)
+
 
-        for char in instr:
-            if not is_printable(char):
-                retstr = retstr + '.'
+class MQMDRenderer(object):
+    """
+    Renders the MQMD of a message as a string of key=value pairs.  The list
+    of field extractors is built once for the handler options.
+
+    pretty_mqmd - Use textual descriptions for MQMD values.
+    make_mqmd_printable - Escape non text values instead of hexlifying them.
+    fields - Only render these MQMD fields.  Default: all fields.
+    """
+
+    def __init__(self, pretty_mqmd=True, make_mqmd_printable=True,
+                 fields=None):
+        if fields is None:
+            fields = MQMD_FIELDS
+        for field in fields:
+            if field not in MQMD_FIELDS:
+                logging.error("Unknown MQMD field ignored: %s" % field)
+
+        constants = dict(MQMD_CONSTANT_FIELDS)
+        if make_mqmd_printable:
+            convert_binary = make_printable
+        else:
+            convert_binary = binascii.hexlify
+
+        self.extractors = []
+        # keep the MQMD field order regardless of the order of fields.
+        for field in [f for f in MQMD_FIELDS if f in fields]:
+            if field in constants and pretty_mqmd:
+                self.extractors.append(
+                    self.pretty_extractor(
+                        field, constant_descriptions(constants[field])))
+            elif field in MQMD_BINARY_FIELDS:
+                self.extractors.append(
+                    self.converted_extractor(field, convert_binary))
+            elif field in MQMD_STRIPPED_FIELDS:
+                self.extractors.append(
+                    self.converted_extractor(field, lambda v: v.strip()))
             else:
-                retstr = retstr + char
+                self.extractors.append(self.raw_extractor(field))
+
+    def pretty_extractor(self, field, descriptions):
+        def extract(msg_desc):
+            value = msg_desc[field]
+            description = descriptions.get(value)
+            if description is not None:
+                return format_mqmd_value(field, description)
+            return format_mqmd_value(field, value)
+        return extract
+
+    def converted_extractor(self, field, convert):
+        def extract(msg_desc):
+            return format_mqmd_value(field, convert(msg_desc[field]))
+        return extract
+
+    def raw_extractor(self, field):
+        def extract(msg_desc):
+            return format_mqmd_value(field, msg_desc[field])
+        return extract
+
+    def __call__(self, msg_desc):
+        return "".join([extract(msg_desc) for extract in self.extractors])
+
+
+def constant_descriptions(prefix):
+    '''Return a dict of the names of the CMQC constants that start with
+       prefix keyed by their value.  Like pymqi._MQConst2String the last
+       name wins if several constants have the same value.
+    '''
+    descriptions = {}
+    for (name, value) in vars(CMQC).items():
+        if name.startswith(prefix):
+            try:
+                descriptions[value] = name
+            except TypeError:
+                # unhashable values are never MQMD field values.
+                pass
+    return descriptions
 
-    return retstr
 
+def parse_mqmd_fields(args):
+    '''Return the list of fields in the mqmd_fields=Field1|Field2 argument
+       or None if it is not set.
+    '''
+    if "mqmd_fields" not in args or not args["mqmd_fields"].strip():
+        return None
+    return [f.strip() for f in args["mqmd_fields"].split("|") if f.strip()]
 
-def make_mqmd(msg_desc, mqmd_dicts, pretty_mqmd, make_mqmd_printable):
 
-    logging.debug("Make mqmd.")
+#####################################
+# Timestamps
+#####################################
 
-    mqmd_dict = {}
+class TimestampService(object):
+    """
+    Formats the index time of events.  Messages arriving in bursts share the
+    same put date and second, so converted put times are kept in a small
+    LRU cache keyed on (PutDate, PutTime[0:6]).  The current time is only
+    formatted once per second.  Shared by all the poller threads.
+    """
 
-    if mqmd_dicts is None:
-        logging.debug("Make mqmd. mqmd_dicts is None")
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._put_times = collections.OrderedDict()
+        # (second, "%Y-%m-%d %H:%M:%S", "%z") of the current second.
+        self._current = (None, None, None)
+
+    def current_second(self):
+        now = time.time()
+        second = int(now)
+        current = self._current
+        if current[0] != second:
+            local = time.localtime(second)
+            current = (second, time.strftime("%Y-%m-%d %H:%M:%S", local),
+                       time.strftime("%z", local))
+            self._current = current
+        return now, current
+
+    def now(self):
+        '''Return the current time as "YYYY-mm-dd HH:MM:SS.mmm +zzzz".
+        '''
+        (now, (second, local, zone)) = self.current_second()
+        return "%s.%03i %s" % (local, int((now - second) * 1000), zone)
+
+    def put_time(self, put_date, put_time):
+        '''Return (epoch, "YYYY-mm-dd HH:MM:SS.hh0 +zzzz") for the MQMD
+           PutDate and PutTime.  The put time is GMT.
+        '''
+        key = (put_date, put_time[0:6])
+        self._lock.acquire()
+        try:
+            entry = self._put_times.get(key)
+            if entry is not None:
+                self._put_times.move_to_end(key)
+        finally:
+            self._lock.release()
+
+        if entry is None:
+            entry = self.convert_put_time(put_date, put_time)
+            self._lock.acquire()
+            try:
+                self._put_times[key] = entry
+                if len(self._put_times) > self.max_entries:
+                    self._put_times.popitem(last=False)
+            finally:
+                self._lock.release()
+
+        h_secs = put_time[6:8]
+        if isinstance(h_secs, bytes):
+            h_secs = h_secs.decode("ascii")
+        return entry[0], "%s.%s0 %s" % (entry[1], h_secs,
+                                        self.current_second()[1][2])
+
+    def convert_put_time(self, put_date, put_time):
+        if isinstance(put_date, bytes):
+            put_date = put_date.decode("ascii")
+        if isinstance(put_time, bytes):
+            put_time = put_time.decode("ascii")
+        epoch = calendar.timegm((int(put_date[0:4]), int(put_date[4:6]),
+                                 int(put_date[6:8]), int(put_time[0:2]),
+                                 int(put_time[2:4]), int(put_time[4:6]),
+                                 0, 0, 0))
+        # the index time shows the put time in the local standard time.
+        local = time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.gmtime(epoch - time.timezone))
+        return float(epoch), local
+
+
+TIMESTAMP_SERVICE = TimestampService()
 
-    if msg_desc is None:
-        logging.debug("Make mqmd. msg_desc is None")
 
-    if pretty_mqmd and msg_desc['StrucId'] in mqmd_dicts["mqmd"]:
-        mqmd_dict['StrucId'] = mqmd_dicts["mqmd"][msg_desc['StrucId']]
-    else:
-        mqmd_dict['StrucId'] = msg_desc['StrucId']
+#####################################
+# Buffered event output
+#####################################
 
-    if pretty_mqmd and msg_desc['Version'] in mqmd_dicts["mqmd"]:
-        mqmd_dict['Version'] = mqmd_dicts["mqmd"][msg_desc['Version']]
-    else:
-        mqmd_dict['Version'] = msg_desc['Version']
+class EventWriter(object):
+    """
+    Collects the events written by the response handlers and writes them to
+    the sink (stdout by default) as one <stream> document per batch.  It is
+    shared by all the poller threads of an input.
+
+    max_events - Flush once this many events are buffered.
+    max_bytes - Flush once the buffered events are this many characters.
+    flush_interval - Flush events that have been buffered for this many
+    seconds.  Only applies once start() was called.
+    """
 
-    if pretty_mqmd and msg_desc['Report'] in mqmd_dicts["mqro"]:
-        mqmd_dict['Report'] = mqmd_dicts["mqro"][msg_desc['Report']]
-    else:
-        mqmd_dict['Report'] = msg_desc['Report']
+    def __init__(self, max_events=1, max_bytes=1048576, flush_interval=1.0,
+                 sink=None):
+        self.max_events = max(1, max_events)
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.sink = sink
+
+        self._lock = threading.Lock()
+        # held while a batch is written so that flush() returns only after
+        # every event buffered before the call is written.
+        self._write_lock = threading.Lock()
+        self._events = []
+        self._bytes = 0
+        self._first_event_time = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.flush_count = 0
+        self.event_count = 0
+        self.flush_time = 0.0
+        self.max_flush_time = 0.0
+
+    def write(self, event):
+        """Buffer an <event> element."""
+        self._lock.acquire()
+        try:
+            if not self._events:
+                self._first_event_time = time.time()
+            self._events.append(event)
+            self._bytes = self._bytes + len(event)
+            full = len(self._events) >= self.max_events or \
+                self._bytes >= self.max_bytes
+        finally:
+            self._lock.release()
+
+        if full:
+            try:
+                self.flush()
+            except Exception as ex:
+                logging.error("Exception occurred while writing events: %s" %
+                              str(ex))
+
+    def flush(self):
+        """Write the buffered events.  Exceptions writing to the sink are
+        raised to the caller.  The events are kept in the buffer if they
+        could not be written, so that they are written again by the next
+        flush and a flush after a failed write never returns without
+        writing them.
+        """
+        self._write_lock.acquire()
+        try:
+            self._lock.acquire()
+            try:
+                events = self._events
+                self._events = []
+                self._bytes = 0
+                self._first_event_time = None
+            finally:
+                self._lock.release()
 
-    if pretty_mqmd and msg_desc['MsgType'] in mqmd_dicts["mqmt"]:
-        mqmd_dict['MsgType'] = mqmd_dicts["mqmt"][msg_desc['MsgType']]
-    else:
-        mqmd_dict['MsgType'] = msg_desc['MsgType']
+            if not events:
+                return
 
-    if pretty_mqmd and msg_desc['Expiry'] in mqmd_dicts["mqei"]:
-        mqmd_dict['Expiry'] = mqmd_dicts["mqei"][msg_desc['Expiry']]
-    else:
-        mqmd_dict['Expiry'] = msg_desc['Expiry']
+            sink = self.sink
+            if sink is None:
+                sink = sys.stdout
 
-    if pretty_mqmd and msg_desc['Feedback'] in mqmd_dicts["mqfb"]:
-        mqmd_dict['Feedback'] = mqmd_dicts["mqfb"][msg_desc['Feedback']]
-    else:
-        mqmd_dict['Feedback'] = msg_desc['Feedback']
+            start = time.time()
+            try:
+                sink.write("<stream>%s</stream>\n" % "".join(events))
+                sink.flush()
+            except:
+                self._lock.acquire()
+                try:
+                    self._events = events + self._events
+                    self._bytes = self._bytes + \
+                        sum([len(e) for e in events])
+                    self._first_event_time = start
+                finally:
+                    self._lock.release()
+                raise
+            elapsed = time.time() - start
+
+            self.flush_count = self.flush_count + 1
+            self.event_count = self.event_count + len(events)
+            self.flush_time = self.flush_time + elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+        finally:
+            self._write_lock.release()
+
+    def start(self):
+        """Start the thread that flushes events older than the flush
+        interval and logs the flush statistics.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """Stop the flush thread and write any buffered events."""
+        self._stop_event.set()
+        try:
+            self.flush()
+        except Exception as ex:
+            logging.error("Exception occurred while writing events: %s" %
+                          str(ex))
+
+    def log_stats(self):
+        if self.flush_count > 0:
+            logging.info("Event output: flushes=%i events=%i "
+                         "avg_flush_ms=%.2f max_flush_ms=%.2f" %
+                         (self.flush_count, self.event_count,
+                          self.flush_time * 1000 / self.flush_count,
+                          self.max_flush_time * 1000))
+
+    def _run(self):
+        last_stats = time.time()
+        while not self._stop_event.wait(min(self.flush_interval, 1.0)):
+            self._lock.acquire()
+            try:
+                due = self._first_event_time is not None and \
+                    time.time() - self._first_event_time >= self.flush_interval
+            finally:
+                self._lock.release()
 
-    if pretty_mqmd and msg_desc['Encoding'] in mqmd_dicts["mqenc"]:
-        mqmd_dict['Encoding'] = mqmd_dicts["mqenc"][msg_desc['Encoding']]
-    else:
-        mqmd_dict['Encoding'] = msg_desc['Encoding']
+            if due:
+                try:
+                    self.flush()
+                except Exception as ex:
+                    logging.error("Exception occurred while writing events: "
+                                  "%s" % str(ex))
 
-    if pretty_mqmd and \
-       msg_desc['CodedCharSetId'] in mqmd_dicts["mqccsi"]:
-        mqmd_dict['CodedCharSetId'] = \
-            mqmd_dicts["mqccsi"][msg_desc['CodedCharSetId']]
-    else:
-        mqmd_dict['CodedCharSetId'] = msg_desc['CodedCharSetId']
+            if time.time() - last_stats >= 60:
+                self.log_stats()
+                last_stats = time.time()
 
-    if pretty_mqmd and msg_desc['Format'] in mqmd_dicts["mqfmt"]:
-        mqmd_dict['Format'] = mqmd_dicts["mqfmt"][msg_desc['Format']]
-    else:
-        mqmd_dict['Format'] = msg_desc['Format']
 
-    if pretty_mqmd and msg_desc['Priority'] in mqmd_dicts["mqpri"]:
-        mqmd_dict['Priority'] = mqmd_dicts["mqpri"][msg_desc['Priority']]
-    else:
-        mqmd_dict['Priority'] = msg_desc['Priority']
+# Every event is written on its own until configure_event_writer is called.
+EVENT_WRITER = EventWriter()
 
-    if pretty_mqmd and msg_desc['Persistence'] in mqmd_dicts["mqper"]:
-        mqmd_dict['Persistence'] = mqmd_dicts["mqper"][msg_desc['Persistence']]
-    else:
-        mqmd_dict['Persistence'] = msg_desc['Persistence']
 
-    if pretty_mqmd and msg_desc['PutApplType'] in mqmd_dicts["mqat"]:
-        mqmd_dict['PutApplType'] = mqmd_dicts["mqat"][msg_desc['PutApplType']]
-    else:
-        mqmd_dict['PutApplType'] = msg_desc['PutApplType']
+def configure_event_writer(max_events, max_bytes, flush_interval, sink=None):
+    """Replace the module event writer with a buffering one and start its
+    flush thread.
+    """
+    global EVENT_WRITER
+    EVENT_WRITER.close()
+    EVENT_WRITER = EventWriter(max_events=max_events, max_bytes=max_bytes,
+                               flush_interval=flush_interval, sink=sink)
+    EVENT_WRITER.start()
+    return EVENT_WRITER
 
-    if pretty_mqmd and msg_desc['MsgFlags'] in mqmd_dicts["mqmf"]:
-        mqmd_dict['MsgFlags'] = mqmd_dicts["mqmf"][msg_desc['MsgFlags']]
-    else:
-        mqmd_dict['MsgFlags'] = msg_desc['MsgFlags']
 
-    if pretty_mqmd and msg_desc['OriginalLength'] in mqmd_dicts["mqol"]:
-        mqmd_dict['OriginalLength'] = \
-            mqmd_dicts["mqol"][msg_desc['OriginalLength']]
-    else:
-        mqmd_dict['OriginalLength'] = msg_desc['OriginalLength']
-
-    if make_mqmd_printable:
-        mqmd_dict['MsgId'] = make_printable(msg_desc['MsgId'])
-        mqmd_dict['CorrelId'] = make_printable(msg_desc['CorrelId'])
-        mqmd_dict['BackoutCount'] = msg_desc['BackoutCount']
-        mqmd_dict['ReplyToQ'] = msg_desc['ReplyToQ'].strip()
-        mqmd_dict['ReplyToQMgr'] = msg_desc['ReplyToQMgr'].strip()
-        mqmd_dict['UserIdentifier'] = \
-            make_printable(msg_desc['UserIdentifier'])
-        mqmd_dict['AccountingToken'] = \
-            make_printable(msg_desc['AccountingToken'])
-        mqmd_dict['ApplIdentityData'] = \
-            make_printable(msg_desc['ApplIdentityData'])
-        mqmd_dict['PutApplName'] = make_printable(msg_desc['PutApplName'])
-        mqmd_dict['PutDate'] = msg_desc['PutDate']
-        mqmd_dict['PutTime'] = msg_desc['PutTime']
-        mqmd_dict['ApplOriginData'] = (msg_desc['ApplOriginData'])
-        mqmd_dict['GroupId'] = make_printable(msg_desc['GroupId'])
-        mqmd_dict['MsgSeqNumber'] = msg_desc['MsgSeqNumber']
-        mqmd_dict['Offset'] = msg_desc['Offset']
+def flush_event_writer():
+    EVENT_WRITER.close()
+    EVENT_WRITER.log_stats()
 
-    else:
-        mqmd_dict['MsgId'] = binascii.hexlify(msg_desc['MsgId'])
-        mqmd_dict['CorrelId'] = binascii.hexlify(msg_desc['CorrelId'])
-        mqmd_dict['BackoutCount'] = msg_desc['BackoutCount']
-        mqmd_dict['ReplyToQ'] = msg_desc['ReplyToQ'].strip()
-        mqmd_dict['ReplyToQMgr'] = msg_desc['ReplyToQMgr'].strip()
-        mqmd_dict['UserIdentifier'] = \
-            binascii.hexlify(msg_desc['UserIdentifier'])
-        mqmd_dict['AccountingToken'] = \
-            binascii.hexlify(msg_desc['AccountingToken'])
-        mqmd_dict['ApplIdentityData'] = \
-            binascii.hexlify(msg_desc['ApplIdentityData'])
-        mqmd_dict['PutApplName'] = binascii.hexlify(msg_desc['PutApplName'])
-        mqmd_dict['PutDate'] = msg_desc['PutDate']
-        mqmd_dict['PutTime'] = msg_desc['PutTime']
-        mqmd_dict['ApplOriginData'] = (msg_desc['ApplOriginData'])
-        mqmd_dict['GroupId'] = binascii.hexlify(msg_desc['GroupId'])
-        mqmd_dict['MsgSeqNumber'] = msg_desc['MsgSeqNumber']
-        mqmd_dict['Offset'] = msg_desc['Offset']
-
-    return mqmd_dict
 
+atexit.register(flush_event_writer)
 
-# prints XML stream
+
+# writes XML stream
 def print_xml_single_instance_mode(server, event, event_time=None, name=None, queue_manager=None, queue=None):
 
     if queue_manager is None or queue is None or name is None:
         if event_time is not None:
-            print("<stream><event><data>%s</data><time>%s</time><host>%s</host></event></stream>" % (
+            EVENT_WRITER.write("<event><data>%s</data><time>%s</time><host>%s</host></event>" % (
                 encodeXMLText(event), event_time, server))
         else:
-            print("<stream><event><data>%s</data><host>%s</host></event></stream>" % (
+            EVENT_WRITER.write("<event><data>%s</data><host>%s</host></event>" % (
                 encodeXMLText(event), server))
     else:
         if event_time is not None:
-            print("<stream><event><data>%s</data><time>%s</time><host>%s</host><source>%s:%s:%s</source></event></stream>" % (
+            EVENT_WRITER.write("<event><data>%s</data><time>%s</time><host>%s</host><source>%s:%s:%s</source></event>" % (
                 encodeXMLText(event), event_time, server, name, queue_manager, queue))
         else:
-                        
-            print("<stream><event><data>%s</data><host>%s</host><source>%s:%s:%s</source></event></stream>" % (
+            EVENT_WRITER.write("<event><data>%s</data><host>%s</host><source>%s:%s:%s</source></event>" % (
                 encodeXMLText(event), server, name, queue_manager, queue))
 
 
-# prints XML stream
+# writes XML stream
 def print_xml_multi_instance_mode(server, event, stanza):
 
-    print("<stream><event stanza=""%s""><data>%s</data><host>%s</host>\
-</event></stream>" % (stanza, encodeXMLText(event), server))
+    EVENT_WRITER.write("<event stanza=\"%s\"><data>%s</data><host>%s</host>\
+</event>" % (stanza, encodeXMLText(event), server))
 
 
 # prints simple stream
@@ -523,6 +715,29 @@ def encodeXMLText(text):
     return text
 
 
+# namespace of the IBM Message Broker 6.1 monitoring events.
+WMBNAMESPACE = \
+    u"http://www.ibm.com/xmlns/prod/websphere/messagebroker/6.1.0/monitoring/event"
+
+# Fields extracted from the eventPointData of a monitoring event.  The XPath
+# expressions are relative to the eventPointData element and the "wmb" prefix
+# is bound to the event namespace.
+BROKER_EVENT_FIELDS = [
+    ("broker", "wmb:messageFlowData/wmb:broker/@wmb:name"),
+    ("execgroup", "wmb:messageFlowData/wmb:executionGroup/@wmb:name"),
+    ("flow", "wmb:messageFlowData/wmb:messageFlow/@wmb:name"),
+    ("node", "wmb:messageFlowData/wmb:node/@wmb:nodeLabel"),
+    ("node_type", "wmb:messageFlowData/wmb:node/@wmb:nodeType"),
+    ("node_terminal", "wmb:messageFlowData/wmb:node/@wmb:terminal")]
+
+BROKER_EVENT_CREATION_TIME = \
+    "wmb:eventData/wmb:eventSequence/@wmb:creationTime"
+
+# matches the bitstream element of an event.
+BITSTREAM_RE = re.compile(br"<(?:[\w.-]+:)?bitstream\b"
+                          br"(?:[^>]*/>|.*?</(?:[\w.-]+:)?bitstream>)", re.S)
+
+
 class BrokerEventResponseHandler(object):
     """
     This response handler can be used to read IBM Message Broker/Integration Bus 
@@ -534,6 +749,14 @@ class BrokerEventResponseHandler(object):
     write_events = true/false
     gzip_events = true/false
     write_events_folder = "/opt/esb/brokerevents"
+    archive_segment_size = 67108864 - Start a new archive segment file once
+    a segment is this many bytes.
+    event_namespace = namespace of the monitoring events.  Default is the
+    6.1.0 monitoring event namespace.
+    ns.<prefix> = namespace uri to use for prefix in field XPaths.
+    field.<name> = XPath relative to eventPointData of a field to add to or
+    replace in the event.  Commas can not be used.
+    exclude_fields = broker|node_type - Fields not to include in the event.
     """
 
     def __init__(self, **args):
@@ -572,6 +795,21 @@ class BrokerEventResponseHandler(object):
         if "write_events_folder" in self.args:
             self.write_events_folder = self.args["write_events_folder"]
 
+        self.archive_segment_size = 67108864
+        if "archive_segment_size" in self.args:
+            try:
+                self.archive_segment_size = \
+                    int(self.args["archive_segment_size"].strip())
+            except:
+                self.archive_segment_size = 67108864
+
+        self.archive = None
+        if self.write_events:
+            self.archive = get_archive_writer(
+                self.write_events_folder, "BrokerEvent",
+                compress=self.gzip_events,
+                max_segment_bytes=self.archive_segment_size)
+
         self.use_event_time = True
         if "use_event_time" in self.args:
             if self.args["use_event_time"].lower().strip() == "false":
@@ -579,214 +817,266 @@ class BrokerEventResponseHandler(object):
             else:
                 self.use_event_time = True
 
-        self.regex = re.compile(r"/[A-Za-z0-9]*:")
+        self.event_namespace = WMBNAMESPACE
+        if "event_namespace" in self.args:
+            self.event_namespace = self.args["event_namespace"].strip()
+
+        ns = "{%s}" % self.event_namespace
+        self.event_point_data_tag = ns + "eventPointData"
+        self.application_data_tag = ns + "applicationData"
+        self.complex_content_tag = ns + "complexContent"
+        self.simple_content_tag = ns + "simpleContent"
+        self.bitstream_tag = ns + "bitstream"
+        self.element_name_attr = ns + "elementName"
+        self.name_attr = ns + "name"
+        self.value_attr = ns + "value"
+        self.encoding_attr = ns + "encoding"
+
+        self.namespaces = {"wmb": self.event_namespace}
+        for (key, value) in self.args.items():
+            if key.startswith("ns."):
+                self.namespaces[key[3:]] = value.strip()
+
+        field_map = list(BROKER_EVENT_FIELDS)
+        for (key, value) in sorted(self.args.items()):
+            if key.startswith("field."):
+                field_map = [(f, x) for (f, x) in field_map if f != key[6:]]
+                field_map.append((key[6:], value.strip()))
+
+        if "exclude_fields" in self.args:
+            exclude = [f.strip() for f in
+                       self.args["exclude_fields"].split("|")]
+            field_map = [(f, x) for (f, x) in field_map if f not in exclude]
+
+        self.field_map = []
+        for (field, xpath) in field_map:
+            try:
+                lxml.etree.XPath(xpath, namespaces=self.namespaces)
+                self.field_map.append((field, xpath))
+            except lxml.etree.XPathError as ex:
+                logging.error("Invalid XPath for field %s: %s. Exception: %s" %
+                              (field, xpath, str(ex)))
+
+        # the handler may be called by several renderer threads at once and
+        # compiled XPaths must not be shared between threads.
+        self._xpaths = threading.local()
+
+    def compiled_xpaths(self):
+        """Return the (event field XPaths, creation time XPath) compiled for
+        the current thread.
+        """
+        xpaths = getattr(self._xpaths, "compiled", None)
+        if xpaths is None:
+            xpaths = ([(field, lxml.etree.XPath(xpath,
+                                                namespaces=self.namespaces))
+                       for (field, xpath) in self.field_map],
+                      lxml.etree.XPath(BROKER_EVENT_CREATION_TIME,
+                                       namespaces=self.namespaces))
+            self._xpaths.compiled = xpaths
+        return xpaths
+
+    def parse_event(self, msg_data):
+        """Collect the event fields in a single pass over the event.  Only
+        the eventPointData and complexContent subtrees are kept until they
+        have been read.
+        """
+        fields = {"creation_time": None, "event_fields": "",
+                  "complex_content": [], "simple_content": [],
+                  "bitstream_encoding": "", "bitstream_data": ""}
+
+        if not self.include_bitstream:
+            # don't parse the bitstream if it is not logged.
+            msg_data = BITSTREAM_RE.sub(b"", msg_data)
+
+        found = set()
+        stack = []
+        # depth inside the eventPointData or complexContent element being
+        # collected.
+        retain_depth = 0
+        for (action, elem) in lxml.etree.iterparse(io.BytesIO(msg_data),
+                                                   events=("start", "end")):
+            if action == "start":
+                parent = stack[-1] if stack else None
+                stack.append(elem.tag)
+                if retain_depth:
+                    retain_depth = retain_depth + 1
+                    continue
+
+                tag = elem.tag
+                if parent == self.application_data_tag:
+                    if tag == self.complex_content_tag:
+                        retain_depth = 1
+                    elif tag == self.simple_content_tag:
+                        value = elem.get(self.value_attr)
+                        if value is not None:
+                            fields["simple_content"].append(
+                                '%s="%s" ' % (elem.get(self.name_attr),
+                                              value.strip()))
+                elif tag == self.event_point_data_tag and tag not in found:
+                    found.add(tag)
+                    retain_depth = 1
+            else:
+                stack.pop()
+                if retain_depth:
+                    retain_depth = retain_depth - 1
+                    if retain_depth == 0:
+                        if elem.tag == self.complex_content_tag:
+                            self.complex_content(elem,
+                                                 fields["complex_content"])
+                        else:
+                            self.evaluate_fields(elem, fields)
+                        elem.clear()
+                    continue
+
+                if elem.tag == self.bitstream_tag and elem.tag not in found:
+                    found.add(elem.tag)
+                    if self.encoding_attr in elem.attrib:
+                        fields["bitstream_encoding"] = \
+                            'bitstream_encoding="%s" ' % \
+                            elem.get(self.encoding_attr)
+                    fields["bitstream_data"] = \
+                        'bitstream_data="{}" '.format(elem.text)
+                elem.clear()
+
+        fields["complex_content"] = "".join(fields["complex_content"])
+        fields["simple_content"] = "".join(fields["simple_content"])
+        return fields
+
+    def evaluate_fields(self, event_point_data, fields):
+        """Evaluate the compiled field XPaths on the eventPointData."""
+        (event_fields, creation_time_xpath) = self.compiled_xpaths()
+        values = []
+        for (field, xpath) in event_fields:
+            value = first_xpath_value(xpath(event_point_data))
+            if value is not None:
+                values.append('%s="%s" ' % (field, value))
+        fields["event_fields"] = "".join(values)
+
+        if self.use_event_time:
+            fields["creation_time"] = first_xpath_value(
+                creation_time_xpath(event_point_data))
+
+    def complex_content(self, complex_content, values):
+        """Append name="value" for every element with text in the
+        complexContent.  The name is the element path of local names with
+        [n] added for elements that have siblings of the same name.
+        """
+        top_level_name = complex_content.get(self.element_name_attr, "")
+        for c in complex_content:
+            if isinstance(c.tag, str):
+                self.complex_values(c, "/" + lxml.etree.QName(c).localname,
+                                    top_level_name, values)
+
+    def complex_values(self, elem, path, top_level_name, values):
+        if elem.text is not None and elem.text.strip() != "":
+            if not self.include_complex_top_level:
+                name = path.replace("/%s/" % top_level_name, "")
+            elif path[0] == "/":
+                name = path[1:]
+            else:
+                name = path
+            values.append('%s="%s" ' % (name.replace("/", "."),
+                                        elem.text.strip()))
+
+        children = [c for c in elem if isinstance(c.tag, str)]
+        counts = {}
+        for c in children:
+            counts[c.tag] = counts.get(c.tag, 0) + 1
+        positions = {}
+        for c in children:
+            name = lxml.etree.QName(c).localname
+            if counts[c.tag] > 1:
+                positions[c.tag] = positions.get(c.tag, 0) + 1
+                name = "%s[%i]" % (name, positions[c.tag])
+            self.complex_values(c, path + "/" + name, top_level_name, values)
 
     def __call__(self, splunk_host, name, queue_manager_name, queue, msg_data,
                  msg_desc, **kw):
 
         splunk_event = ""
-        event_file_name = ""
+        event_location = ""
 
         queue_manager_name_str = 'queue_manager="%s" ' % queue_manager_name
         queue_str = 'queue="%s" ' % queue
         host = splunk_host + " "
         process = "mqinput(%i): " % os.getpid()
 
-        ev_pos = msg_data.find(":event")
-        start_pos = msg_data.rfind("<", 0, ev_pos)
+        ev_pos = msg_data.find(b":event")
+        start_pos = msg_data.rfind(b"<", 0, ev_pos)
 
         msg_data = msg_data[start_pos:]
-        logging.debug("Msg data: [%s]" % msg_data[:100])
-        index_time_o = datetime.datetime.now()
-        index_time = "[" + \
-            index_time_o.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + \
-            " " + time.strftime("%z") + "] "
+        index_time = "[" + TIMESTAMP_SERVICE.now() + "] "
 
         if self.write_events:
             try:
-                date_s = time.strftime("%Y%m%d")
-                cur_folder = \
-                    os.path.join(os.path.join(
-                        os.path.join(
-                            self.write_events_folder, queue_manager_name),
-                        queue), date_s)
-
-                if not os.path.exists(cur_folder):
-                    os.makedirs(cur_folder)
-
-                file_name = "BrokerEvent_" + \
-                    binascii.hexlify(msg_desc["MsgId"]) + ".xml"
-                full_file_name = os.path.join(cur_folder, file_name)
-                if self.gzip_events:
-                    f = gzip.open(full_file_name + ".gz", 'wb')
-                    f.write(msg_data)
-                    f.close()
-                else:
-                    f = open(full_file_name, "w")
-                    f.write(msg_data)
-                    f.close()
-                event_file_name = ' event_file_name="%s"' % \
-                    full_file_name
+                (segment, offset, length) = self.archive.write(
+                    queue_manager_name, queue,
+                    binascii.hexlify(msg_desc["MsgId"]).decode("ascii"),
+                    msg_data)
+                event_location = \
+                    ' event_segment="%s" event_offset=%i event_length=%i' % \
+                    (segment, offset, length)
             except Exception as ex:
                 logging.error("Failed to write event message. " + str(ex))
         
         event_time = None
 
         try:
+            fields = self.parse_event(msg_data)
 
-            WMBNAMESPACE = \
-                u"http://www.ibm.com/xmlns/prod/websphere/messagebroker/6.1.0/monitoring/event"
-            nss = {'wmb': WMBNAMESPACE}
+            if self.use_event_time and fields["creation_time"] is not None:
+                # "2015-05-17T06:28:18.535424Z"
+                event_time = \
+                    datetime.datetime.strptime(
+                        fields["creation_time"].replace("T", " ").replace(
+                            "Z", "GMT"),
+                        "%Y-%m-%d %H:%M:%S.%f%Z")
 
-            doc = lxml.etree.fromstring(msg_data)
-            
-            if self.use_event_time:
-                nl = doc.xpath(u"//wmb:eventSequence[1]/@wmb:creationTime",
-                               namespaces=nss)
-                if len(nl) > 0:
-                    "2015-05-17T06:28:18.535424Z"
-                    event_time = \
-                        datetime.datetime.strptime(
-                            nl[0].replace("T", " ").replace("Z", "GMT"),
-                            "%Y-%m-%d %H:%M:%S.%f%Z")
-
-                    index_time_o = event_time - \
-                        datetime.timedelta(seconds=time.timezone)
-
-                    h_secs = msg_desc["PutTime"][6:]
-                    index_time = "[" + \
-                        index_time_o.strftime("%Y-%m-%d %H:%M:%S") + "." + \
-                        h_secs + "0 " + time.strftime("%z") + "] "
-
-                    event_time = str(index_time_o.timestamp())
-
-            broker = ""
-            nl = doc.xpath(u"//wmb:messageFlowData[1]/wmb:broker/@wmb:name",
-                           namespaces=nss)
-            if len(nl) > 0:
-                broker = 'broker="%s" ' % nl[0]
-
-            exec_group = ""
-            nl = doc.xpath(
-                u"//wmb:messageFlowData[1]/wmb:executionGroup/@wmb:name",
-                namespaces=nss)
-            if len(nl) > 0:
-                exec_group = 'execgroup="%s" ' % nl[0]
-
-            flow = ""
-            nl = doc.xpath(
-                u"//wmb:messageFlowData[1]/wmb:messageFlow/@wmb:name",
-                namespaces=nss)
-            if len(nl) > 0:
-                flow = 'flow="%s" ' % nl[0]
-
-            node_details = ""
-            nl = doc.xpath(u"//wmb:messageFlowData[1]/wmb:node",
-                           namespaces=nss)
-            if len(nl) > 0:
-                node_details = ""
-                if "{%s}nodeLabel" % WMBNAMESPACE in nl[0].attrib:
-                    node_label = nl[0].attrib["{%s}nodeLabel" % WMBNAMESPACE]
-                    node_details = node_details + 'node="%s" ' % node_label
-
-                if "{%s}nodeType" % WMBNAMESPACE in nl[0].attrib:
-                    node_type = nl[0].attrib["{%s}nodeType" % WMBNAMESPACE]
-                    node_details = node_details + 'node_type="%s" ' % node_type
-
-                if "{%s}terminal" % WMBNAMESPACE in nl[0].attrib:
-                    node_terminal = nl[0].attrib["{%s}terminal" % WMBNAMESPACE]
-                    node_details = node_details + 'node_terminal="%s" ' % \
-                        node_terminal
-                # node_details = 'node="%s" node_type="%s"
-                # node_terminal="%s"' % (node_label, node_type, node_terminal)
-
-            complex_content = ''
-            nl = doc.xpath(u"//wmb:applicationData/wmb:complexContent",
-                           namespaces=nss)
-            if len(nl) > 0:
-                for n in nl:
-                    path = ""
-
-                    for c in n:
-                        c_name = n.xpath("@wmb:elementName", namespaces=nss)
-                        top_level_name = ""
-                        if len(c_name):
-                            top_level_name = c_name[0]
-
-                        tree = lxml.etree.ElementTree(c)
-                        for e in tree.iter():
-                            if e.text is not None:
-                                if e.text.strip() != "":
-                                    path = tree.getpath(e)
-                                    path = self.regex.sub("/", path)
-
-                                    if not self.include_complex_top_level:
-                                        path = \
-                                            path.replace(
-                                                "/%s/" % top_level_name,
-                                                "")
-                                    else:
-                                        if path[0] == "/":
-                                            path = path[1:]
-
-                                    path = path.replace("/", ".")
-
-                                    complex_content = complex_content + \
-                                        '%s="%s" ' % (path, e.text.strip())
-
-            simple_content = ""
-            nl = doc.xpath(u"//wmb:applicationData/wmb:simpleContent",
-                           namespaces=nss)
-            if len(nl) > 0:
-                nameTuple = u"{%s}name" % WMBNAMESPACE
-                valueTuple = u"{%s}value" % WMBNAMESPACE
-
-                for n in nl:
-                    name = None
-                    value = None
-                    if nameTuple in n.attrib:
-                        name = n.attrib[nameTuple]
-                    if valueTuple in n.attrib:
-                        value = n.attrib[valueTuple]
-
-                    if value is not None:
-                        simple_content = simple_content + \
-                            '%s="%s" ' % (name, value.strip())
-
-            bitstream_data = ""
-            bitstream_encoding = ""
-            # arb_text = "include_bitstream={} ".format(self.include_bitstream)
-            #logging.error("Include bitstream:" + str(self.include_bitstream))
-            # sys.stderr.write("Include bitstream:" + \
-            # str(self.include_bitstream) + "\n")
-            if self.include_bitstream:
-                nl = doc.xpath("//wmb:bitstream", namespaces=nss)
-                #logging.error("len is:" + str(len(nl)))
-                if len(nl) > 0:
-                    encoding_key = "{%s}encoding" % WMBNAMESPACE
-                    if encoding_key in nl[0].attrib:
-                        bitstream_encoding = 'bitstream_encoding="%s" '
-                        bitstream_encoding = \
-                            bitstream_encoding % (nl[0].attrib[encoding_key])
-                    bitstream_data = 'bitstream_data="{}" '
-                    bitstream_data = bitstream_data.format(nl[0].text)
+                index_time_o = event_time - \
+                    datetime.timedelta(seconds=time.timezone)
+
+                h_secs = msg_desc["PutTime"][6:].decode("ascii")
+                index_time = "[" + \
+                    index_time_o.strftime("%Y-%m-%d %H:%M:%S") + "." + \
+                    h_secs + "0 " + time.strftime("%z") + "] "
+
+                event_time = str(index_time_o.timestamp())
+
+            event_fields = fields["event_fields"]
+            complex_content = fields["complex_content"]
+            simple_content = fields["simple_content"]
+            bitstream_encoding = fields["bitstream_encoding"]
+            bitstream_data = fields["bitstream_data"]
 
             splunk_event = splunk_event + index_time + host + \
                             process + queue_manager_name_str + queue_str + \
-                            broker + exec_group + flow + node_details + \
+                            event_fields + \
                             complex_content + simple_content + \
-                            event_file_name + bitstream_encoding + \
+                            event_location + bitstream_encoding + \
                             bitstream_data
             print_xml_single_instance_mode(splunk_host, splunk_event,event_time=event_time, name=name, queue_manager=queue_manager_name,queue=queue)
 
         except Exception as ex:
             logging.error("Exception occured! Exception:" + str(ex))
             splunk_event = splunk_event + index_time + host + process + \
-                queue_manager_name_str + queue_str + event_file_name + \
+                queue_manager_name_str + queue_str + event_location + \
                 ' error="Exception occured while processing event. Exception Text: %s"' % (str(ex))
             print_xml_single_instance_mode(splunk_host, splunk_event, event_time=event_time, name=name, queue_manager=queue_manager_name,queue=queue)
 
 
+def first_xpath_value(result):
+    '''Return the first value of an XPath result as a string or None if
+       the result is empty.
+    '''
+    if isinstance(result, list):
+        if not result:
+            return None
+        result = result[0]
+        if lxml.etree.iselement(result):
+            return result.text
+    return str(result)
+
+
 #####################################
 # Channel Status Response handlers
 #####################################
@@ -1057,7 +1347,7 @@ MQCHSSTATE_COMPRESSING = 1800
 
                 channel_name = \
                     channel_info[pymqi.CMQCFC.MQCACH_CHANNEL_NAME].strip()
-                logging.debug("Doing channel status for channel [%s]" %
+                logging.debug("Doing channel status for channel [%s]",
                               channel_name)
 
                 conf_channel_str = ""
@@ -1337,6 +1627,91 @@ MQCHSSTATE_COMPRESSING = 1800
                 print_xml_single_instance_mode(splunk_host, splunk_event)
 
 
+class TagExtractor(object):
+    """
+    Extracts the text between <Tag> and </Tag> for a set of tags in one scan
+    of a message.  The start tags are found with a single compiled
+    alternation regex.  Only the first value is collected for the
+    first_only_tags and every value for the all_tags.  A value ends at the
+    first end tag of its tag, and the next value is searched for after that
+    end tag, so values of the same tag do not overlap.  A start tag without
+    an end tag is logged and skipped.
+    """
+
+    def __init__(self, first_only_tags, all_tags):
+        self.first_only_tags = set(first_only_tags)
+        self.tags = list(first_only_tags) + list(all_tags)
+        self.end_tags = ["</%s>" % t for t in self.tags]
+        self.end_tags_bytes = [t.encode("ascii") for t in self.end_tags]
+        # one group per tag so match.lastindex identifies the tag.
+        pattern = "<(?:%s)>" % "|".join(
+            ["(%s)" % re.escape(t) for t in self.tags])
+        self.start_re = re.compile(pattern)
+        self.start_re_bytes = re.compile(pattern.encode("ascii"))
+
+    def extract(self, text, regions=None, encoding="utf-8"):
+        """Return a dict of tag name to the list of values found.
+
+        text may be a str or bytes.  regions is a list of (start, end)
+        offsets to scan and defaults to the whole of text.  Values found in
+        bytes are decoded with encoding.
+        """
+        if isinstance(text, str):
+            start_re = self.start_re
+            end_tags = self.end_tags
+        else:
+            start_re = self.start_re_bytes
+            end_tags = self.end_tags_bytes
+
+        if regions is None:
+            regions = [(0, len(text))]
+
+        values = dict([(t, []) for t in self.tags])
+        next_pos = {}
+        first_only_left = len(self.first_only_tags)
+        only_first_only = first_only_left == len(self.tags)
+
+        for (region_start, region_end) in regions:
+            for match in start_re.finditer(text, region_start, region_end):
+                index = match.lastindex - 1
+                tag = self.tags[index]
+                start_pos = match.start()
+                if start_pos < next_pos.get(tag, 0):
+                    continue
+                first_only = tag in self.first_only_tags
+                if first_only and values[tag]:
+                    continue
+
+                end_pos = text.find(end_tags[index], start_pos + 1, region_end)
+                if end_pos > 0:
+                    value = text[match.end():end_pos]
+                    if not isinstance(value, str):
+                        value = value.decode(encoding, "replace")
+                    values[tag].append(value)
+                    next_pos[tag] = end_pos
+                    if first_only:
+                        first_only_left = first_only_left - 1
+                        if first_only_left == 0 and only_first_only:
+                            return values
+                else:
+                    logging.error("End tag expected. TagName: %s MsgData: %s " %
+                                  (str(tag), repr(text[start_pos:start_pos + 100])))
+
+        return values
+
+
+# tags extracted from broker error messages and the event field names.
+ERROR_MESSAGE_FIELDS = [("Timestamp", "error_timestamp"),
+                        ("BrokerName", "broker"),
+                        ("ExecutionGroupName", "execution_group"),
+                        ("MessageFlowLabel", "flow"),
+                        ("SourceQueue", "source_queue"),
+                        ("ReplyToQ", "replyto_queue"),
+                        ("ReplyProtocol", "reply_protocol"),
+                        ("MessageFormat", "message_format"),
+                        ("CodedCharSetId", "message_ccsid")]
+
+
 class ErrorQueueResponseHandler(object):
     """
     Custom XML Error message format. 
@@ -1352,15 +1727,16 @@ class ErrorQueueResponseHandler(object):
     use_mqmd_puttime=true/false
     blob_limit=1024
     make_mqmd_printable=true/false
+    mqmd_fields=MsgId|CorrelId
     write_messages_folder=/some/folder
     write_messages=true/false
     gzip_messages=true/false
+    archive_segment_size=67108864
 
     """
     def __init__(self,**args):
 
         self.args = args
-        self.mqmd_dicts = None
 
         self.include_mqmd = False
         if "include_mqmd" in self.args:
@@ -1375,23 +1751,6 @@ class ErrorQueueResponseHandler(object):
         if "pretty_mqmd" in self.args:
             if self.args["pretty_mqmd"].strip().lower() == "true":
                 self.pretty_mqmd = True
-
-                mqmd_dict = pymqi._MQConst2String(CMQC, "MQMD_")
-                mqro_dict = pymqi._MQConst2String(CMQC, "MQRO_")
-                mqmt_dict = pymqi._MQConst2String(CMQC, "MQMT_")
-                mqei_dict = pymqi._MQConst2String(CMQC, "MQEI_")
-                mqfb_dict = pymqi._MQConst2String(CMQC, "MQFB_")
-                mqenc_dict = pymqi._MQConst2String(CMQC, "MQENC_")
-                mqccsi_dict = pymqi._MQConst2String(CMQC, "MQCCSI_")
-                mqfmt_dict = pymqi._MQConst2String(CMQC, "MQFMT_")
-                mqpri_dict = pymqi._MQConst2String(CMQC, "MQPRI_")
-                mqper_dict = pymqi._MQConst2String(CMQC, "MQPER_")
-                mqat_dict = pymqi._MQConst2String(CMQC, "MQAT_")
-                mqmf_dict = pymqi._MQConst2String(CMQC, "MQMF_")
-                mqol_dict = pymqi._MQConst2String(CMQC, "MQOL_")
-
-                self.mqmd_dicts = {"mqmd": mqmd_dict, "mqro": mqro_dict, "mqmt": mqmt_dict, "mqei": mqei_dict, "mqfb": mqfb_dict, "mqenc": mqenc_dict, "mqccsi": mqccsi_dict,"mqfmt": mqfmt_dict, "mqpri": mqpri_dict, "mqper": mqper_dict, "mqat": mqat_dict, "mqmf": mqmf_dict, "mqol": mqol_dict}
-
             else:
                 self.pretty_mqmd = False
         else:
@@ -1450,13 +1809,22 @@ class ErrorQueueResponseHandler(object):
                 self.blob_limit = 65536
         else:
             self.blob_limit = 65536
+        # the BLOB is hex encoded so only log whole bytes.
+        self.blob_limit = self.blob_limit + self.blob_limit % 2
 
         self.make_mqmd_printable = False
         if "make_mqmd_printable" in self.args:
-            self.make_mqmd_printable = self.args["make_mqmd_printable"].lower().strip()
+            if self.args["make_mqmd_printable"].lower().strip() == "true":
+                self.make_mqmd_printable = True
+            else:
+                self.make_mqmd_printable = False
         else:
             self.make_mqmd_printable = False
 
+        self.mqmd_renderer = MQMDRenderer(self.pretty_mqmd,
+                                          self.make_mqmd_printable,
+                                          parse_mqmd_fields(self.args))
+
         self.write_messages = True
         if "write_messages" in self.args:
             if self.args["write_messages"].lower().strip() == "false":
@@ -1479,116 +1847,93 @@ class ErrorQueueResponseHandler(object):
         if "write_messages_folder" in self.args:
             self.write_messages_folder = self.args["write_messages_folder"]
 
+        self.archive_segment_size = 67108864
+        if "archive_segment_size" in self.args:
+            try:
+                self.archive_segment_size = int(self.args["archive_segment_size"].strip())
+            except:
+                self.archive_segment_size = 67108864
 
-    def extract_values(self, msg_data, tag_name, first_only=False, reverse=False):
-        done = False
-        start_pos = 0
-        end_pos = 0
-        #value = ""
-        start_tag = "<%s>" % tag_name
-        end_tag = "</%s>" % tag_name
-        values = []
-        while not done:
+        self.archive = None
+        if self.write_messages:
+            self.archive = get_archive_writer(self.write_messages_folder, "ErrorMessage",
+                                              compress=self.gzip_messages,
+                                              max_segment_bytes=self.archive_segment_size)
 
-            start_pos = msg_data.find(start_tag, start_pos)
-            if start_pos >= 0:
-                end_pos = msg_data.find(end_tag, start_pos + 1)
-                if end_pos > 0:
-                    #value = value + msg_data[start_pos + len(start_tag):end_pos] + "|"
-                    if reverse:
-                        values = [msg_data[start_pos + len(start_tag):end_pos]] + values
-                    else:
-                        values.append(msg_data[start_pos + len(start_tag):end_pos])
+        first_only_tags = [t for (t, f) in ERROR_MESSAGE_FIELDS]
+        if self.extract_message_header:
+            first_only_tags.append("MessageHeader")
+        self.tag_extractor = TagExtractor(first_only_tags,
+                                          ["MessageText", "Text"])
 
-                    if first_only:
-                        done = True
-                    start_pos = end_pos
-                else:
-                    logging.error("End tag expected. TagName: %s MsgData: %s " % (str(tag_name), str(msg_data)[0:100]))
-                    start_pos = start_pos + 1
-            else:
-                done = True
 
-        return values
+    def message_regions(self, msg_data):
+        """
+        Return the (start, end, is_blob) offsets of the parts of msg_data
+        that are logged.  Without include_blob only the <BLOB> and </BLOB>
+        tags are kept, otherwise the first blob_limit characters of the BLOB
+        are kept too.
+        """
+        if isinstance(msg_data, str):
+            (start_tag, end_tag) = ("<BLOB>", "</BLOB>")
+        else:
+            (start_tag, end_tag) = (b"<BLOB>", b"</BLOB>")
+
+        blob_start = msg_data.find(start_tag)
+        if blob_start < 0:
+            return [(0, len(msg_data), False)]
+
+        blob_data_start = blob_start + len(start_tag)
+        blob_end = msg_data.find(end_tag, blob_data_start)
+        if blob_end < 0:
+            blob_end = len(msg_data)
+
+        regions = [(0, blob_data_start, False)]
+        if self.include_blob:
+            blob_limit = min(self.blob_limit, blob_end - blob_data_start)
+            regions.append((blob_data_start, blob_data_start + blob_limit,
+                            True))
+        regions.append((blob_end, len(msg_data), False))
+        return regions
+
+    def logged_message(self, msg_data, regions):
+        """Return the logged parts of msg_data as one string."""
+        if isinstance(msg_data, str):
+            return "".join([msg_data[start:end] for (start, end, b) in regions])
+
+        view = memoryview(msg_data)
+        return b"".join([view[start:end] for (start, end, b) in regions]).decode("utf-8", "replace")
 
     def __call__(self, splunk_host, name, queue_manager_name, queue, msg_data, msg_desc, **kw):
 
         splunk_event = ""
-        logging.debug("ErrorQueueResponseHandler in  __call__()")
         queue_manager_name_str = " queue_manager=%s" % queue_manager_name
         queue_str = " queue=%s" % queue
         host = " " + splunk_host
         process = " mqinput(%i):" % os.getpid()
-        msg_id = " message_id=%s" % binascii.hexlify(msg_desc["MsgId"])
-        message_file_name = ""
+        msg_id_hex = binascii.hexlify(msg_desc["MsgId"]).decode("ascii")
+        msg_id = " message_id=%s" % msg_id_hex
+        message_location = ""
         #event_time = None
 
         mqmd_str = ""
         if self.include_mqmd and (msg_desc is not None):
-            new_mqmd = make_mqmd(msg_desc, self.mqmd_dicts, self.pretty_mqmd, self.make_mqmd_printable)
-            for (mqmd_key, mqmd_value) in list(new_mqmd.items()):
-                if isinstance(mqmd_value, int) or isinstance(mqmd_value, float) or str(mqmd_value).startswith("MQ"):
-                    mqmd_str = mqmd_str + " %s=%s" % (str(mqmd_key).strip(), str(mqmd_value))
-                else:
-                    mqmd_str = mqmd_str + ' %s="%s"' % (str(mqmd_key).strip(), str(mqmd_value))
+            mqmd_str = self.mqmd_renderer(msg_desc)
 
-        index_time_o = datetime.datetime.now()
-        index_time = "[" + index_time_o.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + " " + time.strftime("%z") + "]"
         if self.use_mqmd_puttime:
-            puttime = datetime.datetime.strptime(msg_desc["PutDate"].decode("ascii") + " " + msg_desc["PutTime"][0:6].decode("ascii"), "%Y%m%d %H%M%S")
-
-            index_time_o = puttime - datetime.timedelta(seconds=time.timezone)
-
-            h_secs = msg_desc["PutTime"][6:]
-            index_time = "[" + index_time_o.strftime("%Y-%m-%d %H:%M:%S") + "." + h_secs + "0 " +  time.strftime("%z") + "]"
-            
-            #event_time = str(index_time_o.timestamp())
+            index_time = "[" + TIMESTAMP_SERVICE.put_time(msg_desc["PutDate"], msg_desc["PutTime"])[1] + "]"
+        else:
+            index_time = "[" + TIMESTAMP_SERVICE.now() + "]"
 
 
         if self.write_messages:
             try:
-                date_s = time.strftime("%Y%m%d")
-                cur_folder = os.path.join(os.path.join(os.path.join(self.write_messages_folder, queue_manager_name), queue), date_s)
-
-                if not os.path.exists(cur_folder):
-                    os.makedirs(cur_folder)
-
-                file_name = "ErrorMessage_" +  binascii.hexlify(msg_desc["MsgId"]) + ".xml"
-                full_file_name = os.path.join(cur_folder, file_name)
-                if self.gzip_messages:
-                    f = gzip.open(full_file_name + ".gz", 'wb')
-                    f.write(msg_data)
-                    f.close()
-                else:
-                    f = open(full_file_name, "w")
-                    f.write(msg_data)
-                    f.close()
-                message_file_name = ' message_file_name="%s"'  % full_file_name
+                (segment, offset, length) = self.archive.write(queue_manager_name, queue, msg_id_hex, msg_data)
+                message_location = ' message_segment="%s" message_offset=%i message_length=%i' % (segment, offset, length)
             except Exception as ex:
                 logging.error("Failed to write error message. " + str(ex))
 
-        new_msg_data = ""
-
-        blob_start = msg_data.find("<BLOB>")
-        blob_end = msg_data.find("</BLOB>", blob_start)
-
-        blob_len = blob_end - blob_start + 6
-
-        if self.include_blob:
-            mod_blob_limit = self.blob_limit % 2
-
-            if mod_blob_limit > 0:
-                self.blob_limit = self.blob_limit + 1
-
-                if self.blob_limit > blob_len:
-                    self.blob_limit = blob_len
-
-            new_msg_data = msg_data[:blob_start + 6 + self.blob_limit] + msg_data[blob_end:]
-
-        else:
-            new_msg_data = msg_data[:blob_start + 6] + msg_data[blob_end:]
-
-
+        regions = self.message_regions(msg_data)
 
         #logging.debug("extract elements?")
         if self.extract_elements:
@@ -1597,113 +1942,58 @@ class ErrorQueueResponseHandler(object):
 
             try:
 
-                timestamp = ""
-                nl = self.extract_values(new_msg_data, "Timestamp", first_only=True)
-                if len(nl) > 0:
-                    timestamp = ' error_timestamp="%s"' % nl[0]
-
-                broker = ""
-                nl = self.extract_values(new_msg_data,"BrokerName", first_only=True)
-                if len(nl) > 0:
-                    broker = ' broker="%s"' % nl[0]
-                #logging.debug("extracted brokername")
-                eg = ""
-                nl = self.extract_values(new_msg_data,"ExecutionGroupName",first_only=True)
-                if len(nl) > 0:
-                    eg = ' execution_group="%s"' % nl[0]
-
-                flow = ""
-                nl = self.extract_values(new_msg_data,"MessageFlowLabel",first_only=True)
-                if len(nl) > 0:
-                    flow = ' flow="%s"' % nl[0]
-
+                # the BLOB is never searched for fields.
+                values = self.tag_extractor.extract(
+                    msg_data, [(start, end) for (start, end, is_blob)
+                               in regions if not is_blob])
 
-                source_q = ""
-                nl = self.extract_values(new_msg_data,"SourceQueue",first_only=True)
-                if len(nl) > 0:
-                    source_q = ' source_queue="%s"' % nl[0]
-
-                r2_q = ""
-                nl = self.extract_values(new_msg_data,"ReplyToQ",first_only=True)
-                if len(nl) > 0:
-                    r2_q = ' replyto_queue="%s"' % nl[0]
-                #logging.debug("extracted r2q")
-                r2_proto = ""
-                nl = self.extract_values(new_msg_data,"ReplyProtocol",first_only=True)
-                if len(nl) > 0:
-                    r2_proto = ' reply_protocol="%s"' % nl[0]
-
-                msg_fmt = ""
-                nl = self.extract_values(new_msg_data,"MessageFormat",first_only=True)
-                if len(nl) > 0:
-                    msg_fmt = ' message_format="%s"' % nl[0]
-
-                msg_ccsid = ""
-                nl = self.extract_values(new_msg_data,"CodedCharSetId",first_only=True)
-                if len(nl) > 0:
-                    msg_ccsid = ' message_ccsid="%s"' % nl[0]
+                fields = []
+                for (tag, field) in ERROR_MESSAGE_FIELDS:
+                    if values[tag]:
+                        fields.append(' %s="%s"' % (field, values[tag][0]))
 
                 msg_hdr = ""
-                if self.extract_message_header:
-                    nl = self.extract_values(new_msg_data,"MessageHeader",first_only=True)
-                    if len(nl) > 0:
-                        msg_hdr = ' message_header="<MessageHeader>%s</MessageHeader>"' % nl[0].replace('"', "'")
-
+                if self.extract_message_header and values["MessageHeader"]:
+                    msg_hdr = ' message_header="<MessageHeader>%s</MessageHeader>"' % values["MessageHeader"][0].replace('"', "'")
 
-                #logging.debug("extracting messagetext")
                 message_texts = ""
-                nl = self.extract_values(new_msg_data,"MessageText",first_only=False)
-
-                temp_msg_txt = ""
+                nl = values["MessageText"]
                 if len(nl) > 0:
-                    #message_texts = " message_text="
-                    for n in nl:
-                        temp_msg_txt = temp_msg_txt + n.replace('"', "'").replace("||", "+") + "|"
-                        #temp_msg_txt = temp_msg_txt + ' message_text="%s"' % n.text.replace('"', "'")
-                    if temp_msg_txt[-1:] == "|":
-                        temp_msg_txt = temp_msg_txt[:-1]
-
+                    temp_msg_txt = "|".join([n.replace('"', "'").replace("||", "+") for n in nl])
                     if temp_msg_txt[0:1] == "|":
                         temp_msg_txt = temp_msg_txt[1:]
 
                     message_texts = ' message_text="%s"' % temp_msg_txt
-                    #message_texts = temp_msg_txt
-
-
 
                 txt_elements = ""
-                nl = self.extract_values(new_msg_data,"Text", first_only=False)
+                nl = values["Text"]
                 if len(nl) > 0:
-                    #txt_elements = " text_elements="
-                    tmp_el = ""
-                    for n in nl:
-                        if self.filter_text_elements:
-
+                    texts = []
+                    if self.filter_text_elements:
+                        for n in nl:
                             try:
                                 dummy_float = float(n)
                             except:
                                 if n.find("rethrowing") <= 0:
-                                    tmp_el = n.replace('"', "'").replace("||", "+").replace("|", "+") + "|" + tmp_el
-                                    #tmp_el = ' exception_text="%s"' % n.text.replace('"', "'") + tmp_el
-
-                    if tmp_el[-1:] == "|":
-                        tmp_el = tmp_el[:-1]
+                                    texts.append(n.replace('"', "'").replace("||", "+").replace("|", "+"))
 
+                    # the text elements are logged innermost first.
+                    texts.reverse()
+                    tmp_el = "|".join(texts)
                     if tmp_el[0:1] == "|":
                         tmp_el = tmp_el[1:]
 
                     txt_elements = ' exception_text="%s"' % tmp_el
-                    #txt_elements = tmp_el
-                payload = timestamp + broker + eg + flow + source_q + r2_q + r2_proto + msg_fmt + msg_ccsid + msg_hdr + message_texts + txt_elements
+                payload = "".join(fields) + msg_hdr + message_texts + txt_elements
 
             except Exception as ex:
                 logging.error("XML parsing error.  Including whole message." + str(ex))
-                payload = ' xmlparsingfail="true" payload="%s"' %  new_msg_data
+                payload = ' xmlparsingfail="true" payload="%s"' % self.logged_message(msg_data, regions)
         else:
 
-            payload = ' extractfields="false" payload="%s"' %  new_msg_data
+            payload = ' extractfields="false" payload="%s"' % self.logged_message(msg_data, regions)
 
-        splunk_event = splunk_event + index_time + host + process + queue_manager_name_str +  queue_str + msg_id + message_file_name +  mqmd_str + payload
+        splunk_event = splunk_event + index_time + host + process + queue_manager_name_str +  queue_str + msg_id + message_location +  mqmd_str + payload
         print_xml_single_instance_mode(splunk_host, splunk_event, event_time=None, name=name, queue_manager=queue_manager_name,queue=queue)
 
 
@@ -1726,6 +2016,9 @@ class BrokerJSONResourceStats(object):
         log_as_syslog=false/true - Log as a syslog type message instead of pure json.
         Default: false
 
+        separate_into_events=false/true - Log one event per
+        resourceIdentifier.  Default: true
+
     """
 
     def __init__(self, **args):
@@ -1774,41 +2067,60 @@ class BrokerJSONResourceStats(object):
             self.separate_into_events = True            
 
 
+    def json_start_time(self, j_obj):
+        """Return the start time of the statistics as the event time."""
+        try:
+            puttime = datetime.datetime.strptime(j_obj["ResourceStatistics"]["startDate"] +
+                                                 " " +
+                                                 j_obj["ResourceStatistics"]["startTime"],
+                                                 "%Y-%m-%d %H:%M:%S")
+            return puttime.strftime("%Y-%m-%d %H:%M:%S") + ".000 +0200"
+        except Exception as ex:
+            logging.error("Exception occured. " + str(ex))
+            return ""
+
+    def resource_events(self, j_obj, prefix):
+        """
+        Yield one JSON event per resourceIdentifier.  The ResourceStatistics
+        envelope without the ResourceType list is serialized once and
+        shared by all the events.  prefix is the start of every event and
+        either "{" or the time element.
+        """
+        rs = j_obj["ResourceStatistics"]
+        envelope = dict([(k, v) for (k, v) in rs.items()
+                         if k not in ("ResourceType", "resourceType",
+                                      "resourceStatistics")])
+        envelope_str = json.dumps(envelope)[1:-1]
+        if envelope_str:
+            prefix = prefix + envelope_str + ", "
+
+        for rt in rs["ResourceType"]:
+            type_prefix = prefix + '"resourceType": ' + json.dumps(rt["name"]) + \
+                ', "resourceStatistics": '
+            for ri in rt["resourceIdentifier"]:
+                yield type_prefix + json.dumps(ri) + "}"
+
     def __call__(self, splunk_host, name, queue_manager_name, queue, msg_data,
                  msg_desc, **kw):
 
-        splunk_event = ""
-        #logging.error("default queue handler _call_")
-        #mqmd_str = ""
-        #event_time = None
-      
-        splunk_event = ""
+        if not isinstance(msg_data, str):
+            msg_data = msg_data.decode("utf-8", "replace")
+
         payload = ""
         pos = msg_data.find('{"ResourceStatistics')
         if pos > 0:
             payload = msg_data[pos:]
         else:
-            payload = msg_data[:]
+            payload = msg_data
 
         if self.log_as_syslog:
 
-            index_time = "[" + \
-                        datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + \
-                        " " + time.strftime("%z") + "]"
-
             if self.use_mqmd_puttime:
-                puttime = datetime.datetime.strptime(msg_desc["PutDate"].decode("ascii") +
-                                                    " " +
-                                                    msg_desc["PutTime"][0:6].decode("ascii"),
-                                                    "%Y%m%d %H%M%S")
-                # puttime = puttime.replace(tzinfo=pytz.timezone("GMT"))
-                localtime = puttime - datetime.timedelta(seconds=time.timezone)
-
-                h_secs = msg_desc["PutTime"][6:].decode("ascii")
-                index_time = "[" + localtime.strftime("%Y-%m-%d %H:%M:%S") + \
-                            "." + h_secs + "0 " + \
-                            time.strftime("%z") + "]"
-                #event_time = str(localtime.timestamp)
+                index_time = "[" + \
+                    TIMESTAMP_SERVICE.put_time(msg_desc["PutDate"],
+                                               msg_desc["PutTime"])[1] + "]"
+            else:
+                index_time = "[" + TIMESTAMP_SERVICE.now() + "]"
 
 
             queue_manager_name_str = " queue_manager=%s" % queue_manager_name
@@ -1816,72 +2128,36 @@ class BrokerJSONResourceStats(object):
             host = " " + splunk_host
             process = " mqinput(%i):" % os.getpid()
 
-            splunk_event = splunk_event + index_time + host + process + \
+            splunk_event = index_time + host + process + \
                             queue_manager_name_str + queue + \
                             payload
             
             print_xml_single_instance_mode(splunk_host, splunk_event, event_time=None, name=name, queue_manager=queue_manager_name,queue=queue)
         else:
-            
+
+            # the message is parsed at most once.
+            j_obj = None
+            if self.separate_into_events or (self.add_time_element and
+                                             self.use_json_start_time and
+                                             not self.use_mqmd_puttime):
+                j_obj = json.loads(payload)
+
+            prefix = "{"
             if self.add_time_element:
-                index_time = ""
                 if self.use_mqmd_puttime:
-                    puttime = datetime.datetime.strptime(msg_desc["PutDate"].decode("ascii") +
-                                                 " " +
-                                                 msg_desc["PutTime"][0:6].decode("ascii"),
-                                                 "%Y%m%d %H%M%S")
-                    # puttime = puttime.replace(tzinfo=pytz.timezone("GMT"))
-                    localtime = puttime - datetime.timedelta(seconds=time.timezone)
-
-                    h_secs = msg_desc["PutTime"][6:].decode("ascii")
-                    index_time = localtime.strftime("%Y-%m-%d %H:%M:%S") + \
-                                "." + h_secs + "0 " + \
-                                time.strftime("%z")
+                    index_time = TIMESTAMP_SERVICE.put_time(
+                        msg_desc["PutDate"], msg_desc["PutTime"])[1]
+                elif self.use_json_start_time:
+                    index_time = self.json_start_time(j_obj)
                 else:
-                    if self.use_json_start_time:
-                        try:
-                            j_obj = json.loads(payload)
-                            puttime = datetime.datetime.strptime(j_obj["ResourceStatistics"]["startDate"] +
-                                                    " " +
-                                                    j_obj["ResourceStatistics"]["startTime"],
-                                                    "%Y-%m-%d %H:%M:%S")
-                            # puttime = puttime.replace(tzinfo=pytz.timezone("GMT"))
-                            #localtime = puttime - datetime.timedelta(seconds=time.timezone)
-                           
-                            index_time = puttime.strftime("%Y-%m-%d %H:%M:%S") + \
-                            ".000 +0200"
-                        except Exception as ex:
-                            logging.error("Exception occured. " + str(ex)) 
+                    index_time = TIMESTAMP_SERVICE.now()
+                prefix = '{"time": "%s",' % index_time
 
-                    else:
-                        index_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + \
-                                    " " + time.strftime("%z")
-                
-                if self.separate_into_events:
-                    j_obj = json.loads(payload)
-
-                    rs = copy.deepcopy(j_obj["ResourceStatistics"])
-                    del(rs["ResourceType"])
-
-                    for rt in j_obj["ResourceStatistics"]["ResourceType"]:
-                        #new_rs = copy.deepcopy(rs)
-                        #new_rs["resourceType"] = rt["name"]
-                        
-                        for ri in rt["resourceIdentifier"]:
-                            new_rs = copy.deepcopy(rs)
-                            new_rs["resourceType"] = rt["name"]
-                            new_rs["resourceStatistics"] = ri
-                            payload = json.dumps(new_rs)
-                            if payload.startswith("{"):
-                                payload = '{"time": "%s",' % index_time + payload[1:]
-            
-                            splunk_event = splunk_event + payload
-                            print_xml_single_instance_mode(splunk_host, splunk_event, event_time=None, name=name, queue_manager=queue_manager_name,queue=queue)    
-                else:
-                
-                    if payload.startswith("{"):
-                        payload = '{"time": "%s",' % index_time + payload[1:]
-            
-                    splunk_event = splunk_event + payload
-                    print_xml_single_instance_mode(splunk_host, splunk_event, event_time=None, name=name, queue_manager=queue_manager_name,queue=queue)    
-    
+            if self.separate_into_events:
+                for splunk_event in self.resource_events(j_obj, prefix):
+                    print_xml_single_instance_mode(splunk_host, splunk_event, event_time=None, name=name, queue_manager=queue_manager_name,queue=queue)
+            else:
+                if payload.startswith("{"):
+                    payload = prefix + payload[1:]
+
+                print_xml_single_instance_mode(splunk_host, payload, event_time=None, name=name, queue_manager=queue_manager_name,queue=queue)
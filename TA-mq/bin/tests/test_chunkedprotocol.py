@@ -0,0 +1,133 @@
+'''
+IBM Websphere MQ Modular Input for Splunk
+Hannes Wagener - 2015
+
+Tests of the chunked search command protocol.
+
+DISCLAIMER
+You are free to use this code in any way you like, subject to the
+Python & IBM disclaimers & copyrights. I make no representations
+about the suitability of this software for any purpose. It is
+provided "AS-IS" without warranty of any kind, either express or
+implied.
+
+'''
+import io
+import json
+import unittest
+
+import chunkedprotocol
+
+
+def chunk(metadata, body=""):
+    metadata = json.dumps(metadata).encode("utf-8")
+    body = body.encode("utf-8")
+    return b"chunked 1.0,%i,%i\n" % (len(metadata), len(body)) + \
+        metadata + body
+
+
+def getinfo(*args):
+    return chunk({"action": "getinfo", "searchinfo": {"args": list(args)}})
+
+
+def execute(body, finished=False):
+    return chunk({"action": "execute", "finished": finished}, body)
+
+
+def replies(stdout):
+    stream = io.BytesIO(stdout.getvalue())
+    chunks = []
+    while True:
+        reply = chunkedprotocol.read_chunk(stream)
+        if reply is None:
+            return chunks
+        chunks.append(reply)
+
+
+def run(stdin, process, parse_args=None):
+    stdout = io.BytesIO()
+    chunkedprotocol.run_chunked_command(process, parse_args,
+                                        stdin=io.BytesIO(stdin),
+                                        stdout=stdout)
+    return replies(stdout)
+
+
+class RunChunkedCommandTest(unittest.TestCase):
+
+    def test_results_are_returned_with_the_added_fields(self):
+        chunks = []
+
+        def process(results, messages):
+            chunks.append([dict(res) for res in results])
+            for res in results:
+                res["payload"] = (u"<msg id=\"%s\">\u00e9,\n</msg>" %
+                                  res["id"]).encode("utf-8")
+            messages.append(("INFO", "%i results" % len(results)))
+            return results
+
+        stdin = getinfo("decodebitstream=true") + \
+            execute('id,_raw\n1,"a, ""quoted"" event"\n2,"two\nlines"\n') + \
+            execute("id,_raw\n3,last\n", finished=True)
+
+        result = run(stdin, process)
+
+        self.assertEqual(
+            [[{"id": "1", "_raw": 'a, "quoted" event'},
+              {"id": "2", "_raw": "two\nlines"}],
+             [{"id": "3", "_raw": "last"}]], chunks)
+        self.assertEqual(3, len(result))
+        self.assertEqual(({"type": "stateful"}, ""), result[0])
+
+        for (i, finished, ids) in [(1, False, ["1", "2"]),
+                                   (2, True, ["3"])]:
+            (metadata, body) = result[i]
+            self.assertEqual(
+                {"finished": finished,
+                 "inspector": {"messages": [["INFO",
+                                             "%i results" % len(ids)]]}},
+                metadata)
+            (fields, results) = chunkedprotocol.read_results(body)
+            self.assertEqual(["id", "_raw", "payload"], fields)
+            self.assertEqual(ids, [res["id"] for res in results])
+            for res in results:
+                self.assertEqual(u"<msg id=\"%s\">\u00e9,\n</msg>" %
+                                 res["id"], res["payload"])
+
+    def test_invalid_arguments_are_reported(self):
+        calls = []
+
+        def parse_args(args):
+            calls.append(args)
+            raise ValueError("Invalid argument.")
+
+        def process(results, messages):
+            self.fail("process must not be called")
+
+        stdin = getinfo("bogus=1") + execute("id\n1\n", finished=True)
+
+        result = run(stdin, process, parse_args)
+
+        self.assertEqual([["bogus=1"]], calls)
+        self.assertEqual(
+            [({"finished": True,
+               "inspector": {"messages": [["ERROR", "Invalid argument."]]}},
+              "")], result)
+
+    def test_process_errors_are_reported(self):
+        def process(results, messages):
+            raise KeyError("payload")
+
+        result = run(getinfo() + execute("id\n1\n", finished=True), process)
+
+        (metadata, body) = result[1]
+        self.assertTrue(metadata["finished"])
+        self.assertEqual("ERROR", metadata["inspector"]["messages"][0][0])
+        # the results are returned unchanged.
+        self.assertEqual("id\n1\n", body)
+
+    def test_empty_input(self):
+        self.assertEqual([], run(b"", lambda results, messages: results))
+
+
+if __name__ == "__main__":
+    unittest.main()
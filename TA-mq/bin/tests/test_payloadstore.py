@@ -0,0 +1,192 @@
+'''
+IBM Websphere MQ Modular Input for Splunk
+Hannes Wagener - 2015
+
+Tests of the payload store used by the search commands.
+
+DISCLAIMER
+You are free to use this code in any way you like, subject to the
+Python & IBM disclaimers & copyrights. I make no representations
+about the suitability of this software for any purpose. It is
+provided "AS-IS" without warranty of any kind, either express or
+implied.
+
+'''
+import base64
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import zlib
+
+try:
+    import mongomock
+    from bson.objectid import ObjectId
+except ImportError:
+    mongomock = None
+
+import payloadstore
+
+
+def encode_mongodb_payload(payload):
+    return base64.b64encode(zlib.compress(payload))
+
+
+class FindRecorder(object):
+    """
+    Wraps a mongomock database and records the filter of every find.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.finds = []
+
+    def __getitem__(self, collection):
+        recorder = self
+        target = self.db[collection]
+
+        class Collection(object):
+            def find(self, *args, **kw):
+                recorder.finds.append((collection, args[0]))
+                return target.find(*args, **kw)
+
+        return Collection()
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class FetchMongoDBPayloadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient()["mqinput"]
+
+    def insert(self, collection, payload):
+        msg_id = ObjectId()
+        self.db[collection].insert_one(
+            {"_id": msg_id, "msg_data": encode_mongodb_payload(payload)})
+        return str(msg_id)
+
+    def test_payloads_are_returned_in_key_order(self):
+        keys = []
+        for i in range(10):
+            collection = "QM1.Q%i" % (i % 3)
+            keys.append((collection, self.insert(collection, b"msg %i" % i)))
+        keys.reverse()
+        # a key may appear more than once.
+        keys.append(keys[0])
+
+        payloads = payloadstore.fetch_mongodb_payloads(self.db, keys)
+
+        expected = [b"msg %i" % i for i in reversed(range(10))]
+        self.assertEqual(expected + [b"msg 9"], payloads)
+
+    def test_missing_and_invalid_ids_are_none(self):
+        msg_id = self.insert("QM1.Q", b"found")
+        keys = [None,
+                ("QM1.Q", None),
+                ("QM1.Q", "not an id"),
+                ("QM1.Q", "zzzzzzzzzzzzzzzzzzzzzzzz"),
+                ("QM1.Q", str(ObjectId())),
+                ("QM1.OTHER", msg_id),
+                ("QM1.Q", msg_id)]
+
+        payloads = payloadstore.fetch_mongodb_payloads(self.db, keys)
+
+        self.assertEqual([None] * 6 + [b"found"], payloads)
+
+    def test_undecodable_payload_is_none(self):
+        msg_id = ObjectId()
+        self.db["QM1.Q"].insert_one({"_id": msg_id, "msg_data": "garbage"})
+        keys = [("QM1.Q", str(msg_id)), ("QM1.Q", self.insert("QM1.Q", b"ok"))]
+
+        payloads = payloadstore.fetch_mongodb_payloads(self.db, keys)
+
+        self.assertEqual([None, b"ok"], payloads)
+
+    def test_ids_are_fetched_in_chunks(self):
+        keys = [("QM1.A", self.insert("QM1.A", b"a%i" % i))
+                for i in range(1201)]
+        keys.extend(("QM1.B", self.insert("QM1.B", b"b%i" % i))
+                    for i in range(3))
+        db = FindRecorder(self.db)
+
+        payloads = payloadstore.fetch_mongodb_payloads(db, keys)
+
+        self.assertEqual([b"a%i" % i for i in range(1201)] +
+                         [b"b%i" % i for i in range(3)], payloads)
+        self.assertEqual([("QM1.A", 500), ("QM1.A", 500), ("QM1.A", 201),
+                          ("QM1.B", 3)],
+                         [(collection, len(query["_id"]["$in"]))
+                          for (collection, query) in db.finds])
+
+
+class ArchiveReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def write_old_files(self, count):
+        # one file per message, half of them gzipped.  The locator names
+        # the .xml file in both cases.
+        folder = os.path.join(self.folder, "old", "QM1", "Q")
+        os.makedirs(folder)
+        items = []
+        for i in range(count):
+            payload = b"<old>%i</old>" % i
+            file_name = os.path.join(folder, "msg%i.xml" % i)
+            if i % 2:
+                f = gzip.open(file_name + ".gz", "wb")
+            else:
+                f = open(file_name, "wb")
+            f.write(payload)
+            f.close()
+            items.append(((file_name,), payload))
+        return items
+
+    def write_segments(self, count, compress):
+        writer = payloadstore.ArchiveWriter(
+            os.path.join(self.folder, "segments"), "test", compress=compress,
+            max_segment_bytes=256)
+        items = []
+        for i in range(count):
+            payload = b"<segment compress='%i'>%i</segment>" % (compress, i)
+            locator = writer.write("QM1", "Q%i" % (i % 2), "id%i" % i,
+                                   payload)
+            items.append((locator, payload))
+        writer.close()
+        self.assertEqual(0, writer.error_count)
+        return items
+
+    def test_payloads_are_returned_in_locator_order(self):
+        items = self.write_old_files(20)
+        items.extend(self.write_segments(40, True))
+        items.extend(self.write_segments(40, False))
+        missing = os.path.join(self.folder, "old", "QM1", "Q", "gone.xml")
+        items.extend([(None, None), ((missing,), None)])
+        random.Random(42).shuffle(items)
+
+        locators = [locator for (locator, payload) in items]
+        expected = [payload for (locator, payload) in items]
+        reader = payloadstore.ArchiveReader(max_workers=4)
+
+        self.assertEqual(expected, reader.read(locators))
+        # the second read comes from the cache.
+        locators.reverse()
+        expected.reverse()
+        self.assertEqual(expected, reader.read(locators))
+
+    def test_segments_are_rolled(self):
+        items = self.write_segments(40, True)
+        segments = set(locator[0] for (locator, payload) in items)
+        self.assertTrue(len(segments) > 2)
+
+        reader = payloadstore.ArchiveReader(max_workers=1, cache_bytes=0)
+        self.assertEqual([payload for (locator, payload) in items],
+                         reader.read([locator for (locator, payload) in
+                                      items]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+'''
+IBM Websphere MQ Modular Input for Splunk
+Hannes Wagener - 2015
+
+Tests of the response handlers.
+
+DISCLAIMER
+You are free to use this code in any way you like, subject to the
+Python & IBM disclaimers & copyrights. I make no representations
+about the suitability of this software for any purpose. It is
+provided "AS-IS" without warranty of any kind, either express or
+implied.
+
+'''
+import io
+import unittest
+
+try:
+    import pymqi
+    from pymqi import CMQC
+    import responsehandlers
+except ImportError:
+    pymqi = None
+
+
+@unittest.skipIf(pymqi is None, "pymqi is not installed")
+class MQMDRendererTest(unittest.TestCase):
+
+    def msg_desc(self):
+        msg_desc = pymqi.md()
+        msg_desc["MsgType"] = CMQC.MQMT_DATAGRAM
+        msg_desc["Persistence"] = CMQC.MQPER_PERSISTENT
+        msg_desc["MsgId"] = b"AMQ \x00\x01"
+        msg_desc["ReplyToQ"] = b"REPLY.Q" + b" " * 41
+        return msg_desc
+
+    def test_pretty_mqmd(self):
+        renderer = responsehandlers.MQMDRenderer(pretty_mqmd=True)
+
+        mqmd = renderer(self.msg_desc())
+
+        self.assertIn(" StrucId=MQMD_STRUC_ID", mqmd)
+        self.assertIn(" MsgType=MQMT_DATAGRAM", mqmd)
+        self.assertIn(" Persistence=MQPER_PERSISTENT", mqmd)
+        self.assertIn(' MsgId="AMQ .."', mqmd)
+        self.assertIn(' ReplyToQ="REPLY.Q"', mqmd)
+
+    def test_raw_mqmd(self):
+        renderer = responsehandlers.MQMDRenderer(pretty_mqmd=False,
+                                                 make_mqmd_printable=False)
+
+        mqmd = renderer(self.msg_desc())
+
+        self.assertIn(" MsgType=%i" % CMQC.MQMT_DATAGRAM, mqmd)
+        self.assertIn(' MsgId="414d51200001"', mqmd)
+
+    def test_default_handler_renders_the_mqmd(self):
+        sink = io.StringIO()
+        writer = responsehandlers.EventWriter(max_events=100, sink=sink)
+        original = responsehandlers.EVENT_WRITER
+        responsehandlers.EVENT_WRITER = writer
+        try:
+            handler = responsehandlers.DefaultQueueResponseHandler(
+                include_mqmd="true", log_payload_as_event="true",
+                use_mqmd_puttime="false")
+            handler("host", "mqinput://test", "QM1", "Q1", b"payload",
+                    self.msg_desc())
+            writer.flush()
+        finally:
+            responsehandlers.EVENT_WRITER = original
+
+        self.assertIn("MsgType=MQMT_DATAGRAM", sink.getvalue())
+        self.assertIn("payload=&quot;payload&quot;", sink.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()